@@ -7,6 +7,7 @@ from __future__ import annotations
 import io
 import json
 import re
+import threading
 
 import pandas as pd
 import numpy as np
@@ -20,6 +21,11 @@ import seaborn as sns
 # 日本語フォント自動設定（IPAexGothicをバンドル）
 import matplotlib_fontja  # noqa: F401
 
+from breakdown import collapse_breakdowns, detect_breakdowns
+from metrics import aggregate, format_kpi, safe_divide
+from reach_engine import estimate_reach_from_frequency
+from stats_engine import compute_kpi_intervals
+
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # スタイル設定
@@ -51,14 +57,26 @@ def _get_markers(names):
     return {n: markers[i % len(markers)] for i, n in enumerate(sorted(names))}
 
 
+def _axis_max(values) -> float:
+    """軸上限用の最大値（NaN・無限大を除外。有効値が無ければ1）"""
+    arr = np.asarray(values, dtype=float)
+    arr = arr[np.isfinite(arr)]
+    return float(arr.max()) if len(arr) > 0 and arr.max() > 0 else 1.0
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # Phase 1: データ前処理
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 def process_excel(uploaded_file) -> pd.DataFrame:
-    """Excelファイルを読み込みクリーニングする"""
+    """
+    Excelファイルを読み込みクリーニングする
+    配置・年齢・性別などのブレイクダウン列はカテゴリ型で保持する（breakdown.BREAKDOWN_COLUMNS）
+    """
     df = pd.read_excel(uploaded_file)
     df["レポート開始日"] = pd.to_datetime(df["レポート開始日"])
     df["レポート終了日"] = pd.to_datetime(df["レポート終了日"])
+    for col in detect_breakdowns(df):
+        df[col] = df[col].astype("category")
     df["is_active"] = df["消化金額 (JPY)"] > 0
     return df
 
@@ -75,22 +93,15 @@ def parse_creative_jsons(json_files: list[dict]) -> list[dict]:
         timeline = data.get("timeline_analysis", [])
 
         # タイムラインからhook/body/cta構造を推定
+        segments = _parse_segments(timeline)
         hook_sec = 0
         body_sec = 0
         cta_sec = 0
-        for seg in timeline:
-            tr = seg.get("time_range", "00:00-00:00")
-            parts = tr.split("-")
-            if len(parts) == 2:
-                start = _parse_time(parts[0])
-                end = _parse_time(parts[1])
-                dur = end - start
-            else:
-                dur = 0
-            stype = seg.get("segment_type", "")
-            if "hook" in stype:
+        for seg in segments:
+            dur = seg["end_sec"] - seg["start_sec"]
+            if seg["segment_role"] == "hook":
                 hook_sec += dur
-            elif "cta" in stype:
+            elif seg["segment_role"] == "cta":
                 cta_sec += dur
             else:
                 body_sec += dur
@@ -104,6 +115,7 @@ def parse_creative_jsons(json_files: list[dict]) -> list[dict]:
             "duration_category": "長尺" if total >= 30 else "短尺",
             "hook_strength_score": summary.get("hook_strength_score", 0),
             "primary_angle": summary.get("primary_angle", ""),
+            "hook_technique": summary.get("hook_technique", ""),
             "overall_sentiment": summary.get("overall_sentiment", ""),
             "segment_count": len(timeline),
             "hook_duration_sec": hook_sec,
@@ -111,11 +123,40 @@ def parse_creative_jsons(json_files: list[dict]) -> list[dict]:
             "cta_duration_sec": cta_sec,
             "target_audience": summary.get("target_audience", ""),
             "_raw_json": data,
+            "_filename": jf["filename"],
             "_qualitative_text": jf.get("qualitative_text", ""),
+            "_segments": segments,
         })
     return creatives
 
 
+def _parse_segments(timeline: list[dict]) -> list[dict]:
+    """timeline_analysis を秒単位のセグメント（hook/body/cta）に変換する"""
+    segments = []
+    for seg in timeline:
+        tr = seg.get("time_range", "00:00-00:00")
+        parts = tr.split("-")
+        if len(parts) == 2:
+            start = _parse_time(parts[0])
+            end = _parse_time(parts[1])
+        else:
+            start = end = 0
+        stype = seg.get("segment_type", "")
+        if "hook" in stype:
+            role = "hook"
+        elif "cta" in stype:
+            role = "cta"
+        else:
+            role = "body"
+        segments.append({
+            "segment_type": stype,
+            "segment_role": role,
+            "start_sec": start,
+            "end_sec": end,
+        })
+    return segments
+
+
 def _try_repair_json(block_text: str) -> str | None:
     """
     不正なJSON値（Geminiが出力しがちなもの）を修復する。
@@ -276,49 +317,30 @@ def _parse_time(t: str) -> int:
     return 0
 
 
-def build_summary(df: pd.DataFrame, creative_attrs: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+def prepare_active_df(df: pd.DataFrame) -> pd.DataFrame:
     """
-    日次パフォーマンスとクリエイティブ属性からサマリーテーブルを構築
-    Returns: (active_df, summary_df)
+    配信日（消化金額>0）の行だけを取り出し、日次の視聴維持率列を付与する
+    ブレイクダウン行を含む場合は先に 広告 × 日 の1行へ合算する
     """
+    df = collapse_breakdowns(df)
     active_df = df[df["is_active"]].copy()
 
     # 視聴維持率
     for col in ["動画の3秒再生数", "動画の25%再生数", "動画の50%再生数",
                 "動画の75%再生数", "動画の95%再生数", "動画の100%再生数"]:
         rate_col = col.replace("再生数", "再生率")
-        active_df[rate_col] = active_df[col] / active_df["インプレッション"] * 100
-
-    summary = active_df.groupby("広告の名前").agg(
-        配信日数=("レポート開始日", "nunique"),
-        配信開始日=("レポート開始日", "min"),
-        配信終了日=("レポート開始日", "max"),
-        消化金額合計=("消化金額 (JPY)", "sum"),
-        インプレッション合計=("インプレッション", "sum"),
-        リーチ合計=("リーチ", "sum"),
-        リンククリック合計=("リンクのクリック", "sum"),
-        購入合計=("購入", "sum"),
-        平均CTR=("CTR(リンククリックスルー率)", "mean"),
-        平均CPC=("CPC(リンククリックの単価) (JPY)", "mean"),
-        平均CPM=("CPM(インプレッション単価) (JPY)", "mean"),
-        平均フリークエンシー=("フリークエンシー", "mean"),
-        _3秒再生合計=("動画の3秒再生数", "sum"),
-        _25再生合計=("動画の25%再生数", "sum"),
-        _50再生合計=("動画の50%再生数", "sum"),
-        _75再生合計=("動画の75%再生数", "sum"),
-        _95再生合計=("動画の95%再生数", "sum"),
-        _100再生合計=("動画の100%再生数", "sum"),
-    ).reset_index()
-
-    summary["全体CTR"] = summary["リンククリック合計"] / summary["インプレッション合計"] * 100
-    summary["全体CPC"] = summary["消化金額合計"] / summary["リンククリック合計"]
-    summary["全体CPM"] = summary["消化金額合計"] / summary["インプレッション合計"] * 1000
-    summary["CPA"] = summary["消化金額合計"] / summary["購入合計"]
-    summary["日次平均消化"] = summary["消化金額合計"] / summary["配信日数"]
-
-    for pct, col in [("3秒", "_3秒再生合計"), ("25%", "_25再生合計"), ("50%", "_50再生合計"),
-                     ("75%", "_75再生合計"), ("95%", "_95再生合計"), ("100%", "_100再生合計")]:
-        summary[f"{pct}視聴率"] = summary[col] / summary["インプレッション合計"] * 100
+        active_df[rate_col] = safe_divide(active_df[col], active_df["インプレッション"], 100)
+    return active_df
+
+
+def build_summary(df: pd.DataFrame, creative_attrs: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    日次パフォーマンスとクリエイティブ属性からサマリーテーブルを構築
+    KPIはすべて metrics.KPIS の定義（分子合計 / 分母合計）から計算する
+    Returns: (active_df, summary_df)
+    """
+    active_df = prepare_active_df(df)
+    summary = aggregate(active_df, "広告の名前")
 
     # クリエイティブ属性と結合
     if creative_attrs is not None and len(creative_attrs) > 0:
@@ -327,6 +349,199 @@ def build_summary(df: pd.DataFrame, creative_attrs: pd.DataFrame) -> tuple[pd.Da
     return active_df, summary
 
 
+# 紐付けたクリエイティブからサマリーに結合する属性
+CREATIVE_ATTR_KEYS = [
+    "video_id", "creative_type", "duration_sec", "duration_category", "hook_strength_score", "primary_angle",
+    "hook_technique", "segment_count", "hook_duration_sec", "body_duration_sec", "cta_duration_sec",
+]
+
+
+def build_creative_attrs(
+    mapping: dict[str, str], short_names: dict[str, str], creatives: list[dict],
+) -> pd.DataFrame | None:
+    """広告名 → video_id の紐付けからクリエイティブ属性テーブルを構築（紐付けが無ければ None）"""
+    by_id = {cr["video_id"]: cr for cr in creatives}
+    rows = [
+        {"広告の名前": ad_name, "クリエイティブ短縮名": short_names.get(ad_name, ad_name),
+         **{k: by_id[video_id][k] for k in CREATIVE_ATTR_KEYS}}
+        for ad_name, video_id in mapping.items() if video_id in by_id
+    ]
+    return pd.DataFrame(rows) if rows else None
+
+
+def build_window_summary(
+    date_index, date_range: tuple, creative_attrs: pd.DataFrame | None, short_names: dict[str, str],
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    DateRangeIndex から分析期間の広告別サマリーを作り、KPI信頼区間と推定ユニークリーチを結合する
+    Returns: (active_df, summary)
+    """
+    active_df = date_index.rows_for_window(*date_range).copy()
+    active_df["クリエイティブ短縮名"] = active_df["広告の名前"].map(short_names)
+    summary = date_index.summary_for_window(*date_range, creative_attrs)
+    if len(summary) == 0:
+        raise ValueError("選択した期間に配信実績がありません")
+    summary = summary.merge(compute_kpi_intervals(active_df), on="広告の名前", how="left")
+    summary = summary.merge(
+        estimate_reach_from_frequency(active_df)[["広告の名前", "推定リーチ", "推定フリークエンシー"]],
+        on="広告の名前", how="left",
+    )
+    return active_df, summary
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 視聴維持率 × タイムライン（セグメント別ドロップオフ）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+RETENTION_COLS = ["3秒視聴率", "25%視聴率", "50%視聴率", "75%視聴率", "95%視聴率", "100%視聴率"]
+
+# (広告の名前, video_id, 配信開始日, 配信終了日) → (入力フィンガープリント, セグメント行リスト)
+# 維持率は広告ごとに異なるため、同じクリエイティブ・同じ期間でも広告ごとに別のエントリにする
+_SEGMENT_DROPOFF_CACHE: dict[tuple, tuple[tuple, list[dict]]] = {}
+_SEGMENT_DROPOFF_CACHE_MAX = 1024
+_SEGMENT_DROPOFF_LOCK = threading.Lock()  # 分析ジョブのスレッドから同時に更新されるため
+
+
+def _retention_knots(duration: np.ndarray, rates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    チェックポイント（3秒/25%/50%/75%/95%/100%）を秒に換算した補間ノットを作る。
+    0秒 = 100%（インプレッション）を先頭に置き、短尺で3秒が25%地点を超える場合に備えて
+    秒でソートした上で維持率を単調非増加に揃える。
+
+    Returns: (x, y) いずれも shape (n, 7)
+    """
+    n = len(duration)
+    x = np.column_stack([
+        np.zeros(n),
+        np.full(n, 3.0),
+        duration * 0.25,
+        duration * 0.50,
+        duration * 0.75,
+        duration * 0.95,
+        duration,
+    ])
+    x = np.minimum(x, duration[:, None])
+    y = np.column_stack([np.full(n, 100.0), rates])
+
+    order = np.argsort(x, axis=1, kind="stable")
+    x = np.take_along_axis(x, order, axis=1)
+    y = np.take_along_axis(y, order, axis=1)
+    y = np.minimum.accumulate(y, axis=1)
+    return x, y
+
+
+def _interp_rows(x: np.ndarray, y: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """行ごとの区分線形補間（x, y: (n, k) 昇順ノット / q: (n, m) 問い合わせ秒）"""
+    k = x.shape[1]
+    idx = (x[:, None, :] <= q[:, :, None]).sum(axis=2) - 1
+    idx = np.clip(idx, 0, k - 2)
+    x0 = np.take_along_axis(x, idx, axis=1)
+    x1 = np.take_along_axis(x, idx + 1, axis=1)
+    y0 = np.take_along_axis(y, idx, axis=1)
+    y1 = np.take_along_axis(y, idx + 1, axis=1)
+    span = x1 - x0
+    t = np.divide(q - x0, span, out=np.zeros(q.shape), where=span > 0)
+    return y0 + np.clip(t, 0, 1) * (y1 - y0)
+
+
+def _compute_segment_dropoff(
+    duration: np.ndarray, rates: np.ndarray, segments: list[list[dict]],
+) -> list[list[dict]]:
+    """全クリエイティブ分のセグメント別ドロップオフを一括計算する"""
+    n = len(duration)
+    m = max((len(s) for s in segments), default=0)
+    if n == 0 or m == 0:
+        return [[] for _ in range(n)]
+
+    # 可変長セグメントを (n, m) にパディング
+    starts = np.zeros((n, m))
+    ends = np.zeros((n, m))
+    for i, segs in enumerate(segments):
+        for j, seg in enumerate(segs):
+            starts[i, j] = seg["start_sec"]
+            ends[i, j] = seg["end_sec"]
+    starts = np.clip(starts, 0, duration[:, None])
+    ends = np.clip(ends, starts, duration[:, None])
+
+    x, y = _retention_knots(duration, rates)
+    r_start = _interp_rows(x, y, starts)
+    r_end = _interp_rows(x, y, ends)
+
+    drop = r_start - r_end
+    seg_len = ends - starts
+    total_drop = (100.0 - y[:, -1])[:, None]
+    rel_drop = np.divide(drop, r_start, out=np.full(drop.shape, np.nan), where=r_start > 0) * 100
+    per_sec = np.divide(drop, seg_len, out=np.full(drop.shape, np.nan), where=seg_len > 0)
+    share = np.divide(drop, total_drop, out=np.full(drop.shape, np.nan), where=total_drop > 0) * 100
+
+    results = []
+    for i, segs in enumerate(segments):
+        rows = []
+        for j, seg in enumerate(segs):
+            rows.append({
+                "segment_no": j + 1,
+                "segment_type": seg["segment_type"],
+                "segment_role": seg["segment_role"],
+                "開始秒": float(starts[i, j]),
+                "終了秒": float(ends[i, j]),
+                "開始時維持率": float(r_start[i, j]),
+                "終了時維持率": float(r_end[i, j]),
+                "離脱pt": float(drop[i, j]),
+                "区間離脱率": float(rel_drop[i, j]),
+                "秒あたり離脱pt": float(per_sec[i, j]),
+                "離脱寄与率": float(share[i, j]),
+            })
+        results.append(rows)
+    return results
+
+
+def build_segment_dropoff(summary: pd.DataFrame, creatives: list[dict]) -> pd.DataFrame:
+    """
+    視聴維持率チェックポイントを duration_sec で秒に換算して維持率カーブを補間し、
+    timeline_analysis の各セグメント（hook/body/cta）に離脱を割り当てる。
+    計算結果は (広告, video_id, 配信期間) 単位でキャッシュし、未計算分のみ一括で再計算する。
+
+    Returns: 1行 = 1広告 × 1セグメント のDataFrame
+    """
+    if "video_id" not in summary.columns:
+        return pd.DataFrame()
+
+    segments_by_id = {cr["video_id"]: cr.get("_segments", []) for cr in creatives}
+    target = summary[summary["video_id"].isin(segments_by_id.keys())]
+    target = target[target["duration_sec"].fillna(0) > 0]
+    if len(target) == 0:
+        return pd.DataFrame()
+
+    keys = list(zip(target["広告の名前"], target["video_id"],
+                    target["配信開始日"].astype(str), target["配信終了日"].astype(str)))
+    duration = target["duration_sec"].to_numpy(dtype=float)
+    rates = target[RETENTION_COLS].fillna(0).to_numpy(dtype=float)
+    fingerprints = [
+        (dur, tuple(r), tuple((s["start_sec"], s["end_sec"], s["segment_type"]) for s in segments_by_id[k[1]]))
+        for k, dur, r in zip(keys, duration, rates)
+    ]
+
+    with _SEGMENT_DROPOFF_LOCK:
+        # キャッシュに無い（または入力が変わった）行だけを一括計算
+        cached = [_SEGMENT_DROPOFF_CACHE.get(k) for k in keys]
+        miss = [i for i, (entry, fp) in enumerate(zip(cached, fingerprints)) if entry is None or entry[0] != fp]
+        if len(_SEGMENT_DROPOFF_CACHE) + len(miss) > _SEGMENT_DROPOFF_CACHE_MAX:
+            _SEGMENT_DROPOFF_CACHE.clear()
+        if miss:
+            computed = _compute_segment_dropoff(
+                duration[miss], rates[miss], [segments_by_id[keys[i][1]] for i in miss],
+            )
+            for i, rows in zip(miss, computed):
+                cached[i] = (fingerprints[i], rows)
+                _SEGMENT_DROPOFF_CACHE[keys[i]] = cached[i]
+
+    records = []
+    names = target.get("クリエイティブ短縮名", target["広告の名前"])
+    for k, (_, rows), name in zip(keys, cached, names):
+        for seg in rows:
+            records.append({"広告の名前": k[0], "クリエイティブ短縮名": name, "video_id": k[1], **seg})
+    return pd.DataFrame(records)
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # Phase 2: グラフ生成（各関数はmatplotlib Figureを返す）
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -347,18 +562,30 @@ def generate_kpi_chart(summary: pd.DataFrame) -> plt.Figure:
     for ax, (col, ylabel) in zip(axes.flat, metrics):
         bars = ax.bar(names, summary[col],
                       color=[colors[n] for n in names], edgecolor="black", linewidth=0.5)
+        ymax = _axis_max(summary[col])
+        # 信頼区間（compute_kpi_intervals() の結果が結合されている場合）
+        if f"{col}_下限" in summary.columns:
+            lo = summary[f"{col}_下限"].to_numpy(dtype=float)
+            hi = summary[f"{col}_上限"].to_numpy(dtype=float)
+            ymax = max(ymax, _axis_max(hi))
+            hi = np.where(np.isfinite(hi), hi, ymax * 1.3)
+            val = summary[col].to_numpy(dtype=float)
+            yerr = np.nan_to_num(np.vstack([val - lo, hi - val]).clip(min=0))
+            ax.errorbar(names, val, yerr=yerr, fmt="none", ecolor="black",
+                        elinewidth=1, capsize=6, zorder=6)
         for bar, val in zip(bars, summary[col]):
             if "円" in ylabel:
-                fmt = f"¥{val:,.0f}"
+                fmt = format_kpi(val, "¥{:,.0f}")
             elif "%" in ylabel or "CTR" in ylabel:
-                fmt = f"{val:.2f}%"
+                fmt = format_kpi(val, "{:.2f}%")
             else:
-                fmt = f"{val:.1f}%"
-            ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() * 1.02,
+                fmt = format_kpi(val, "{:.1f}%")
+            height = bar.get_height() if np.isfinite(bar.get_height()) else 0
+            ax.text(bar.get_x() + bar.get_width() / 2, height * 1.02,
                     fmt, ha="center", va="bottom", fontsize=11, fontweight="bold")
         ax.set_ylabel(ylabel, fontsize=12)
         ax.set_title(col, fontsize=14, fontweight="bold", pad=10)
-        ax.set_ylim(0, summary[col].max() * 1.35)
+        ax.set_ylim(0, ymax * 1.35)
         ax.tick_params(axis="x", rotation=15)
 
     fig.suptitle("クリエイティブ別 主要KPI比較", fontsize=18, fontweight="bold", y=1.02)
@@ -385,16 +612,16 @@ def generate_retention_chart(summary: pd.DataFrame) -> plt.Figure:
         ax.plot(x_labels, vals, color=colors[name], marker=markers[name],
                 label=label, linewidth=2.5, markersize=8)
         for i, v in enumerate(vals):
-            ax.annotate(f"{v:.1f}%", (x_labels[i], v),
-                        textcoords="offset points", xytext=(0, 10),
-                        ha="center", fontsize=9, color=colors[name])
+            if np.isfinite(v):
+                ax.annotate(f"{v:.1f}%", (x_labels[i], v),
+                            textcoords="offset points", xytext=(0, 10),
+                            ha="center", fontsize=9, color=colors[name])
 
     ax.set_ylabel("視聴率（%）", fontsize=13)
     ax.set_xlabel("視聴到達ポイント", fontsize=13)
     ax.set_title("動画視聴維持率カーブ（クリエイティブ比較）", fontsize=16, fontweight="bold", pad=20)
     ax.legend(fontsize=11, loc="upper right")
-    vmax = summary[retention_points].max().max()
-    ax.set_ylim(0, (vmax or 1) * 1.35)
+    ax.set_ylim(0, _axis_max(summary[retention_points].to_numpy().ravel()) * 1.35)
     plt.tight_layout()
     return fig
 
@@ -408,6 +635,9 @@ def generate_cost_matrix(summary: pd.DataFrame) -> plt.Figure:
     fig, ax = plt.subplots(figsize=(16, 9))
     for _, row in summary.iterrows():
         name = row["クリエイティブ短縮名"]
+        # CPA未定義（購入0件）の広告はプロットできないためスキップ
+        if not (np.isfinite(row["全体CTR"]) and np.isfinite(row["CPA"])):
+            continue
         ax.scatter(row["全体CTR"], row["CPA"],
                    s=max(row["消化金額合計"] / 30, 100),
                    color=colors[name], edgecolors="black", linewidth=0.8, alpha=0.8, zorder=5)
@@ -421,21 +651,76 @@ def generate_cost_matrix(summary: pd.DataFrame) -> plt.Figure:
     ax.set_ylabel("CPA（円）", fontsize=13)
     ax.set_title("コスト効率マトリックス（CTR vs CPA）\nバブルサイズ＝消化金額",
                  fontsize=16, fontweight="bold", pad=20)
-    ax.set_xlim(0, summary["全体CTR"].max() * 1.4)
-    ax.set_ylim(0, summary["CPA"].max() * 1.35)
+    ax.set_xlim(0, _axis_max(summary["全体CTR"]) * 1.4)
+    ax.set_ylim(0, _axis_max(summary["CPA"]) * 1.35)
     ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, p: f"¥{x:,.0f}"))
     plt.tight_layout()
     return fig
 
 
-def generate_daily_trend(daily: pd.DataFrame) -> plt.Figure:
-    """日次推移グラフ（消化金額・CTR）"""
+def generate_effect_chart(effects: pd.DataFrame) -> plt.Figure:
+    """
+    属性効果（fit_attribute_effects() の結果）のフォレストプロット
+    指標ごとに 効果 ± ブートストラップ区間（信頼水準は 信頼水準 列）を横棒で描き、区間が0をまたがない効果を色付きで示す
+    """
+    setup_style()
+    kpis = list(dict.fromkeys(effects["指標"])) if len(effects) else []
+    fig, axes = plt.subplots(2, 2, figsize=(16, 12))
+    if not kpis:
+        for ax in axes.flat:
+            ax.axis("off")
+        axes[0, 0].text(0, 0.5, "広告数が少ないため属性効果は推定していません", fontsize=16, va="center")
+        return fig
+
+    for ax, kpi in zip(axes.flat, kpis):
+        rows = effects[effects["指標"] == kpi].iloc[::-1]
+        y = np.arange(len(rows))
+        val = rows["効果"].to_numpy(dtype=float)
+        xerr = np.nan_to_num(np.vstack([val - rows["下限"], rows["上限"] - val]).clip(min=0))
+        unit = rows["単位"].iloc[0]
+        # CPA（% 変化）は低い方が良いため、赤 = 良化 の意味を揃える
+        better = val < 0 if unit == "%" else val > 0
+        colors = np.where(~rows["有意"].to_numpy(dtype=bool), "#BDC3C7", np.where(better, "#E74C3C", "#3498DB"))
+        ax.barh(y, val, color=colors, edgecolor="black", linewidth=0.5, height=0.6)
+        ax.errorbar(val, y, xerr=xerr, fmt="none", ecolor="black", elinewidth=1, capsize=4, zorder=6)
+        ax.axvline(0, color="black", linewidth=0.8)
+        ax.set_yticks(y)
+        ax.set_yticklabels([f"{f}\n{c}" for f, c in zip(rows["特徴"], rows["変化"])], fontsize=9)
+        ax.set_xlabel(f"効果（{'% 変化' if unit == '%' else 'ポイント差'}）", fontsize=11)
+        ax.set_title(f"{kpi}（決定係数 {rows['決定係数'].iloc[0]:.2f}）", fontsize=14, fontweight="bold", pad=10)
+    for ax in list(axes.flat)[len(kpis):]:
+        ax.axis("off")
+
+    fig.suptitle(
+        f"クリエイティブ属性の効果（インプレッション加重回帰・広告{int(effects['広告数'].max())}本・"
+        f"{effects['信頼水準'].iloc[0]:.0%}ブートストラップ区間）\n"
+        "赤 = KPI を良くする方向 / 青 = 悪くする方向 / 灰 = 区間が0をまたぐ",
+        fontsize=16, fontweight="bold", y=1.03,
+    )
+    plt.tight_layout()
+    return fig
+
+
+# 日次推移の比率KPI: (日次値の列, compute_rolling_kpis() の接頭辞, 軸ラベル, 移動窓比率の定義)
+DAILY_TREND_KPIS = [
+    ("CTR(リンククリックスルー率)", "CTR", "CTR（%）", "窓内クリック合計 ÷ 窓内Imp合計"),
+    ("CPC(リンククリックの単価) (JPY)", "CPC", "CPC（円）", "窓内消化合計 ÷ 窓内クリック合計"),
+    ("購入ROAS(広告費用対効果)", "ROAS", "ROAS", "窓内購入金額合計 ÷ 窓内消化合計"),
+]
+
+
+def generate_daily_trend(daily: pd.DataFrame, rolling: pd.DataFrame | None = None, window: int = 7) -> plt.Figure:
+    """
+    日次推移グラフ（消化金額・CTR・CPC・ROAS）
+    rolling（compute_rolling_kpis() の結果）を渡すと、CTR / CPC / ROAS は移動窓比率を実線で描き
+    日次値は薄い点で重ねる
+    """
     setup_style()
     names = daily["クリエイティブ短縮名"].dropna().unique().tolist()
     colors = _get_colors(names)
     markers = _get_markers(names)
 
-    fig, axes = plt.subplots(2, 1, figsize=(16, 12), sharex=True)
+    fig, axes = plt.subplots(1 + len(DAILY_TREND_KPIS), 1, figsize=(16, 22), sharex=True)
 
     ax = axes[0]
     for name, group in daily.groupby("クリエイティブ短縮名"):
@@ -446,59 +731,34 @@ def generate_daily_trend(daily: pd.DataFrame) -> plt.Figure:
     ax.legend(fontsize=10, loc="upper right")
     ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, p: f"¥{x:,.0f}"))
 
-    ax = axes[1]
-    for name, group in daily.groupby("クリエイティブ短縮名"):
-        g = group[group["CTR(リンククリックスルー率)"].notna()]
-        if len(g) > 0:
-            ax.plot(g["レポート開始日"], g["CTR(リンククリックスルー率)"],
-                    color=colors[name], marker=markers[name], label=name, linewidth=2, markersize=6)
-    ax.set_ylabel("CTR（%）", fontsize=12)
-    ax.set_xlabel("日付", fontsize=12)
-    ax.set_title("日次 CTR推移", fontsize=14, fontweight="bold", pad=15)
-    ax.legend(fontsize=10, loc="upper right")
+    for ax, (raw_col, prefix, ylabel, definition) in zip(axes[1:], DAILY_TREND_KPIS):
+        rolling_col = f"{prefix}_{window}日"
+        use_rolling = rolling is not None and rolling_col in rolling.columns
+        if raw_col not in daily.columns and not use_rolling:
+            ax.set_visible(False)
+            continue
+        for name, group in daily.groupby("クリエイティブ短縮名"):
+            g = group[group[raw_col].notna()] if raw_col in group.columns else group.iloc[:0]
+            if use_rolling:
+                if len(g) > 0:
+                    ax.scatter(g["レポート開始日"], g[raw_col],
+                               color=colors[name], marker=markers[name], s=25, alpha=0.35)
+                r = rolling[rolling["クリエイティブ短縮名"] == name]
+                ax.plot(r["レポート開始日"], r[rolling_col],
+                        color=colors[name], label=f"{name}（{window}日移動）", linewidth=2.5)
+            elif len(g) > 0:
+                ax.plot(g["レポート開始日"], g[raw_col],
+                        color=colors[name], marker=markers[name], label=name, linewidth=2, markersize=6)
+        if prefix == "ROAS":
+            ax.axhline(y=1.0, color="red", linestyle="--", alpha=0.5, label="ROAS=1.0（損益分岐）")
+        if prefix == "CPC":
+            ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, p: f"¥{x:,.0f}"))
+        ax.set_ylabel(ylabel, fontsize=12)
+        title = f"日次 {prefix}推移（{window}日移動{prefix} = {definition}）" if use_rolling else f"日次 {prefix}推移"
+        ax.set_title(title, fontsize=14, fontweight="bold", pad=15)
+        ax.legend(fontsize=10, loc="upper right")
+    axes[-1].set_xlabel("日付", fontsize=12)
 
     fig.suptitle("日次パフォーマンス推移", fontsize=18, fontweight="bold", y=1.02)
     plt.tight_layout()
     return fig
-
-
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# KPIサマリーテキスト生成（Claude APIへの入力用）
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-def build_kpi_text(summary: pd.DataFrame) -> str:
-    """Claude APIに渡すためのKPIサマリーテキストを生成"""
-    lines = ["## クリエイティブ別KPIサマリー\n"]
-    lines.append("| クリエイティブ | 配信日数 | 消化金額 | Imp | CTR | CPC | CPA | 3秒視聴率 | 100%視聴率 |")
-    lines.append("|---|---|---|---|---|---|---|---|---|")
-
-    for _, row in summary.iterrows():
-        name = row.get("クリエイティブ短縮名", row["広告の名前"])
-        lines.append(
-            f"| {name} "
-            f"| {int(row['配信日数'])}日 "
-            f"| ¥{row['消化金額合計']:,.0f} "
-            f"| {row['インプレッション合計']:,.0f} "
-            f"| {row['全体CTR']:.2f}% "
-            f"| ¥{row['全体CPC']:,.0f} "
-            f"| ¥{row['CPA']:,.0f} "
-            f"| {row['3秒視聴率']:.1f}% "
-            f"| {row['100%視聴率']:.1f}% |"
-        )
-
-    # 視聴維持率テーブル
-    lines.append("\n## 視聴維持率\n")
-    lines.append("| クリエイティブ | 3秒 | 25% | 50% | 75% | 95% | 100% |")
-    lines.append("|---|---|---|---|---|---|---|")
-    for _, row in summary.iterrows():
-        name = row.get("クリエイティブ短縮名", row["広告の名前"])
-        lines.append(
-            f"| {name} "
-            f"| {row['3秒視聴率']:.1f}% "
-            f"| {row['25%視聴率']:.1f}% "
-            f"| {row['50%視聴率']:.1f}% "
-            f"| {row['75%視聴率']:.1f}% "
-            f"| {row['95%視聴率']:.1f}% "
-            f"| {row['100%視聴率']:.1f}% |"
-        )
-
-    return "\n".join(lines)
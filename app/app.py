@@ -6,6 +6,7 @@ Gemini手動JSON + Excel → Claude API → レポート自動生成
 import json
 import streamlit as st
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 import os
 
@@ -13,14 +14,46 @@ from analysis_engine import (
     process_excel,
     parse_creative_jsons,
     parse_creative_md,
-    build_summary,
-    build_kpi_text,
+    prepare_active_df,
+    build_segment_dropoff,
+    build_creative_attrs,
+    build_window_summary,
     generate_kpi_chart,
     generate_retention_chart,
     generate_cost_matrix,
     generate_daily_trend,
+    generate_effect_chart,
 )
-from claude_client import run_analysis
+from attribute_cube import AttributeCube
+from date_index import DateRangeIndex
+from breakdown import BreakdownRollup, detect_breakdowns
+from timeseries_engine import compute_rolling_kpis, latest_period_comparison, detect_fatigue
+from claude_client import (
+    MODEL_ID,
+    build_prompt,
+    check_prompt_size,
+    kpi_token_budget,
+    run_analysis,
+    run_structured_analysis,
+)
+from prompt_data import MAX_PROMPT_TOKENS, build_kpi_text, estimate_tokens
+from job_runner import PLOT_LOCK, figure_to_png, get_runner
+from shared_cache import content_hash, get_cache
+from run_store import RunStore
+from html_export import markdown_to_html
+from creative_mapper import CreativeMatcher
+from table_view import DEFAULT_PAGE_SIZE, PagedTable
+from report_schema import ReportSchemaError, report_frames
+from creative_index import TOP_K, CreativeIndex
+from attribute_effects import build_effects_text, ci_label, fit_attribute_effects, flag_columns
+from creative_clusters import (
+    CLUSTER_MIN_ADS,
+    build_cluster_kpi_text,
+    cluster_daily,
+    cluster_portfolio,
+    cluster_summary,
+)
+from budget_simulator import MAX_SCALE, ResponseCurves
 
 load_dotenv()
 
@@ -60,6 +93,693 @@ def check_password() -> bool:
 
     return False
 
+# ── 分析ジョブ ──────────────────────────────────────────
+STAGE_LABELS = {
+    "summary": "📊 定量分析を実行中...",
+    "charts": "📈 グラフを生成中...",
+    "report": "🧠 Claude API で分析中...（30秒〜1分ほどかかります）",
+}
+
+
+def analysis_job(
+    job,
+    export_key: str,
+    account: str,
+    date_index,
+    date_range,
+    short_names: dict,
+    creative_attrs,
+    creatives: list[dict],
+    mapping: dict,
+    breakdown_rollup,
+    breakdown_dims: list[str],
+    api_key: str,
+    structured: bool = False,
+    cluster: bool = True,
+) -> None:
+    """
+    バックグラウンドで実行する分析本体。各ステージの結果を publish() で順に公開する
+    サマリー → グラフ（1枚ずつ）→ AIレポート
+    cluster=True で広告数が CLUSTER_MIN_ADS を超える場合、グラフと AI 分析はクラスタの代表で行う
+    各ステージの結果は入力の内容ハッシュをキーに共有キャッシュへ保存し、他のセッションと共有する
+    完了時（レポート失敗時を含む）にはサマリー・グラフ・レポートを分析履歴に保存する
+    """
+    cache = get_cache()
+    # 類似クリエイティブの検索は定性分析テキストも使うので、JSON と合わせてキーに含める
+    analysis_key = content_hash(
+        export_key, date_range, creative_attrs, short_names,
+        [(cr["_raw_json"], cr.get("_qualitative_text", "")) for cr in creatives],
+    )
+
+    # --- 定量分析 ---
+    job.set_stage("summary")
+
+    def compute_tables() -> dict:
+        active_df, summary = build_window_summary(date_index, date_range, creative_attrs, short_names)
+        rolling = compute_rolling_kpis(active_df)
+        tables = {
+            "summary": summary,
+            "active_df": active_df,
+            "rolling": rolling,
+            "segment_dropoff": build_segment_dropoff(summary, creatives),
+            "latest_period": latest_period_comparison(rolling),
+            "fatigue": detect_fatigue(rolling),
+        }
+        # has_* フラグはサマリーに結合されていないため、紐付けたクリエイティブから引いて軸に加える
+        flags = flag_columns(summary, creatives)
+        flags = flags.drop(columns=summary.columns.intersection(flags.columns)).astype("boolean")
+        cube = AttributeCube(summary.join(flags))
+        if cube.dims:
+            tables["cube_marginals"] = cube.marginals()
+        # 属性効果は（クラスタ要約の有無に関係なく）広告単位のサマリーで推定する
+        tables["attribute_effects"] = fit_attribute_effects(summary, creatives)
+        tables["response_curves"] = ResponseCurves.fit(active_df)
+        if breakdown_rollup is not None:
+            tables["breakdowns"] = {dim: breakdown_rollup.kpis([dim], *date_range) for dim in breakdown_dims}
+        if len(creatives) >= 2:
+            # 類似検索インデックスはクリエイティブ分析の内容だけで決まるので、期間・紐付けをまたいで使い回す
+            index = cache.get_or_compute(
+                "creative_index",
+                content_hash([(cr["_raw_json"], cr.get("_qualitative_text", "")) for cr in creatives]),
+                lambda: CreativeIndex.build(creatives),
+            )
+            tables["similar_creatives"] = index.neighbors(
+                sorted(set(mapping.values())), k=TOP_K, summary=summary,
+            )
+        return tables
+
+    tables = cache.get_or_compute("analysis", analysis_key, compute_tables)
+    for name, value in tables.items():
+        if name not in ("active_df", "rolling"):
+            job.publish(name, value)
+    summary = tables["summary"]
+
+    # --- クラスタ要約（広告数が多い場合、グラフとプロンプトはクラスタの代表で作る） ---
+    view = tables
+    clusters = None
+    if cluster and len(summary) > CLUSTER_MIN_ADS:
+        def compute_clusters() -> dict:
+            assignments = cluster_portfolio(summary, creatives)
+            daily = cluster_daily(tables["active_df"], assignments)
+            return {
+                "assignments": assignments,
+                "summary": cluster_summary(daily, summary, assignments),
+                "active_df": daily,
+                "rolling": compute_rolling_kpis(daily),
+            }
+
+        clusters = cache.get_or_compute("clusters", analysis_key, compute_clusters)
+        job.publish("cluster_assignments", clusters["assignments"])
+        job.publish("cluster_summary", clusters["summary"])
+        view = clusters
+
+    # --- グラフ生成 ---
+    job.set_stage("charts")
+    charts = {
+        "kpi": lambda: generate_kpi_chart(view["summary"]),
+        "retention": lambda: generate_retention_chart(view["summary"]),
+        "cost": lambda: generate_cost_matrix(view["summary"]),
+        "daily": lambda: generate_daily_trend(view["active_df"], view["rolling"]),
+        "effects": lambda: generate_effect_chart(tables["attribute_effects"]),
+    }
+    figures = {}
+    for name, make in charts.items():
+        job.check_cancelled()
+
+        def render(make=make) -> bytes:
+            with PLOT_LOCK:
+                return figure_to_png(make())
+
+        figures[name] = cache.get_or_compute("chart", content_hash(analysis_key, name, clusters is not None), render)
+        job.publish(f"chart_{name}", figures[name])
+
+    def save_run(report: str | None = None, report_data: dict | None = None) -> None:
+        job.publish("run_id", RunStore().save_run(
+            analysis_key, account, date_range, summary, figures, report,
+            meta={"ads": list(mapping), "video_ids": list(mapping.values())},
+            report_data=report_data,
+        ))
+
+    # --- AI分析 ---
+    job.set_stage("report")
+    if not api_key:
+        job.publish("report_warning", "APIキーが設定されていません。管理者に連絡してください。")
+        save_run()
+        return
+    mapped_ids = set(mapping.values())
+    creative_json_for_api = [cr for cr in creatives if cr["video_id"] in mapped_ids]
+    # 送信前にプロンプトサイズを見積もり、KPI表を残りの予算に収める
+    budget = kpi_token_budget(creative_json_for_api, structured=structured)
+    effects_text = build_effects_text(tables["attribute_effects"])
+    budget = max(budget - estimate_tokens(effects_text), 0)
+    try:
+        if clusters is not None:
+            kpi_text = build_cluster_kpi_text(clusters["summary"], clusters["assignments"], max_tokens=budget)
+        else:
+            kpi_text = build_kpi_text(summary, max_tokens=budget)
+        kpi_text += effects_text
+        prompt_tokens = check_prompt_size(build_prompt(kpi_text, creative_json_for_api, structured))
+    except ValueError as e:
+        job.publish("report_error", str(e))
+        save_run()
+        return
+    job.publish("prompt_tokens", prompt_tokens)
+    def report_key(mode: str) -> str:
+        return content_hash(
+            MODEL_ID, kpi_text, [(cr["_raw_json"], cr.get("_qualitative_text", "")) for cr in creative_json_for_api],
+            mode,
+        )
+
+    kwargs = dict(api_key=api_key, kpi_summary_text=kpi_text, creative_jsons=creative_json_for_api)
+
+    def analyze_markdown() -> dict:
+        return {"markdown": run_analysis(**kwargs), "data": None}
+
+    try:
+        result = None
+        if structured:
+            # 構造化出力モードでは Markdown と検証済み JSON を1回の呼び出しで受け取る
+            # スキーマ違反で Markdown のみに落とした結果は structured のキーには保存しない（次回は取り直す）
+            try:
+                result = cache.get_or_compute("report", report_key("structured"),
+                                              lambda: run_structured_analysis(**kwargs))
+            except ReportSchemaError as e:
+                job.publish("report_warning", f"{e}（Markdown レポートのみ出力します）")
+        if result is None:
+            result = cache.get_or_compute("report", report_key("markdown"), analyze_markdown)
+    except Exception as e:
+        job.publish("report_error", f"API呼び出しエラー: {e}")
+        save_run()
+        return
+    # API呼び出し中にキャンセルされた場合は結果を公開しない
+    job.check_cancelled()
+    report, report_data = result["markdown"], result["data"]
+    if report_data is not None:
+        job.publish("report_data", report_data)
+    job.publish("report", report)
+    save_run(report, report_data)
+
+    # --- HTMLエクスポート（グラフ付き） ---
+    job.publish("html_exports", build_html_exports(report, figures))
+
+
+def render_paged_table(
+    paged: PagedTable,
+    key: str,
+    formats: dict[str, str] | None = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> None:
+    """PagedTable をソート・絞り込み付きで1ページずつ表示する（書式は表示中のページにだけ適用）"""
+    columns = paged.columns
+    col_sort, col_order, col_filter, col_value = st.columns([2, 1, 2, 3])
+    with col_sort:
+        sort_by = st.selectbox("並べ替え", ["（なし）", *columns], key=f"{key}_sort")
+    with col_order:
+        descending = st.toggle("降順", key=f"{key}_desc")
+    with col_filter:
+        filter_col = st.selectbox("絞り込み", ["（なし）", *columns], key=f"{key}_filter_col")
+
+    filters = []
+    with col_value:
+        if filter_col != "（なし）" and paged.is_numeric(filter_col):
+            value_range = paged.value_range(filter_col)
+            if value_range and value_range[0] < value_range[1]:
+                lo, hi = st.slider("範囲", *value_range, value=value_range, key=f"{key}_range_{filter_col}")
+                filters.append((filter_col, "between", (lo, hi)))
+        elif filter_col != "（なし）":
+            text = st.text_input("含む文字列", key=f"{key}_text_{filter_col}")
+            if text:
+                filters.append((filter_col, "contains", text))
+
+    sort_col = None if sort_by == "（なし）" else sort_by
+    query_key = content_hash(paged.key, filters, sort_col, descending)
+    indices = get_cache().get_or_compute(
+        "table_query", query_key, lambda: paged.query_indices(filters, sort_col, descending),
+    )
+    n_pages = paged.page_count(indices, page_size)
+    page = 1
+    if n_pages > 1:
+        # 条件が変わったらページ番号を1に戻す
+        page = st.number_input("ページ", min_value=1, max_value=n_pages, value=1, key=f"{key}_page_{query_key[:8]}")
+
+    page_df = paged.page(indices, page - 1, page_size)
+    formats = {c: f for c, f in (formats or {}).items() if c in page_df.columns}
+    st.dataframe(
+        page_df.style.format(formats, na_rep="N/A") if formats else page_df,
+        use_container_width=True,
+        hide_index=True,
+    )
+    st.caption(f"{len(indices):,} / {paged.num_rows:,} 行（{page} / {n_pages} ページ）")
+
+
+CHART_TITLES = {
+    "kpi": "KPI比較",
+    "retention": "視聴維持率",
+    "cost": "コスト効率",
+    "daily": "日次推移",
+    "effects": "属性効果",
+}
+
+
+def build_html_exports(report: str, figures: dict[str, bytes]) -> dict:
+    """レポートにグラフを付けた HTML（画像埋め込み版 / 画像別ファイルの zip 版）を作る"""
+    md_text = report + "\n\n---\n\n## グラフ\n\n" + "\n\n".join(
+        f"![{CHART_TITLES.get(name, name)}]({name})" for name in figures
+    )
+    inline = markdown_to_html(md_text, resolve_image=figures.get, image_mode="inline")
+    external = markdown_to_html(md_text, resolve_image=figures.get, image_mode="external")
+    return {"inline": inline, "external": external}
+
+
+def render_report_data(report_data: dict, key: str) -> None:
+    """構造化レポート（ランキング・所見・推奨事項・仮説）を表で表示し、JSON をダウンロードできるようにする"""
+    frames = report_frames(report_data)
+    with st.expander("🧾 構造化データ（JSON）"):
+        tabs = st.tabs(["総合ランキング", "所見", "推奨事項", "仮説"])
+        for tab, name in zip(tabs, ["rankings", "findings", "recommendations", "hypotheses"]):
+            with tab:
+                st.dataframe(frames[name], hide_index=True, use_container_width=True)
+        st.download_button(
+            "📥 構造化データをダウンロード（JSON）",
+            data=json.dumps(report_data, ensure_ascii=False, indent=2),
+            file_name="analysis_report.json",
+            mime="application/json",
+            key=key,
+        )
+
+
+def render_budget_simulator(curves: ResponseCurves, summary: pd.DataFrame, key: str) -> None:
+    """総予算・上下限・固定する広告を変えて、限界効率が揃う配分と予測購入をその場で試算する"""
+    st.caption("広告ごとに 1日あたり購入 = α × 消化^β（β<1 で逓減）を日次実績から推定し、"
+               "追加1円あたりの購入（限界効率）が全広告で揃うように総予算を配分します。"
+               "実績の範囲を大きく超える配分は外挿になるため、上限倍率で制限しています")
+    names = dict(zip(summary["広告の名前"], summary["クリエイティブ短縮名"])) if "クリエイティブ短縮名" in summary else {}
+    col_b, col_min, col_max = st.columns(3)
+    with col_b:
+        budget_pct = st.slider("総予算（現在比 %）", 50, 200, 100, step=5, key=f"{key}_total")
+    with col_min:
+        min_scale = st.slider("広告ごとの下限（現在比）", 0.0, 1.0, 0.0, step=0.1, key=f"{key}_min")
+    with col_max:
+        max_scale = st.slider("広告ごとの上限（現在比）", 1.0, 5.0, MAX_SCALE, step=0.5, key=f"{key}_max")
+    fixed = st.multiselect("現在の消化のまま固定する広告", list(curves.ads), format_func=lambda ad: names.get(ad, ad),
+                           key=f"{key}_fixed")
+    no_conversions = list(curves.no_conversions)
+    if no_conversions:
+        st.warning(f"期間中に購入が無い広告が {len(no_conversions)} 本あります（反応曲線を推定できないため、"
+                   "固定しない場合は限界効率0として下限まで減らします）: "
+                   + "、".join(names.get(ad, ad) for ad in no_conversions[:10])
+                   + ("…" if len(no_conversions) > 10 else ""))
+        if st.checkbox("購入が無い広告は現在の消化のまま固定する", value=True, key=f"{key}_lock_zero"):
+            fixed = sorted(set(fixed) | set(no_conversions))
+
+    bounded = curves.with_bounds(min_scale, max_scale, fixed)
+    current_total = float(curves.current_spend.sum())
+    total = current_total * budget_pct / 100
+    scenario = bounded.scenario_table([current_total, total])
+    if not bounded.lower.sum() <= total <= bounded.upper.sum():
+        st.warning(f"上下限の範囲で配分できる総予算は ¥{bounded.lower.sum():,.0f}〜¥{bounded.upper.sum():,.0f}/日 です"
+                   "（範囲内に丸めて試算しています）")
+
+    now, plan = scenario.iloc[0], scenario.iloc[1]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("総予算/日", f"¥{plan['総予算/日']:,.0f}", f"{plan['総予算/日'] - current_total:+,.0f}")
+    col2.metric("予測購入/日（最適配分）", f"{plan['予測購入/日（最適配分）']:,.1f}",
+                f"{plan['予測購入/日（最適配分）'] - now['予測購入/日（現在の配分比）']:+,.1f}（現状比）")
+    col3.metric("予測CPA（最適配分）", f"¥{plan['予測CPA（最適配分）']:,.0f}",
+                f"{plan['予測CPA（最適配分）'] - now['予測CPA（現在の配分比）']:+,.0f}", delta_color="inverse")
+
+    allocation = bounded.allocation_table(bounded.optimize([total])[0], names)
+    st.dataframe(
+        allocation.style.format({
+            "現在消化/日": "¥{:,.0f}",
+            "推奨消化/日": "¥{:,.0f}",
+            "増減/日": "{:+,.0f}",
+            "現在購入/日": "{:.2f}",
+            "予測購入/日": "{:.2f}",
+            "推奨後の限界CPA": "¥{:,.0f}",
+            "β（逓減度）": "{:.2f}",
+        }),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    # 総予算を動かしたときの予測（最適配分 vs 現在の配分比のまま拡大縮小）
+    curve = bounded.scenario_table(current_total * np.linspace(0.5, 2.0, 301))
+    st.line_chart(curve.set_index("総予算/日")[["予測購入/日（最適配分）", "予測購入/日（現在の配分比）"]])
+
+
+def render_analysis_job(job_id: str, polling: bool) -> None:
+    """ジョブの進捗と、その時点までに公開された部分結果を描画する"""
+    job = get_runner().get(job_id)
+    if job is None:
+        return
+    results = job.snapshot()
+
+    if not job.finished:
+        col_p, col_c = st.columns([4, 1])
+        with col_p:
+            st.progress(job.progress, text=STAGE_LABELS.get(job.stage, "⏳ 待機中..."))
+        with col_c:
+            if st.button("⏹ キャンセル", key=f"cancel_{job.id}", use_container_width=True):
+                job.cancel()
+    elif job.status == "error":
+        st.error(job.error)
+    elif job.status == "cancelled":
+        st.warning("分析をキャンセルしました")
+
+    if "summary" in results:
+        summary = results["summary"]
+        st.subheader("📋 KPIサマリー")
+        display_cols = ["クリエイティブ短縮名", "配信日数", "消化金額合計",
+                        "インプレッション合計", "推定リーチ", "推定フリークエンシー",
+                        "全体CTR", "全体CPC", "CPA", "3秒視聴率", "100%視聴率"]
+        available = [c for c in display_cols if c in summary.columns]
+        paged_summary = get_cache().get_or_compute(
+            "arrow_table", f"{job_id}:summary", lambda: PagedTable(summary[available], key=f"{job_id}:summary"),
+        )
+        render_paged_table(paged_summary, key=f"summary_{job_id}", formats={
+            "消化金額合計": "¥{:,.0f}",
+            "インプレッション合計": "{:,.0f}",
+            "推定リーチ": "{:,.0f}",
+            "推定フリークエンシー": "{:.2f}",
+            "全体CTR": "{:.2f}%",
+            "全体CPC": "¥{:,.0f}",
+            "CPA": "¥{:,.0f}",
+            "3秒視聴率": "{:.1f}%",
+            "100%視聴率": "{:.1f}%",
+        })
+
+    if "cube_marginals" in results:
+        with st.expander("🧊 属性別クロス集計（合計比）"):
+            cube_cols = ["属性", "値", "広告数", "消化金額合計", "全体CTR", "全体CPC", "CPA", "3秒視聴率", "100%視聴率"]
+            marginals = results["cube_marginals"]
+            st.dataframe(
+                marginals[[c for c in cube_cols if c in marginals.columns]].style.format({
+                    "消化金額合計": "¥{:,.0f}",
+                    "全体CTR": "{:.2f}%",
+                    "全体CPC": "¥{:,.0f}",
+                    "CPA": "¥{:,.0f}",
+                    "3秒視聴率": "{:.1f}%",
+                    "100%視聴率": "{:.1f}%",
+                }, na_rep="N/A"),
+                use_container_width=True,
+            )
+
+    if "breakdowns" in results:
+        with st.expander("🧩 ブレイクダウン別KPI（配置・年齢・性別など）"):
+            for dim, breakdown_kpis in results["breakdowns"].items():
+                breakdown_cols = [dim, "消化金額合計", "インプレッション合計", "全体CTR", "全体CPC", "CPA", "ROAS"]
+                st.markdown(f"**{dim}別**")
+                st.dataframe(
+                    breakdown_kpis[[c for c in breakdown_cols if c in breakdown_kpis.columns]].style.format({
+                        "消化金額合計": "¥{:,.0f}",
+                        "インプレッション合計": "{:,.0f}",
+                        "全体CTR": "{:.2f}%",
+                        "全体CPC": "¥{:,.0f}",
+                        "CPA": "¥{:,.0f}",
+                        "ROAS": "{:.2f}",
+                    }, na_rep="N/A"),
+                    use_container_width=True,
+                )
+
+    if "similar_creatives" in results and len(results["similar_creatives"]) > 0:
+        with st.expander("🔎 類似クリエイティブ（動画分析・定性分析の近さ）"):
+            st.caption("類似度 = テキスト（分析JSON・定性分析の文字n-gram）と属性（尺・構成・種別・訴求軸）の重み付きコサイン。"
+                       "KPIは今回の期間で類似先に紐付いた広告の合算")
+            similar = results["similar_creatives"]
+            st.dataframe(
+                similar.style.format({
+                    "類似度": "{:.3f}",
+                    "テキスト類似度": "{:.3f}",
+                    "属性類似度": "{:.3f}",
+                    "広告数": "{:.0f}",
+                    "消化金額合計": "¥{:,.0f}",
+                    "全体CTR": "{:.2f}%",
+                    "全体CPC": "¥{:,.0f}",
+                    "CPA": "¥{:,.0f}",
+                    "3秒視聴率": "{:.1f}%",
+                    "100%視聴率": "{:.1f}%",
+                }, na_rep="—"),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+    if "cluster_summary" in results:
+        with st.expander(f"🧬 クラスタ要約（{len(results['cluster_summary'])}クラスタ・グラフとAI分析はクラスタ単位）"):
+            cluster_cols = ["クリエイティブ短縮名", "広告数", "代表広告", "creative_type", "duration_sec",
+                            "消化金額合計", "全体CTR", "全体CPC", "CPA", "3秒視聴率", "100%視聴率"]
+            reps = results["cluster_summary"]
+            st.dataframe(
+                reps[[c for c in cluster_cols if c in reps.columns]].style.format({
+                    "duration_sec": "{:.0f}秒",
+                    "消化金額合計": "¥{:,.0f}",
+                    "全体CTR": "{:.2f}%",
+                    "全体CPC": "¥{:,.0f}",
+                    "CPA": "¥{:,.0f}",
+                    "3秒視聴率": "{:.1f}%",
+                    "100%視聴率": "{:.1f}%",
+                }, na_rep="N/A"),
+                use_container_width=True,
+                hide_index=True,
+            )
+            st.markdown("**所属広告**")
+            st.dataframe(
+                results["cluster_assignments"][["クラスタ名", "クリエイティブ短縮名", "広告の名前", "代表", "中心距離"]]
+                .style.format({"中心距離": "{:.2f}"}),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+    if "response_curves" in results and len(results["response_curves"]) >= 2:
+        with st.expander("💰 予算配分シミュレーター（どこに予算を動かすか）"):
+            render_budget_simulator(results["response_curves"], results["summary"], key=f"budget_{job_id}")
+
+    # --- グラフ表示（生成済みのものから順に表示） ---
+    if "summary" in results:
+        st.subheader("📈 パフォーマンスグラフ")
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["KPI比較", "視聴維持率", "コスト効率", "日次推移", "属性効果"])
+
+        def show_chart(name: str) -> None:
+            if f"chart_{name}" in results:
+                st.image(results[f"chart_{name}"], use_container_width=True)
+            elif not job.finished:
+                st.caption("⏳ グラフを生成中...")
+
+        with tab1:
+            show_chart("kpi")
+        with tab2:
+            show_chart("retention")
+            segment_dropoff = results["segment_dropoff"]
+            if len(segment_dropoff) > 0:
+                st.markdown("**セグメント別ドロップオフ（Hook / Body / CTA）**")
+                st.dataframe(
+                    segment_dropoff.drop(columns=["広告の名前", "video_id"]).style.format({
+                        "開始秒": "{:.0f}秒",
+                        "終了秒": "{:.0f}秒",
+                        "開始時維持率": "{:.1f}%",
+                        "終了時維持率": "{:.1f}%",
+                        "離脱pt": "{:.1f}pt",
+                        "区間離脱率": "{:.1f}%",
+                        "秒あたり離脱pt": "{:.2f}pt",
+                        "離脱寄与率": "{:.1f}%",
+                    }),
+                    use_container_width=True,
+                )
+        with tab3:
+            show_chart("cost")
+        with tab4:
+            show_chart("daily")
+            st.markdown("**直近7日KPIと前週比**")
+            st.dataframe(
+                results["latest_period"].drop(columns=["広告の名前"]).style.format({
+                    "レポート開始日": "{:%Y/%m/%d}",
+                    "CTR_7日": "{:.2f}%",
+                    "CPC_7日": "¥{:,.0f}",
+                    "CPM_7日": "¥{:,.0f}",
+                    "CPA_7日": "¥{:,.0f}",
+                    "ROAS_7日": "{:.2f}",
+                    "フリークエンシー_7日": "{:.2f}",
+                    "CTR_7日_前週比": "{:+.1f}%",
+                    "CPC_7日_前週比": "{:+.1f}%",
+                    "CPM_7日_前週比": "{:+.1f}%",
+                    "CPA_7日_前週比": "{:+.1f}%",
+                    "ROAS_7日_前週比": "{:+.1f}%",
+                    "CTR_7日_ピーク比": "{:.0%}",
+                }, na_rep="-"),
+                use_container_width=True,
+            )
+
+            fatigue = results["fatigue"]
+            st.markdown("**クリエイティブ疲弊検出（CTR × 累計接触回数）**")
+            for _, row in fatigue[fatigue["疲弊"]].iterrows():
+                st.warning(
+                    f"{row['クリエイティブ短縮名']}: CTRが初回接触時の {row['CTR残存率']:.0%} まで低下"
+                    f"（累計接触回数 {row['現在累計接触回数']:.1f}回）"
+                )
+            st.dataframe(
+                fatigue.drop(columns=["広告の名前"]).style.format({
+                    "減衰係数": "{:.3f}",
+                    "初回接触CTR推定": "{:.2f}%",
+                    "現在CTR推定": "{:.2f}%",
+                    "現在累計接触回数": "{:.1f}",
+                    "CTR残存率": "{:.0%}",
+                    "CTR半減接触回数": "{:.1f}",
+                    "決定係数": "{:.2f}",
+                }, na_rep="-"),
+                use_container_width=True,
+            )
+        with tab5:
+            effects = results["attribute_effects"]
+            if len(effects) == 0:
+                st.caption("広告数が少ないため属性効果は推定していません")
+            else:
+                show_chart("effects")
+                st.caption(f"他の属性を固定したときの差（インプレッション加重回帰）。[下限, 上限] は{ci_label(effects)}"
+                           "ブートストラップ区間。CTR・視聴率はポイント差、CPA は % 変化")
+                st.dataframe(
+                    effects.drop(columns="信頼水準").style.format({
+                        "効果": "{:+.2f}",
+                        "下限": "{:+.2f}",
+                        "上限": "{:+.2f}",
+                        "決定係数": "{:.2f}",
+                    }, na_rep="-"),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
+    # --- AI分析 ---
+    if job.stage == "report" or "report" in results:
+        st.subheader("🤖 AI分析（Claude API）")
+        if "report_warning" in results:
+            st.warning(results["report_warning"])
+        if "report_error" in results:
+            st.error(results["report_error"])
+        if "prompt_tokens" in results:
+            st.caption(f"プロンプト見積もり: {results['prompt_tokens']:,} / 上限 {MAX_PROMPT_TOKENS:,} トークン")
+
+    if "report" in results:
+        report = results["report"]
+        st.markdown(report)
+        if "report_data" in results:
+            render_report_data(results["report_data"], key=f"report_data_{job_id}")
+
+        # --- エクスポート ---
+        st.header("Step 4: エクスポート")
+
+        col_dl1, col_dl2 = st.columns(2)
+        with col_dl1:
+            st.download_button(
+                "📥 レポートをダウンロード（Markdown）",
+                data=report,
+                file_name="analysis_report.md",
+                mime="text/markdown",
+                use_container_width=True,
+            )
+        with col_dl2:
+            st.download_button(
+                "📥 レポートをダウンロード（テキスト）",
+                data=report,
+                file_name="analysis_report.txt",
+                mime="text/plain",
+                use_container_width=True,
+            )
+
+        if "html_exports" in results:
+            exports = results["html_exports"]
+            col_dl3, col_dl4 = st.columns(2)
+            with col_dl3:
+                st.download_button(
+                    "📥 HTML（グラフ埋め込み・Notion貼り付け用）",
+                    data=exports["inline"].html,
+                    file_name="analysis_report.html",
+                    mime="text/html",
+                    use_container_width=True,
+                )
+                st.caption(exports["inline"].summary())
+            with col_dl4:
+                st.download_button(
+                    "📥 HTML + 画像ファイル（zip）",
+                    data=exports["external"].to_zip("analysis_report.html"),
+                    file_name="analysis_report.zip",
+                    mime="application/zip",
+                    use_container_width=True,
+                )
+                st.caption(exports["external"].summary())
+
+    if "run_id" in results:
+        st.caption(f"💾 分析履歴に保存しました（#{results['run_id']}）")
+
+    # 完了したらアプリ全体を再実行してポーリングを止める
+    if polling and job.finished:
+        st.rerun()
+
+
+HISTORY_DIFF_KPIS = ["配信日数", "消化金額合計", "インプレッション合計", "推定リーチ",
+                     "全体CTR", "全体CPC", "CPA", "ROAS", "3秒視聴率", "100%視聴率"]
+
+
+def render_run_history() -> None:
+    """保存済みの分析履歴の閲覧と、2回分のKPI差分比較"""
+    store = RunStore()
+    accounts = store.accounts()
+    if not accounts:
+        st.caption("保存済みの分析はまだありません")
+        return
+    account = st.selectbox("アカウント", accounts, key="history_account")
+    runs = store.list_runs(account=account)
+    labels = {
+        row.run_id: f"#{row.run_id}  {row.window_start} 〜 {row.window_end}（{row.created_at} 実行）"
+        for row in runs.itertuples()
+    }
+    col_new, col_base = st.columns(2)
+    with col_new:
+        new_id = st.selectbox("表示する分析", list(labels), format_func=labels.get, key="history_new")
+    with col_base:
+        base_options = [None] + [rid for rid in labels if rid != new_id]
+        base_id = st.selectbox(
+            "比較対象（前回）", base_options,
+            format_func=lambda rid: "（比較しない）" if rid is None else labels[rid],
+            key="history_base",
+        )
+
+    run = store.load_run(new_id)
+    if base_id is not None:
+        diff = store.diff_runs(base_id, new_id, kpis=HISTORY_DIFF_KPIS)
+        st.markdown("**KPI差分（今回 − 前回）**")
+        st.dataframe(
+            diff.drop(columns=["広告の名前"]).style.format({
+                "前回": "{:,.2f}",
+                "今回": "{:,.2f}",
+                "差分": "{:+,.2f}",
+                "変化率(%)": "{:+.1f}%",
+            }, na_rep="-"),
+            use_container_width=True,
+        )
+    else:
+        summary = run["summary"]
+        st.dataframe(
+            summary[[c for c in ["クリエイティブ短縮名"] + HISTORY_DIFF_KPIS if c in summary.columns]],
+            use_container_width=True,
+        )
+    for name, png in run["figures"].items():
+        with st.expander(f"📈 {name}"):
+            st.image(png, use_container_width=True)
+    if run["report"]:
+        with st.expander("🤖 AI分析レポート"):
+            st.markdown(run["report"])
+    if run["report_data"]:
+        render_report_data(run["report_data"], key=f"history_report_data_{new_id}")
+
+    ranking = store.ranking_history(account)
+    if ranking["run_id"].nunique() > 1:
+        with st.expander("🏆 総合ランキングの推移（構造化レポート）"):
+            st.dataframe(
+                ranking.assign(期間=ranking["開始日"] + "〜" + ranking["終了日"])
+                .pivot_table(index="クリエイティブ", columns="期間", values="順位", aggfunc="min"),
+                use_container_width=True,
+            )
+
+
 # ── ページ設定 ────────────────────────────────────────
 st.set_page_config(
     page_title="Ad Creative Analyzer",
@@ -89,6 +809,17 @@ with st.sidebar:
     st.divider()
     st.caption("Powered by Claude API (Sonnet 4.5)")
 
+    # 管理者向け: 共有キャッシュの統計（URLに ?admin=<ADMIN_KEY> を付けると表示）
+    admin_key = _get_secret("ADMIN_KEY")
+    if admin_key and st.query_params.get("admin") == admin_key:
+        st.divider()
+        st.subheader("🛠 共有キャッシュ")
+        shared_cache = get_cache()
+        st.caption(f"使用量: {shared_cache.used_bytes / 1024 ** 2:,.1f} / {shared_cache.max_bytes / 1024 ** 2:,.0f} MB")
+        st.dataframe(shared_cache.stats(), hide_index=True, use_container_width=True)
+        if st.button("🗑 キャッシュをクリア"):
+            shared_cache.clear()
+
 # ── Step 1: ファイルアップロード ──────────────────────────
 st.header("Step 1: データアップロード")
 
@@ -115,21 +846,42 @@ with col2:
 if excel_file and creative_files:
     st.header("Step 2: データ確認・紐付け")
 
-    # Excel処理
-    df = process_excel(excel_file)
+    # Excel処理（同じ内容のファイルはセッションをまたいで共有キャッシュから取得）
+    cache = get_cache()
+    export_key = content_hash(excel_file.getvalue())
+    df = cache.get_or_compute("export", export_key, lambda: process_excel(excel_file))
     ad_names = df["広告の名前"].unique().tolist()
 
     st.subheader("📊 パフォーマンスデータ プレビュー")
-    st.dataframe(df.head(10), use_container_width=True)
+    preview = cache.get_or_compute("arrow_table", export_key, lambda: PagedTable(df, key=export_key))
+    render_paged_table(preview, key="preview", page_size=20)
     st.caption(f"全 {len(df)} 行 / 広告 {len(ad_names)} 本 / "
                f"期間: {df['レポート開始日'].min().strftime('%Y/%m/%d')} 〜 {df['レポート開始日'].max().strftime('%Y/%m/%d')}")
 
+    # 期間フィルタ用の日付インデックス（同じファイルの間は再構築しない）
+    date_index = cache.get_or_compute("date_index", export_key, lambda: DateRangeIndex(prepare_active_df(df)))
+    breakdown_rollup = None
+    if detect_breakdowns(df):
+        breakdown_rollup = cache.get_or_compute("breakdown", export_key, lambda: BreakdownRollup(df))
+
+    date_range = st.slider(
+        "📅 分析期間",
+        min_value=date_index.min_date.date(),
+        max_value=date_index.max_date.date(),
+        value=(date_index.min_date.date(), date_index.max_date.date()),
+        format="YYYY/MM/DD",
+    )
+    default_account = str(df["アカウント名"].iloc[0]) if "アカウント名" in df.columns else excel_file.name.rsplit(".", 1)[0]
+    account = st.text_input("🏷 アカウント名（分析履歴の保存・比較に使用）", value=default_account)
+
     # クリエイティブファイル処理（JSON / MD 両対応・1動画1ファイル）
     parsed_jsons = []
     for cf in creative_files:
         if cf.name.endswith(".md"):
             md_text = cf.read().decode("utf-8")
-            md_result = parse_creative_md(md_text, cf.name)
+            md_result = cache.get_or_compute(
+                "creative_md", content_hash(md_text, cf.name), lambda: parse_creative_md(md_text, cf.name),
+            )
             if md_result["ok"]:
                 parsed_jsons.append(md_result["result"])
                 vid = md_result["result"]["content"].get("video_id", "?")
@@ -152,53 +904,67 @@ if excel_file and creative_files:
                 st.markdown("**定性分析:**")
                 st.markdown(cr["_qualitative_text"][:500] + ("..." if len(cr["_qualitative_text"]) > 500 else ""))
 
-    # 紐付けUI
+    # 紐付けUI（文字 n-gram の類似度で自動提案し、確定済みの紐付けがあればそれを初期値にする）
     st.subheader("🔗 広告名 ↔ クリエイティブJSON の紐付け")
-    st.caption("Excel内の広告名と、JSONのクリエイティブを対応させてください")
-
-    mapping = {}
-    short_names = {}
-    for ad_name in ad_names:
-        col_a, col_b = st.columns([2, 1])
-        with col_a:
-            video_options = ["（対応なし）"] + [cr["video_id"] for cr in creatives]
-            selected = st.selectbox(
-                f"「{ad_name}」に対応するJSON",
-                video_options,
-                key=f"map_{ad_name}",
-            )
-            if selected != "（対応なし）":
-                mapping[ad_name] = selected
-        with col_b:
-            sname = st.text_input("短縮名", value=ad_name[:10], key=f"short_{ad_name}")
-            short_names[ad_name] = sname
+    st.caption("自動提案された紐付けを確認し、違うものは video_id を選び直してください（空欄 = 対応なし）")
+
+    confirmed = RunStore().load_mappings(account)
+    confirmed_ids = dict(zip(confirmed["広告の名前"], confirmed["video_id"]))
+    confirmed_short = confirmed.dropna(subset=["クリエイティブ短縮名"]).set_index("広告の名前")["クリエイティブ短縮名"].to_dict()
+    matcher = CreativeMatcher(creatives)
+    proposals = cache.get_or_compute(
+        "mapping",
+        content_hash(ad_names, matcher.video_ids, [cr.get("_filename") for cr in creatives], confirmed_ids),
+        lambda: matcher.propose(ad_names, confirmed=confirmed_ids),
+    )
+    proposals = proposals.assign(
+        クリエイティブ短縮名=[confirmed_short.get(ad) or ad[:10] for ad in proposals["広告の名前"]],
+        確定=proposals["根拠"] == "確定済み",
+    )
+    edited = st.data_editor(
+        proposals[["広告の名前", "video_id", "クリエイティブ短縮名", "確定", "スコア", "根拠", "候補"]],
+        column_config={
+            "video_id": st.column_config.SelectboxColumn("video_id", options=matcher.video_ids),
+            "クリエイティブ短縮名": st.column_config.TextColumn("短縮名"),
+            "確定": st.column_config.CheckboxColumn("確定", help="チェックした行（と選び直した行）だけを次回の初期値として保存します"),
+            "スコア": st.column_config.ProgressColumn("スコア", min_value=0.0, max_value=1.0, format="%.2f"),
+        },
+        disabled=["広告の名前", "スコア", "根拠", "候補"],
+        hide_index=True,
+        use_container_width=True,
+        key="mapping_editor",
+    )
+    counts = proposals["根拠"].value_counts()
+    st.caption(" / ".join(f"{label} {int(counts.get(label, 0))} 件" for label in ["確定済み", "自動", "要確認", "該当なし"])
+               + "（要確認 = 1位と2位の候補のスコアが近いもの）")
+
+    mapping = {ad: vid for ad, vid in zip(edited["広告の名前"], edited["video_id"]) if isinstance(vid, str) and vid}
+    short_names = {
+        ad: (sname if isinstance(sname, str) and sname else ad[:10])
+        for ad, sname in zip(edited["広告の名前"], edited["クリエイティブ短縮名"])
+    }
+    # 確定済みとして保存するのは、確定にチェックした行と、提案から選び直した行だけ
+    # （確認していない自動提案を保存すると、次回はスコア 1.0 の確定済みとして扱われてしまう）
+    reviewed = edited["確定"].fillna(False).to_numpy(dtype=bool) \
+        | (edited["video_id"].fillna("").to_numpy() != proposals["video_id"].fillna("").to_numpy()) \
+        | (edited["クリエイティブ短縮名"].fillna("").to_numpy() != proposals["クリエイティブ短縮名"].to_numpy())
+    reviewed_ads = set(edited.loc[reviewed, "広告の名前"])
 
     # 紐付けからクリエイティブ属性DataFrameを構築
-    df["クリエイティブ短縮名"] = df["広告の名前"].map(short_names)
-
-    creative_attrs_rows = []
-    for ad_name, video_id in mapping.items():
-        cr = next((c for c in creatives if c["video_id"] == video_id), None)
-        if cr:
-            creative_attrs_rows.append({
-                "広告の名前": ad_name,
-                "クリエイティブ短縮名": short_names.get(ad_name, ad_name),
-                "video_id": cr["video_id"],
-                "creative_type": cr["creative_type"],
-                "duration_sec": cr["duration_sec"],
-                "duration_category": cr["duration_category"],
-                "hook_strength_score": cr["hook_strength_score"],
-                "primary_angle": cr["primary_angle"],
-                "segment_count": cr["segment_count"],
-                "hook_duration_sec": cr["hook_duration_sec"],
-                "body_duration_sec": cr["body_duration_sec"],
-                "cta_duration_sec": cr["cta_duration_sec"],
-            })
-
-    creative_attrs = pd.DataFrame(creative_attrs_rows) if creative_attrs_rows else None
+    df = df.assign(クリエイティブ短縮名=df["広告の名前"].map(short_names))
+
+    creative_attrs = build_creative_attrs(mapping, short_names, creatives)
 
     # ── Step 3 & 4: 分析実行 ──────────────────────────────
     st.header("Step 3: 分析実行")
+    structured = st.toggle(
+        "🧾 構造化データ（ランキング・所見・推奨事項の JSON）も出力する", value=True,
+        help="Markdown レポートと同じ内容をスキーマ検証済みの JSON でも受け取り、分析履歴に保存します",
+    )
+    cluster = st.toggle(
+        f"🧬 広告数が{CLUSTER_MIN_ADS}本を超える場合はクラスタにまとめてグラフ・AI分析に使う", value=True,
+        help="属性（尺・フック・構成・種別）と KPI の近い広告を k-means でまとめ、クラスタ単位の合計比で表示・分析します",
+    )
 
     if st.button("🚀 分析開始", type="primary", use_container_width=True):
 
@@ -206,89 +972,39 @@ if excel_file and creative_files:
             st.error("少なくとも1つの広告名とJSONを紐付けてください")
             st.stop()
 
-        # --- 定量分析 ---
-        with st.spinner("📊 定量分析を実行中..."):
-            active_df, summary = build_summary(df, creative_attrs)
-
-        st.subheader("📋 KPIサマリー")
-        display_cols = ["クリエイティブ短縮名", "配信日数", "消化金額合計",
-                        "インプレッション合計", "全体CTR", "全体CPC", "CPA",
-                        "3秒視聴率", "100%視聴率"]
-        available = [c for c in display_cols if c in summary.columns]
-        st.dataframe(
-            summary[available].style.format({
-                "消化金額合計": "¥{:,.0f}",
-                "インプレッション合計": "{:,.0f}",
-                "全体CTR": "{:.2f}%",
-                "全体CPC": "¥{:,.0f}",
-                "CPA": "¥{:,.0f}",
-                "3秒視聴率": "{:.1f}%",
-                "100%視聴率": "{:.1f}%",
-            }),
-            use_container_width=True,
+        # 確認済みの紐付けを確定済みとして保存（次回アップロード時の初期値になる）。対応なしに直したものは取り消す
+        store = RunStore()
+        store.save_mappings(account, {ad: vid for ad, vid in mapping.items() if ad in reviewed_ads}, short_names)
+        store.delete_mappings(account, [ad for ad in reviewed_ads if ad not in mapping])
+
+        # 実行中の前回ジョブは破棄してから投入する
+        runner = get_runner()
+        if st.session_state.get("analysis_job_id"):
+            runner.cancel(st.session_state["analysis_job_id"])
+        st.session_state["analysis_job_id"] = runner.submit(
+            analysis_job,
+            list(STAGE_LABELS),
+            export_key=export_key,
+            account=account,
+            date_index=date_index,
+            date_range=date_range,
+            short_names=short_names,
+            creative_attrs=creative_attrs,
+            creatives=creatives,
+            mapping=mapping,
+            breakdown_rollup=breakdown_rollup,
+            breakdown_dims=detect_breakdowns(df),
+            api_key=api_key,
+            structured=structured,
+            cluster=cluster,
         )
 
-        # --- グラフ表示 ---
-        st.subheader("📈 パフォーマンスグラフ")
-        tab1, tab2, tab3, tab4 = st.tabs(["KPI比較", "視聴維持率", "コスト効率", "日次推移"])
-
-        with tab1:
-            fig = generate_kpi_chart(summary)
-            st.pyplot(fig)
-        with tab2:
-            fig = generate_retention_chart(summary)
-            st.pyplot(fig)
-        with tab3:
-            fig = generate_cost_matrix(summary)
-            st.pyplot(fig)
-        with tab4:
-            fig = generate_daily_trend(active_df)
-            st.pyplot(fig)
-
-        # --- AI分析 ---
-        st.subheader("🤖 AI分析（Claude API）")
-
-        if not api_key:
-            st.warning("APIキーが設定されていません。管理者に連絡してください。")
-            st.stop()
-
-        kpi_text = build_kpi_text(summary)
-        creative_json_for_api = [cr for cr in creatives if cr["video_id"] in mapping.values()]
-
-        with st.spinner("🧠 Claude API で分析中...（30秒〜1分ほどかかります）"):
-            try:
-                report = run_analysis(
-                    api_key=api_key,
-                    kpi_summary_text=kpi_text,
-                    creative_jsons=creative_json_for_api,
-                )
-                st.session_state["report"] = report
-            except Exception as e:
-                st.error(f"API呼び出しエラー: {e}")
-                st.stop()
-
-        st.markdown(report)
-
-        # --- エクスポート ---
-        st.header("Step 4: エクスポート")
-
-        col_dl1, col_dl2 = st.columns(2)
-        with col_dl1:
-            st.download_button(
-                "📥 レポートをダウンロード（Markdown）",
-                data=report,
-                file_name="analysis_report.md",
-                mime="text/markdown",
-                use_container_width=True,
-            )
-        with col_dl2:
-            st.download_button(
-                "📥 レポートをダウンロード（テキスト）",
-                data=report,
-                file_name="analysis_report.txt",
-                mime="text/plain",
-                use_container_width=True,
-            )
+    # 実行中は1秒ごとにフラグメントだけを再描画して部分結果を表示する
+    job_id = st.session_state.get("analysis_job_id")
+    if job_id:
+        job = get_runner().get(job_id)
+        polling = job is not None and not job.finished
+        st.fragment(render_analysis_job, run_every=1.0 if polling else None)(job_id, polling)
 
 elif excel_file:
     st.info("クリエイティブ分析ファイル（JSON or MD）もアップロードしてください")
@@ -296,3 +1012,8 @@ elif creative_files:
     st.info("パフォーマンスデータ（Excel/CSV）もアップロードしてください")
 else:
     st.info("Excel（パフォーマンスデータ）と クリエイティブ分析（JSON or MD）をアップロードしてください")
+
+# ── 分析履歴 ──────────────────────────────────────────
+st.divider()
+with st.expander("🕘 分析履歴（過去の分析の閲覧・比較）"):
+    render_run_history()
@@ -0,0 +1,109 @@
+"""
+属性キューブ：クリエイティブ属性 × KPI分子/分母 の事前集計
+広告単位のサマリーを全属性の組み合わせで1度だけ集計し（ベースキューボイド）、
+任意の属性でのスライス・ロールアップはベースから再集計する。
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+from metrics import SUM_COLUMNS, add_kpis, safe_divide
+
+
+# キューブの次元にするクリエイティブ属性（サマリーに存在するものだけを使う）
+CUBE_DIMENSIONS = [
+    "creative_type",
+    "duration_category",
+    "hook_technique",
+    "primary_angle",
+    "has_authority_figure",
+    "has_split_screen",
+    "has_skeptic_element",
+    "has_scientific_explanation",
+]
+
+# 広告単位で単純平均する数値属性: 属性名 → (合計列名, 件数列名)
+# 欠損は合計にも件数にも含めない（値のある広告が無いグループの平均は NaN）
+MEAN_ATTRIBUTES = {
+    "hook_strength_score": ("_hook_strength_score合計", "_hook_strength_score件数"),
+    "duration_sec": ("_duration_sec合計", "_duration_sec件数"),
+}
+
+MISSING_LABEL = "（不明）"
+
+
+class AttributeCube:
+    """
+    クリエイティブ属性キューブ
+
+    Usage:
+        cube = AttributeCube(summary)
+        cube.rollup(["duration_category"])                  # 長尺 vs 短尺
+        cube.rollup(["hook_technique", "has_split_screen"]) # 2軸クロス
+        cube.slice(["primary_angle"], duration_category="短尺")
+    """
+
+    def __init__(self, summary: pd.DataFrame, dims: list[str] | None = None):
+        self.dims = [d for d in (dims or CUBE_DIMENSIONS) if d in summary.columns]
+        self.measures = [c for c in list(SUM_COLUMNS) + ["配信日数"] if c in summary.columns] + ["広告数"]
+
+        base = summary.copy()
+        base["広告数"] = 1
+        for attr, (total, count) in MEAN_ATTRIBUTES.items():
+            if attr in base.columns:
+                values = pd.to_numeric(base[attr], errors="coerce")
+                base[total] = values.fillna(0)
+                base[count] = values.notna().astype(int)
+                self.measures += [total, count]
+        for d in self.dims:
+            base[d] = base[d].astype(object).where(base[d].notna(), MISSING_LABEL)
+
+        # ベースキューボイド（全次元の組み合わせ単位の合計）
+        if self.dims:
+            self.base = base.groupby(self.dims, sort=True)[self.measures].sum().reset_index()
+        else:
+            self.base = base[self.measures].sum().to_frame().T
+        self._rollups: dict[tuple[str, ...], pd.DataFrame] = {}
+
+    def rollup(self, dims: list[str] | tuple[str, ...] = ()) -> pd.DataFrame:
+        """指定した属性でロールアップしたKPIテーブルを返す（結果はメモ化）"""
+        key = tuple(dims)
+        unknown = [d for d in key if d not in self.dims]
+        if unknown:
+            raise KeyError(f"キューブに無い属性です: {unknown}")
+        if key not in self._rollups:
+            self._rollups[key] = self._finalize(self._group(self.base, key))
+        return self._rollups[key].copy()
+
+    def slice(self, dims: list[str] | tuple[str, ...] = (), **filters) -> pd.DataFrame:
+        """属性値で絞り込んだ上でロールアップする（例: slice(["hook_technique"], duration_category="短尺")）"""
+        base = self.base
+        for dim, value in filters.items():
+            if dim not in self.dims:
+                raise KeyError(f"キューブに無い属性です: {dim}")
+            base = base[base[dim] == value]
+        return self._finalize(self._group(base, tuple(dims)))
+
+    def marginals(self) -> pd.DataFrame:
+        """全属性について1軸ロールアップを縦に連結したテーブル（属性, 値, KPI…）"""
+        frames = []
+        for d in self.dims:
+            t = self.rollup([d]).rename(columns={d: "値"})
+            t.insert(0, "属性", d)
+            t["値"] = t["値"].astype(str)
+            frames.append(t)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def _group(self, base: pd.DataFrame, dims: tuple[str, ...]) -> pd.DataFrame:
+        if not dims:
+            return base[self.measures].sum().to_frame().T
+        return base.groupby(list(dims), sort=True)[self.measures].sum().reset_index()
+
+    @staticmethod
+    def _finalize(frame: pd.DataFrame) -> pd.DataFrame:
+        frame = add_kpis(frame)
+        for attr, (total, count) in MEAN_ATTRIBUTES.items():
+            if total in frame.columns:
+                frame[f"平均{attr}"] = safe_divide(frame[total], frame[count])
+                frame = frame.drop(columns=[total, count])
+        return frame
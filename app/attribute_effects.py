@@ -0,0 +1,299 @@
+"""
+属性効果の回帰分析：クリエイティブ属性が CTR / CPA / 視聴率をどれだけ動かすかを全広告で同時に推定する
+- 説明変数: 尺・フック強度・構成（標準化、+1SD あたり）+ 種別・尺カテゴリ・訴求軸・フック手法（最多の値が基準）+ has_* フラグ
+- 目的変数: 広告別の 全体CTR / 3秒視聴率 / 100%視聴率（pt）と CPA（対数 → % 変化）
+- 推定: インプレッション加重の最小二乗（わずかなリッジで多重共線性に備える）を全指標まとめて正規方程式で解く
+- 区間: 広告単位のブートストラップ。リサンプルは重み（出現回数 × インプレッション）の違いだけなので、
+  全リサンプル × 全指標の正規方程式を1回のバッチ行列演算で作って np.linalg.solve でまとめて解く
+散布図の目視（4点）の代わりに、他の属性を固定したときの差と不確かさを、グラフとプロンプトの両方に渡す。
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from metrics import KPIS, safe_divide
+
+
+MIN_ADS = 10              # これ未満の広告数では推定しない（区間が意味を持たないため）
+MIN_LEVEL_ADS = 2         # カテゴリの値がこの本数未満なら説明変数にしない
+RIDGE = 1e-3              # リッジ係数（X'WX の対角平均に対する比。切片には掛けない）
+N_BOOT = 300
+MAX_PROMPT_EFFECTS = 20   # プロンプトに載せる効果の行数
+
+# 再標本化1チャンクあたりの最大要素数（リサンプル × 指標 × 広告数 × 説明変数）
+_CHUNK_ELEMENTS = 4_000_000
+
+# 目的変数: KPI → (単位, 対数をとるか)
+OUTCOMES = {
+    "全体CTR": ("pt", False),
+    "CPA": ("%", True),
+    "3秒視聴率": ("pt", False),
+    "100%視聴率": ("pt", False),
+}
+WEIGHT_COL = "インプレッション合計"
+
+NUMERIC_FEATURES = {
+    "duration_sec": ("動画尺", "秒"),
+    "hook_strength_score": ("フック強度", "点"),
+    "segment_count": ("セグメント数", ""),
+    "hook_ratio": ("フック比率", "%"),
+    "segment_density": ("セグメント密度", "seg/秒"),
+}
+CATEGORICAL_FEATURES = {
+    "creative_type": "種別",
+    "duration_category": "尺カテゴリ",
+    "primary_angle": "訴求軸",
+    "hook_technique": "フック手法",
+}
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 説明変数
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def flag_columns(summary: pd.DataFrame, creatives: list[dict] | None = None) -> pd.DataFrame:
+    """
+    has_* フラグ（1.0 / 0.0、不明は NaN）。サマリーに列があればそれを、
+    無ければ video_id で紐付けたクリエイティブの analysis_summary から引く
+    """
+    columns = {c: summary[c] for c in summary.columns if c.startswith("has_")}
+    if not columns and creatives and "video_id" in summary.columns:
+        by_id = {
+            cr["video_id"]: {k: v for k, v in cr.get("_raw_json", {}).get("analysis_summary", {}).items()
+                             if k.startswith("has_") and isinstance(v, bool)}
+            for cr in creatives
+        }
+        rows = [by_id.get(vid, {}) for vid in summary["video_id"]]
+        names = sorted({k for flags in by_id.values() for k in flags})
+        columns = {f: [r.get(f) for r in rows] for f in names}
+    flags = pd.DataFrame(columns, index=summary.index)
+    return flags.apply(lambda s: s.map({True: 1.0, False: 0.0}).astype(float))
+
+
+def design_matrix(summary: pd.DataFrame, creatives: list[dict] | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    回帰の説明変数（切片は含まない）と、その読み方
+
+    Returns: (X: 広告数 × 説明変数, info: 特徴・変化（例: +1SD = 12.3秒 / 該当（基準: UGC））)
+    """
+    frame = summary.copy()
+    if {"hook_duration_sec", "duration_sec"} <= set(frame.columns):
+        frame["hook_ratio"] = safe_divide(
+            pd.to_numeric(frame["hook_duration_sec"], errors="coerce"),
+            pd.to_numeric(frame["duration_sec"], errors="coerce"), 100,
+        )
+    if {"segment_count", "duration_sec"} <= set(frame.columns):
+        frame["segment_density"] = safe_divide(
+            pd.to_numeric(frame["segment_count"], errors="coerce"),
+            pd.to_numeric(frame["duration_sec"], errors="coerce"),
+        )
+
+    columns, info = {}, []
+    for col, (label, unit) in NUMERIC_FEATURES.items():
+        if col not in frame.columns:
+            continue
+        values = pd.to_numeric(frame[col], errors="coerce").astype(float)
+        sd = values.std(ddof=0)
+        if not np.isfinite(sd) or sd == 0:
+            continue
+        # 標準化し、欠損は平均（= 0）で埋める → 係数は「+1SD あたりの差」
+        columns[label] = ((values - values.mean()) / sd).fillna(0.0)
+        info.append((label, f"+1SD（{sd:.3g}{unit}）"))
+
+    for col, label in CATEGORICAL_FEATURES.items():
+        if col not in frame.columns:
+            continue
+        values = frame[col].astype(object).where(frame[col].notna())
+        counts = values.value_counts()
+        if len(counts) < 2:
+            continue
+        reference = counts.index[0]
+        for level in counts.index[1:]:
+            if counts[level] >= MIN_LEVEL_ADS:
+                columns[f"{label}: {level}"] = (values == level).astype(float)
+                info.append((f"{label}: {level}", f"該当（基準: {reference}）"))
+
+    flags = flag_columns(frame, creatives)
+    for col in flags.columns:
+        values = flags[col]
+        if values.nunique() < 2:
+            continue
+        columns[col] = values.fillna(values.mean())
+        info.append((col, "あり（vs なし）"))
+
+    X = pd.DataFrame(columns, index=summary.index)
+    return X, pd.DataFrame(info, columns=["特徴", "変化"])
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 加重最小二乗（全リサンプル × 全指標をまとめて解く）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _outcomes(summary: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """広告数 × 指標 の目的変数と重み（目的変数が定義できない広告は重み0）"""
+    weight = pd.to_numeric(summary[WEIGHT_COL], errors="coerce").fillna(0).to_numpy(dtype=float)
+    weight = weight / weight.mean() if weight.sum() > 0 else np.ones(len(summary))
+    Y = np.zeros((len(summary), len(OUTCOMES)))
+    W = np.zeros_like(Y)
+    for j, (kpi, (_, log)) in enumerate(OUTCOMES.items()):
+        num, den, scale = KPIS[kpi]
+        if num not in summary.columns or den not in summary.columns:
+            continue
+        y = np.asarray(safe_divide(summary[num], summary[den], scale), dtype=float)
+        if log:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                y = np.log(y)
+        valid = np.isfinite(y)
+        Y[valid, j] = y[valid]
+        W[:, j] = np.where(valid, weight, 0.0)
+    return Y, W
+
+
+def weighted_lstsq(X: np.ndarray, Y: np.ndarray, W: np.ndarray, ridge: float = RIDGE) -> np.ndarray:
+    """
+    重み付き最小二乗をバッチで解く
+
+    Args:
+        X: (広告数, 説明変数) 先頭列が切片
+        Y: (広告数, 指標)
+        W: (リサンプル, 広告数, 指標) の重み
+    Returns:
+        (リサンプル, 指標, 説明変数) の係数（重みが全て0の系は NaN）
+    """
+    n, p = X.shape
+    B, _, m = W.shape
+    coefs = np.empty((B, m, p))
+    step = max(1, _CHUNK_ELEMENTS // max(m * n * p, 1))
+    penalty = np.eye(p)
+    penalty[0, 0] = 0.0
+    for b0 in range(0, B, step):
+        Wc = W[b0:b0 + step].transpose(0, 2, 1)                 # (b, m, n)
+        XW = Wc[..., None] * X                                 # (b, m, n, p)
+        A = XW.transpose(0, 1, 3, 2) @ X                       # (b, m, p, p)
+        rhs = np.einsum("bmnp,nm->bmp", XW, Y)                 # (b, m, p)
+        scale = np.trace(A, axis1=2, axis2=3)[..., None, None] / p
+        # 重みが全て0（リサンプルで有効な広告が1本も引かれない等）の系は解けないので NaN にする
+        empty = scale[..., 0, 0] <= 0
+        A = np.where(empty[..., None, None], np.eye(p), A + ridge * scale * penalty)
+        solved = np.linalg.solve(A, rhs[..., None])[..., 0]
+        solved[empty] = np.nan
+        coefs[b0:b0 + step] = solved
+    return coefs
+
+
+def fit_attribute_effects(
+    summary: pd.DataFrame,
+    creatives: list[dict] | None = None,
+    n_boot: int = N_BOOT,
+    ci: float = 0.95,
+    seed: int | None = 0,
+) -> pd.DataFrame:
+    """
+    属性効果を推定する（広告数が MIN_ADS 未満、または説明変数が無ければ空の DataFrame）
+
+    Returns:
+        指標, 特徴, 変化, 効果, 下限, 上限, 単位, 有意, 広告数, 決定係数, 信頼水準
+        効果は他の属性を固定したときの差（視聴率・CTR は pt、CPA は % 変化）。
+        有意 = ブートストラップ区間（信頼水準 ci）が0をまたがない
+    """
+    columns = ["指標", "特徴", "変化", "効果", "下限", "上限", "単位", "有意", "広告数", "決定係数", "信頼水準"]
+    if len(summary) < MIN_ADS or WEIGHT_COL not in summary.columns:
+        return pd.DataFrame(columns=columns)
+    features, info = design_matrix(summary, creatives)
+    if features.shape[1] == 0:
+        return pd.DataFrame(columns=columns)
+
+    X = np.column_stack([np.ones(len(features)), features.to_numpy(dtype=float)])
+    Y, W = _outcomes(summary)
+    # 目的変数を定義できる広告が MIN_ADS 本未満の指標（購入0件の期間の CPA など）は推定しない
+    n_used = (W > 0).sum(axis=0)
+    used = np.flatnonzero(n_used >= MIN_ADS)
+    if len(used) == 0:
+        return pd.DataFrame(columns=columns)
+    outcomes = [list(OUTCOMES.items())[j] for j in used]
+    Y, W, n_used = Y[:, used], W[:, used], n_used[used]
+    point = weighted_lstsq(X, Y, W[None])[0]                   # (m, p)
+
+    rng = np.random.default_rng(seed)
+    n = len(X)
+    counts = rng.multinomial(n, np.full(n, 1.0 / n), size=n_boot).astype(float)
+    boot = weighted_lstsq(X, Y, counts[:, :, None] * W[None])  # (B, m, p)
+    lo, hi = np.nanquantile(boot, [(1 - ci) / 2, 1 - (1 - ci) / 2], axis=0)
+
+    # 加重決定係数
+    fitted = X @ point.T
+    mean = (W * Y).sum(axis=0) / np.maximum(W.sum(axis=0), 1e-12)
+    ss_res = (W * (Y - fitted) ** 2).sum(axis=0)
+    ss_tot = (W * (Y - mean) ** 2).sum(axis=0)
+    r2 = 1 - safe_divide(ss_res, ss_tot)
+
+    frames = []
+    for j, (kpi, (unit, log)) in enumerate(outcomes):
+        est = np.vstack([point[j, 1:], lo[j, 1:], hi[j, 1:]])
+        if log:
+            # 対数の差 → % 変化
+            est = np.expm1(est) * 100
+        frames.append(info.assign(
+            指標=kpi, 効果=est[0], 下限=est[1], 上限=est[2], 単位=unit,
+            有意=(est[1] > 0) | (est[2] < 0), 広告数=int(n_used[j]), 決定係数=r2[j], 信頼水準=ci,
+        ))
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# プロンプト
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def ci_label(effects: pd.DataFrame) -> str:
+    """推定に使った区間の信頼水準の表示（例: "95%"）"""
+    return f"{effects['信頼水準'].iloc[0]:.0%}" if len(effects) else ""
+
+
+def build_effects_text(effects: pd.DataFrame, max_rows: int = MAX_PROMPT_EFFECTS) -> str:
+    """属性効果の Markdown 表（有意なものを先に、区間幅に対して効果が大きい順に max_rows 行）"""
+    if len(effects) == 0:
+        return ""
+    width = (effects["上限"] - effects["下限"]).abs().replace(0, np.nan)
+    ranked = effects.assign(_強さ=(effects["効果"].abs() / width).fillna(0)) \
+        .sort_values(["有意", "_強さ"], ascending=False, kind="stable").head(max_rows)
+    fits = effects.drop_duplicates("指標")
+    level = ci_label(effects)
+    lines = [
+        "\n## 属性効果（全広告のインプレッション加重回帰）\n",
+        f"※ 広告{int(effects['広告数'].max())}本。他の属性を固定したときの差で、[ ] 内は{level}ブートストラップ区間。"
+        "区間が0をまたぐ効果は有意でないものとして扱うこと。"
+        "CTR・視聴率はポイント差、CPA は % 変化。\n",
+        "※ 決定係数: " + " / ".join(f"{k} {v:.2f}" for k, v in zip(fits["指標"], fits["決定係数"])) + "\n",
+        f"| 指標 | 特徴 | 変化 | 効果 | {level}区間 | 有意 |",
+        "|---|---|---|---|---|---|",
+    ]
+    for row in ranked.itertuples(index=False):
+        lines.append(
+            f"| {row.指標} | {row.特徴} | {row.変化} | {row.効果:+.2f}{row.単位} "
+            f"| [{row.下限:+.2f}, {row.上限:+.2f}] | {'○' if row.有意 else ''} |"
+        )
+    omitted = len(effects) - len(ranked)
+    if omitted > 0:
+        lines.append(f"\n※ 他{omitted}件（区間の幅に対して効果の小さいもの）は省略。")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # 回帰確認: 購入0件の期間（CPA が全広告で未定義）でも落ちずに、CPA 以外の指標だけを推定すること
+    rng = np.random.default_rng(0)
+    n_ads = 30
+    imp = rng.lognormal(10, 1, n_ads).round()
+    summary = pd.DataFrame({
+        "creative_type": rng.choice(["UGC", "アニメ", "実写デモ"], n_ads),
+        "duration_sec": rng.integers(6, 60, n_ads).astype(float),
+        "hook_strength_score": rng.integers(1, 10, n_ads).astype(float),
+        "消化金額合計": imp / 10,
+        "インプレッション合計": imp,
+        "リンククリック合計": rng.binomial(imp.astype(int), 0.01).astype(float),
+        "購入合計": 0.0,
+        "_3秒再生合計": rng.binomial(imp.astype(int), 0.3).astype(float),
+        "_100再生合計": rng.binomial(imp.astype(int), 0.05).astype(float),
+    })
+    effects = fit_attribute_effects(summary)
+    print(effects.groupby("指標", sort=False).size().to_string())
+    assert len(effects) and "CPA" not in set(effects["指標"]), effects["指標"].unique()
+    assert effects[["効果", "下限", "上限"]].notna().all().all()
+    assert len(fit_attribute_effects(summary.drop(columns=["リンククリック合計", "_3秒再生合計", "_100再生合計"]))) == 0
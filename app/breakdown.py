@@ -0,0 +1,151 @@
+"""
+ブレイクダウン対応：配置・年齢・性別・プラットフォーム別の行を含むエクスポートの集計
+全次元のコードで1度だけソートしてから np.add.reduceat で合計し（ソートベースのgroupby）、
+途中の集計レベルをキャッシュして、より粗い粒度はキャッシュ済みの最小レベルから再集計する
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from metrics import DATE_COL, SUM_COLUMNS, add_kpis, safe_divide, with_derived_columns
+
+
+# Meta広告エクスポートのブレイクダウン列
+BREAKDOWN_COLUMNS = [
+    "配置",
+    "プラットフォーム",
+    "デバイスプラットフォーム",
+    "インプレッションデバイス",
+    "年齢",
+    "性別",
+    "国",
+    "地域",
+]
+
+
+def detect_breakdowns(df: pd.DataFrame) -> list[str]:
+    """DataFrameに含まれるブレイクダウン列を返す"""
+    return [c for c in BREAKDOWN_COLUMNS if c in df.columns]
+
+
+class BreakdownRollup:
+    """
+    広告 × 日付 × ブレイクダウン次元 の合計をキャッシュ付きでロールアップする
+
+    Usage:
+        rollup = BreakdownRollup(df)
+        rollup.rollup(["広告の名前", "配置"])       # 広告 × 配置
+        rollup.kpis(["年齢", "性別"])              # 年齢 × 性別 のKPI
+        rollup.kpis(["配置"], "2026-01-23", "2026-02-06")  # 期間内の配置別KPI
+    """
+
+    def __init__(self, df: pd.DataFrame, dims: list[str] | None = None):
+        df = with_derived_columns(df)
+        self.dims = dims or ["広告の名前", DATE_COL] + detect_breakdowns(df)
+        self.measures = [src for src in SUM_COLUMNS.values() if src in df.columns]
+
+        codes = []
+        self.labels: dict[str, pd.Index] = {}
+        for d in self.dims:
+            c, uniques = pd.factorize(df[d], sort=True)
+            codes.append(c)
+            self.labels[d] = uniques
+        values = df[self.measures].fillna(0).to_numpy(dtype=float)
+
+        # 最細粒度（全次元）の合計
+        self._levels: dict[tuple[str, ...], tuple[np.ndarray, np.ndarray]] = {
+            tuple(self.dims): self._reduce(np.column_stack(codes), values),
+        }
+
+    @staticmethod
+    def _reduce(codes: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """コード行列で辞書順ソート → 境界ごとに合計（ソートベースのgroupby）"""
+        if codes.shape[1] == 0:
+            return codes[:1], values.sum(axis=0, keepdims=True)
+        if len(codes) == 0:
+            return codes, values
+        order = np.lexsort(codes.T[::-1])
+        codes, values = codes[order], values[order]
+        starts = np.concatenate([[0], np.flatnonzero(np.any(codes[1:] != codes[:-1], axis=1)) + 1])
+        return codes[starts], np.add.reduceat(values, starts, axis=0)
+
+    def _level(self, key: tuple[str, ...]) -> tuple[np.ndarray, np.ndarray]:
+        """集計レベル（コード行列, 合計行列）を返す。未計算ならキャッシュ済みの最小の上位レベルから作る"""
+        if key not in self._levels:
+            parent = min(
+                (k for k in self._levels if set(key) <= set(k)),
+                key=lambda k: len(self._levels[k][0]),
+            )
+            parent_codes, parent_values = self._levels[parent]
+            cols = [parent.index(d) for d in key]
+            self._levels[key] = self._reduce(parent_codes[:, cols], parent_values)
+        return self._levels[key]
+
+    def _key(self, dims) -> tuple[str, ...]:
+        unknown = [d for d in dims if d not in self.dims]
+        if unknown:
+            raise KeyError(f"集計できない次元です: {unknown}")
+        return tuple(d for d in self.dims if d in dims)
+
+    def rollup(self, dims: list[str] | tuple[str, ...] = (), start=None, end=None) -> pd.DataFrame:
+        """
+        指定次元の組み合わせ単位の合計（日次の列名のまま）を返す
+        start / end を指定した場合は、日付を含むレベルを期間で絞ってから集計する
+        """
+        key = self._key(dims)
+        if start is None and end is None:
+            codes, values = self._level(key)
+        else:
+            date_key = self._key(set(key) | {DATE_COL})
+            codes, values = self._level(date_key)
+            dates = np.asarray(self.labels[DATE_COL], dtype="datetime64[ns]")
+            lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start or dates[0]), "ns"), side="left")
+            hi = np.searchsorted(dates, np.datetime64(pd.Timestamp(end or dates[-1]), "ns"), side="right")
+            date_codes = codes[:, date_key.index(DATE_COL)]
+            mask = (date_codes >= lo) & (date_codes < hi)
+            cols = [date_key.index(d) for d in key]
+            codes, values = self._reduce(codes[mask][:, cols], values[mask])
+
+        frame = pd.DataFrame(values, columns=self.measures)
+        for j, d in enumerate(key):
+            labels = self.labels[d]
+            col = labels.take(np.maximum(codes[:, j], 0)).to_numpy()
+            if d not in (DATE_COL, "広告の名前"):
+                col = pd.Categorical(col, categories=labels)
+            frame.insert(j, d, col)
+            if (codes[:, j] < 0).any():
+                frame.loc[codes[:, j] < 0, d] = np.nan
+        return frame
+
+    def kpis(self, dims: list[str] | tuple[str, ...] = (), start=None, end=None) -> pd.DataFrame:
+        """rollup() の合計を集計列名に変換し、全KPIを付与する"""
+        frame = self.rollup(dims, start, end).rename(columns={src: agg for agg, src in SUM_COLUMNS.items()})
+        return add_kpis(frame)
+
+
+def collapse_breakdowns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    ブレイクダウン行を 広告 × 日 の1行に合算する（ブレイクダウンが無ければそのまま返す）
+    日次の比率列（CTR / CPC / CPM / フリークエンシー / ROAS）は合計から再計算する
+    """
+    breakdowns = detect_breakdowns(df)
+    if not breakdowns:
+        return df
+
+    daily = BreakdownRollup(df).rollup(["広告の名前", DATE_COL])
+    # 合計できない列（レポート終了日・短縮名など）は各 広告×日 の先頭行の値を使う
+    keys = ["広告の名前", DATE_COL]
+    other = [c for c in df.columns if c not in daily.columns and c not in breakdowns]
+    firsts = df.drop_duplicates(keys)[keys + other]
+    daily = daily.merge(firsts, on=keys, how="left")
+
+    daily["CTR(リンククリックスルー率)"] = safe_divide(daily["リンクのクリック"], daily["インプレッション"], 100)
+    daily["CPC(リンククリックの単価) (JPY)"] = safe_divide(daily["消化金額 (JPY)"], daily["リンクのクリック"])
+    daily["CPM(インプレッション単価) (JPY)"] = safe_divide(daily["消化金額 (JPY)"], daily["インプレッション"], 1000)
+    if "リーチ" in daily.columns:
+        # ブレイクダウン間でリーチは重複し得るため、合算リーチからの近似値
+        daily["フリークエンシー"] = safe_divide(daily["インプレッション"], daily["リーチ"])
+    daily["購入ROAS(広告費用対効果)"] = safe_divide(daily["_購入金額"], daily["消化金額 (JPY)"])
+    daily["is_active"] = daily["消化金額 (JPY)"] > 0
+    return daily
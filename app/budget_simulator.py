@@ -0,0 +1,243 @@
+"""
+予算再配分シミュレーター：広告ごとの「消化金額 → 購入」反応曲線から、予算をどこに動かすべきかを試算する
+- 反応曲線: 1日あたり 購入 = α × 消化^β（0 < β < 1 で逓減）。日次の購入数をポアソン回帰（対数リンク）で当てはめ、
+  β は全広告共通の傾きへ縮小推定する。α は β を固定したときの最尤値で、実績の消化で購入合計が一致する
+  （1日1件未満の広告が多いため、log(購入 + 0.5) の最小二乗ではなく件数の尤度で推定する）
+- 最適化: 予算の増分を限界効率（1円あたりの追加購入）の高い広告から順に配る貪欲法の連続版として、
+  全広告の限界効率が等しくなる水準 λ を求める。λ → 総予算 の対応を1度だけ格子で計算しておき、
+  シナリオ（総予算）ごとの λ は補間で引くため、数千シナリオを1回の配列演算で評価できる
+- 各広告の配分は [下限倍率 × 現在, 上限倍率 × 現在] に制限する（実績の範囲から大きく外挿しない）
+"""
+from __future__ import annotations
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+AD_COL = "広告の名前"
+DATE_COL = "レポート開始日"
+SPEND_COL = "消化金額 (JPY)"
+CONV_COL = "購入"
+
+BETA_PRIOR = 0.7          # 全体の傾きが推定できない場合の β
+BETA_RANGE = (0.2, 0.95)  # β の範囲（1 に近いほど線形 = 逓減しない）
+PRIOR_STRENGTH = 5.0      # β を全体の傾きへ縮小する強さ（購入件数 × log 消化の分散 に相当する情報量）
+BISECT_ITERS = 50         # β の尤度方程式を解く二分法の反復回数
+MIN_SCALE = 0.0           # 配分の下限（現在の消化に対する倍率。0 = 停止を許す）
+MAX_SCALE = 2.0           # 配分の上限（同上）
+GRID_SIZE = 4096          # λ → 総予算 の格子点数
+
+
+def _bisect(score, size: int) -> np.ndarray:
+    """単調減少な score(β) = 0 の解を BETA_RANGE 内で二分法で求める（size 個を同時に解く。範囲外なら端）"""
+    lo, hi = np.full(size, BETA_RANGE[0]), np.full(size, BETA_RANGE[1])
+    for _ in range(BISECT_ITERS):
+        mid = (lo + hi) / 2
+        positive = score(mid) > 0
+        lo = np.where(positive, mid, lo)
+        hi = np.where(positive, hi, mid)
+    return (lo + hi) / 2
+
+
+class ResponseCurves:
+    """
+    広告別の反応曲線と予算配分
+
+    Usage:
+        curves = ResponseCurves.fit(active_df)                  # 日次行（消化金額・購入）
+        alloc = curves.optimize([100_000, 150_000])              # (シナリオ, 広告) の1日あたり配分
+        curves.allocation_table(alloc[0])                        # 広告別の現在 vs 推奨
+        curves.scenario_table(np.linspace(5e4, 2e5, 200))        # 総予算 → 予測購入
+        curves.with_bounds(0.5, 1.5, fixed=["広告A"])              # 上下限・固定を変えた複製
+    """
+
+    def __init__(self, ads, alpha, beta, current_spend, current_conv, n_days,
+                 min_scale: float = MIN_SCALE, max_scale: float = MAX_SCALE):
+        self.ads = pd.Index(ads, name=AD_COL)
+        self.alpha = np.asarray(alpha, dtype=float)
+        self.beta = np.asarray(beta, dtype=float)
+        self.current_spend = np.asarray(current_spend, dtype=float)   # 1日あたり消化（配信日の平均）
+        self.current_conv = np.asarray(current_conv, dtype=float)     # 1日あたり購入（同上）
+        self.n_days = np.asarray(n_days)
+        self._set_bounds(min_scale, max_scale)
+
+    def __len__(self) -> int:
+        return len(self.ads)
+
+    @property
+    def no_conversions(self) -> pd.Index:
+        """期間中に購入が1件も無い広告（反応曲線が推定できず、限界効率0として下限に配分される）"""
+        return self.ads[self.alpha <= 0]
+
+    # --- 推定 ---
+    @classmethod
+    def fit(cls, active_df: pd.DataFrame, **bounds) -> "ResponseCurves":
+        """日次行（配信日のみ）から広告別の反応曲線を推定する"""
+        daily = active_df.groupby([AD_COL, DATE_COL], sort=True)[[SPEND_COL, CONV_COL]].sum().reset_index()
+        daily = daily[daily[SPEND_COL] > 0]
+        codes, ads = pd.factorize(daily[AD_COL], sort=True)
+        k = len(ads)
+        x = daily[SPEND_COL].to_numpy(dtype=float)
+        y = daily[CONV_COL].fillna(0).to_numpy(dtype=float)
+        lx = np.log(x)
+        sy = np.bincount(codes, weights=y, minlength=k)
+        sylx = np.bincount(codes, weights=y * lx, minlength=k)
+
+        def score(beta_ad: np.ndarray) -> np.ndarray:
+            """
+            広告ごとのプロファイル尤度の β 微分（α を最尤値 ΣY / Σx^β で消去したもの）
+            = Σ y·log x − ΣY × (x^β で重み付けした log x の平均)。β について単調減少
+            """
+            w = np.exp(beta_ad[codes] * lx)
+            mean_lx = np.divide(np.bincount(codes, weights=w * lx, minlength=k), np.bincount(codes, weights=w, minlength=k),
+                                out=np.zeros(k), where=sy > 0)
+            return sylx - sy * mean_lx
+
+        # 全広告共通の傾き（弱い事前分布で BETA_PRIOR に寄せ、購入が無い・消化が一定でも解が決まるようにする）
+        pooled = _bisect(lambda b: np.atleast_1d(score(np.full(k, b[0])).sum() - PRIOR_STRENGTH * (b[0] - BETA_PRIOR)), 1)[0]
+        # 広告ごとの傾き（罰則つき尤度。購入が少ない・消化のばらつきが小さい広告ほど共通の傾きに寄る）
+        beta = _bisect(lambda b: score(b) - PRIOR_STRENGTH * (b - pooled), k)
+
+        # α: β を固定したときの最尤値（実績の消化で購入合計が一致する）
+        x_beta = np.bincount(codes, weights=x ** beta[codes], minlength=k)
+        alpha = np.divide(sy, x_beta, out=np.zeros(k), where=x_beta > 0)
+        spend = np.bincount(codes, weights=x, minlength=k)
+        n = np.bincount(codes, minlength=k)
+        return cls(ads, alpha, beta, spend / np.maximum(n, 1), sy / np.maximum(n, 1), n, **bounds)
+
+    def with_bounds(self, min_scale: float = MIN_SCALE, max_scale: float = MAX_SCALE,
+                    fixed: list[str] | None = None) -> "ResponseCurves":
+        """
+        配分の上下限（現在の消化に対する倍率）を変えた複製を返す（共有キャッシュ上の推定結果は変更しない）
+        fixed の広告は現在の消化のまま固定する
+        """
+        bounded = copy.copy(self)
+        bounded._set_bounds(min_scale, max_scale, fixed)
+        return bounded
+
+    def _set_bounds(self, min_scale: float, max_scale: float, fixed: list[str] | None = None) -> None:
+        locked = self.ads.isin(fixed or [])
+        self.lower = np.where(locked, self.current_spend, self.current_spend * min_scale)
+        self.upper = np.where(locked, self.current_spend, self.current_spend * max_scale)
+        self._grid = None
+
+    # --- 曲線 ---
+    def predict(self, spend: np.ndarray) -> np.ndarray:
+        """1日あたりの予測購入（spend は (広告,) または (シナリオ, 広告)）"""
+        return self.alpha * np.power(np.maximum(spend, 0.0), self.beta)
+
+    def marginal(self, spend: np.ndarray) -> np.ndarray:
+        """限界効率（追加1円あたりの購入）。消化0では無限大"""
+        with np.errstate(divide="ignore"):
+            return self.alpha * self.beta * np.power(np.maximum(spend, 0.0), self.beta - 1)
+
+    def _spend_at(self, log_lambda: np.ndarray) -> np.ndarray:
+        """限界効率が λ になる消化（上下限でクリップ）。log_lambda は (シナリオ,)"""
+        active = self.alpha > 0
+        log_ab = np.log(np.where(active, self.alpha * self.beta, 1.0))
+        with np.errstate(over="ignore"):
+            x = np.exp((log_lambda[:, None] - log_ab) / (self.beta - 1))
+        # 購入実績の無い広告は限界効率0のため下限に置く
+        x = np.where(active, x, self.lower)
+        return np.clip(x, self.lower, self.upper)
+
+    def _lambda_grid(self) -> tuple[np.ndarray, np.ndarray]:
+        """λ（対数）の格子と、その λ で配分したときの総予算（λ の降順 = 総予算の昇順）"""
+        if self._grid is None:
+            active = self.alpha > 0
+            probe = np.concatenate([np.maximum(self.lower, 1.0), np.maximum(self.upper, 1.0)])
+            m = self.marginal(probe.reshape(2, -1))[:, active]
+            m = m[np.isfinite(m) & (m > 0)]
+            lo, hi = (np.log(m.min()) - 1, np.log(m.max()) + 1) if len(m) else (-1.0, 1.0)
+            log_lambda = np.linspace(hi, lo, GRID_SIZE)
+            totals = self._spend_at(log_lambda).sum(axis=1)
+            self._grid = (log_lambda, totals)
+        return self._grid
+
+    # --- 最適化 ---
+    def optimize(self, totals) -> np.ndarray:
+        """
+        総予算（1日あたり、シナリオごと）を限界効率が等しくなるように配分する
+
+        Returns: (シナリオ, 広告) の1日あたり配分。総予算は [下限の合計, 上限の合計] にクリップする
+        """
+        totals = np.clip(np.atleast_1d(np.asarray(totals, dtype=float)), self.lower.sum(), self.upper.sum())
+        log_lambda, grid_totals = self._lambda_grid()
+        alloc = self._spend_at(np.interp(totals, grid_totals, log_lambda))
+
+        # 格子の補間誤差は、上下限に達していない広告へ配分比で割り戻して合わせる
+        residual = totals - alloc.sum(axis=1)
+        free = (alloc > self.lower + 1e-9) & (alloc < self.upper - 1e-9)
+        share = np.where(free, alloc, 0.0)
+        denom = share.sum(axis=1, keepdims=True)
+        alloc = alloc + np.divide(share * residual[:, None], denom, out=np.zeros_like(alloc), where=denom > 0)
+        return np.clip(alloc, self.lower, self.upper)
+
+    # --- 表 ---
+    def allocation_table(self, alloc: np.ndarray, names: dict[str, str] | None = None) -> pd.DataFrame:
+        """広告別の現在 vs 推奨（1日あたり）"""
+        current = self.predict(self.current_spend)
+        planned = self.predict(alloc)
+        marginal = self.marginal(alloc)
+        table = pd.DataFrame({
+            AD_COL: self.ads,
+            "現在消化/日": self.current_spend,
+            "推奨消化/日": alloc,
+            "増減/日": alloc - self.current_spend,
+            "現在購入/日": current,
+            "予測購入/日": planned,
+            "推奨後の限界CPA": np.divide(1.0, marginal, out=np.full(len(self), np.inf), where=marginal > 0),
+            "β（逓減度）": self.beta,
+            "配信日数": self.n_days,
+            "備考": np.where(self.alpha > 0, "",
+                           np.where(self.lower == self.upper, "購入実績なし（固定）", "購入実績なし（下限に配分）")),
+        })
+        if names:
+            table.insert(1, "クリエイティブ短縮名", table[AD_COL].map(names))
+        return table.sort_values("増減/日", ascending=False, kind="stable").reset_index(drop=True)
+
+    def scenario_table(self, totals) -> pd.DataFrame:
+        """総予算ごとの予測（最適配分 vs 現在の配分比のまま拡大縮小）"""
+        totals = np.clip(np.atleast_1d(np.asarray(totals, dtype=float)), self.lower.sum(), self.upper.sum())
+        optimal = self.predict(self.optimize(totals)).sum(axis=1)
+        base = self.current_spend.sum()
+        scaled = self.predict(np.outer(totals / base if base > 0 else np.zeros_like(totals), self.current_spend))
+        conv_scaled = scaled.sum(axis=1)
+        return pd.DataFrame({
+            "総予算/日": totals,
+            "予測購入/日（最適配分）": optimal,
+            "予測購入/日（現在の配分比）": conv_scaled,
+            "予測CPA（最適配分）": np.divide(totals, optimal, out=np.full(len(totals), np.nan), where=optimal > 0),
+            "予測CPA（現在の配分比）": np.divide(totals, conv_scaled, out=np.full(len(totals), np.nan),
+                                        where=conv_scaled > 0),
+        })
+
+
+def simulate_daily(beta: float, conv_per_day: float, n_ads: int = 300, n_days: int = 28,
+                   spend_sd: float = 0.5, seed: int = 0) -> pd.DataFrame:
+    """真の β が既知の日次データ（購入はポアソン分布）を作る。推定が β を再現できるかの確認用"""
+    rng = np.random.default_rng(seed)
+    ad = np.repeat(np.arange(n_ads), n_days)
+    base = rng.lognormal(9, 1, n_ads)
+    spend = base[ad] * rng.lognormal(0, spend_sd, len(ad))
+    # 配信日の平均的な消化で conv_per_day 件になるように α を決める
+    alpha = conv_per_day / base ** beta
+    return pd.DataFrame({
+        AD_COL: [f"ad_{i:04d}" for i in ad],
+        DATE_COL: pd.Timestamp("2026-01-01") + pd.to_timedelta(np.tile(np.arange(n_days), n_ads), "D"),
+        SPEND_COL: spend,
+        CONV_COL: rng.poisson(alpha[ad] * spend ** beta).astype(float),
+    })
+
+
+if __name__ == "__main__":
+    # 推定の確認: 真の β × 1日あたり購入件数 ごとに、推定 β（広告ごとの中央値）が真値に近いこと
+    print("真のβ  購入/日  推定β（中央値）  推定β（5〜95%）")
+    for true_beta in (0.6, 0.95):
+        for conv_per_day in (0.2, 2.0, 20.0):
+            beta = ResponseCurves.fit(simulate_daily(true_beta, conv_per_day)).beta
+            lo, med, hi = np.percentile(beta, [5, 50, 95])
+            print(f"{true_beta:5.2f}  {conv_per_day:6.1f}  {med:14.2f}  {lo:.2f}〜{hi:.2f}")
+            assert abs(med - true_beta) < 0.1, (true_beta, conv_per_day, med)
@@ -1,35 +1,50 @@
 """
 Claude API連携：プロンプト構築とAPI呼び出し
+
+API呼び出しは AsyncClaudeClient（asyncio）に集約し、プロセス全体で
+- HTTP接続の再利用（APIキーごとに1クライアント）
+- 同時実行数の上限（セマフォ）
+- リクエスト数 / 入力トークン数のトークンバケットによる流量制御
+- 429 / 5xx / 529 / タイムアウト時のジッター付き指数バックオフ（retry-after ヘッダを優先）
+を行う。base_url（または環境変数 ANTHROPIC_BASE_URL）をローカルの偽サーバーに向ければ
+APIキー無しで動作確認できる。
 """
 
+import asyncio
 import json
+import os
+import random
+import threading
+import time
 from pathlib import Path
-from anthropic import Anthropic
+
+import anthropic
+from anthropic import AsyncAnthropic
+
+from prompt_data import MAX_PROMPT_TOKENS, estimate_tokens
+from report_schema import REPORT_TOOL, STRUCTURED_INSTRUCTIONS, ReportSchemaError, parse_report
 
 
 PROMPT_TEMPLATE = (Path(__file__).parent / "prompts" / "analysis_prompt.md").read_text(encoding="utf-8")
 
 MODEL_ID = "claude-sonnet-4-5-20250929"
 
+# 流量制御の既定値（環境変数で上書き可）
+MAX_CONCURRENCY = int(os.getenv("CLAUDE_MAX_CONCURRENCY", "4"))
+REQUESTS_PER_MINUTE = float(os.getenv("CLAUDE_REQUESTS_PER_MINUTE", "50"))
+INPUT_TOKENS_PER_MINUTE = float(os.getenv("CLAUDE_INPUT_TOKENS_PER_MINUTE", "0"))  # 0 = 制限しない
+REQUEST_TIMEOUT_SEC = float(os.getenv("CLAUDE_TIMEOUT_SEC", "180"))
+MAX_RETRIES = int(os.getenv("CLAUDE_MAX_RETRIES", "5"))
+STRUCTURED_MAX_TOKENS = 16000  # 構造化出力は Markdown 全文 + JSON を1回で返すため多めに取る
+# 16000 トークンの出力は 180 秒に収まらないことがあるため、構造化出力は1リクエストの待ち時間を長く取る
+STRUCTURED_TIMEOUT_SEC = float(os.getenv("CLAUDE_STRUCTURED_TIMEOUT_SEC", "600"))
+STRUCTURED_ATTEMPTS = 2        # スキーマ違反の応答を何回まで取り直すか
 
-def run_analysis(
-    api_key: str,
-    kpi_summary_text: str,
-    creative_jsons: list[dict],
-) -> str:
-    """
-    Claude APIを呼び出してクロス分析レポートを生成する
+RETRYABLE_STATUS = {408, 409, 429}  # + 500以上（529 Overloaded を含む）
 
-    Args:
-        api_key: Anthropic API Key
-        kpi_summary_text: build_kpi_text() の出力
-        creative_jsons: parse_creative_jsons() の出力リスト
-
-    Returns:
-        分析レポート（Markdown文字列）
-    """
-    client = Anthropic(api_key=api_key)
 
+def build_prompt(kpi_summary_text: str, creative_jsons: list[dict], structured: bool = False) -> str:
+    """KPIサマリーテキストとクリエイティブJSONから分析プロンプトを組み立てる（structured: ツールでの提出を指示）"""
     # JSONからAPI入力用テキストを構築（_raw_jsonを使用）
     json_text_parts = []
     for cr in creative_jsons:
@@ -42,16 +57,282 @@ def run_analysis(
         json_text_parts.append(part)
     creative_json_text = "\n\n---\n\n".join(json_text_parts)
 
-    # プロンプト組み立て
     prompt = PROMPT_TEMPLATE.format(
         kpi_summary=kpi_summary_text,
         creative_json=creative_json_text,
     )
+    return prompt + STRUCTURED_INSTRUCTIONS if structured else prompt
+
+
+def kpi_token_budget(
+    creative_jsons: list[dict], max_prompt_tokens: int = MAX_PROMPT_TOKENS, structured: bool = False,
+) -> int:
+    """テンプレートとクリエイティブJSONを除いて、KPIサマリーに使える入力トークン数"""
+    return max_prompt_tokens - estimate_tokens(build_prompt("", creative_jsons, structured))
+
+
+def check_prompt_size(prompt: str, max_prompt_tokens: int = MAX_PROMPT_TOKENS) -> int:
+    """プロンプトの見積もりトークン数を返す（上限を超える場合は送信せず ValueError）"""
+    tokens = estimate_tokens(prompt)
+    if tokens > max_prompt_tokens:
+        raise ValueError(
+            f"プロンプトが大きすぎます（見積もり {tokens:,} トークン > 上限 {max_prompt_tokens:,}）。"
+            "クリエイティブ数を減らすか CLAUDE_MAX_PROMPT_TOKENS を見直してください。"
+        )
+    return tokens
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 流量制御
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+class TokenBucket:
+    """毎分 per_minute 個補充されるトークンバケット（容量 = 1分ぶん）"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        amount = min(amount, self.capacity)  # 容量を超える要求で永久に待たないように
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AsyncClaudeClient:
+    """
+    接続を再利用する非同期 Claude クライアント
+
+    Usage:
+        client = AsyncClaudeClient(api_key)
+        text = await client.complete(prompt)
+
+        # ローカルの偽サーバーで確認する場合
+        client = AsyncClaudeClient("dummy", base_url="http://127.0.0.1:8765")
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str | None = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        input_tokens_per_minute: float = INPUT_TOKENS_PER_MINUTE,
+        timeout: float = REQUEST_TIMEOUT_SEC,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        # リトライは自前で行う（SDK側のリトライは無効化）
+        self._client = AsyncAnthropic(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._input_tokens = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute > 0 else None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # 429 を受けたら retry-after の間は全リクエストを止める
+        self._paused_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, anthropic.APIConnectionError):  # APITimeoutError を含む
+            return True
+        if isinstance(error, anthropic.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+        return False
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """フルジッター付き指数バックオフ。retry-after ヘッダがあればそれ以上待つ"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    async def _wait_for_capacity(self, prompt: str) -> None:
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if self._requests is not None:
+            await self._requests.acquire()
+        if self._input_tokens is not None:
+            await self._input_tokens.acquire(estimate_tokens(prompt))
+
+    async def _create(self, prompt: str, max_tokens: int, model: str, timeout: float | None = None, **kwargs):
+        """
+        プロンプトを送信して応答メッセージを返す（再試行可能なエラーはバックオフして再送）
+        timeout: 1リクエストの待ち時間（省略時はクライアントの timeout）
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_capacity(prompt)
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                try:
+                    return await self._client.messages.create(
+                        model=model,
+                        max_tokens=max_tokens,
+                        messages=[{"role": "user", "content": prompt}],
+                        timeout=timeout or self.timeout,
+                        **kwargs,
+                    )
+                except Exception as e:
+                    if not self._is_retryable(e) or attempt == self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+                    delay = self._backoff(attempt, e)
+                    if isinstance(e, anthropic.APIStatusError) and e.status_code == 429:
+                        self.stats["rate_limited"] += 1
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            # 待機中はセマフォを解放しておく
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def complete(self, prompt: str, max_tokens: int = 8192, model: str = MODEL_ID) -> str:
+        """プロンプトを送信し、応答テキストを返す"""
+        message = await self._create(prompt, max_tokens, model)
+        return message.content[0].text
+
+    async def complete_tool(
+        self, prompt: str, tool: dict, max_tokens: int = STRUCTURED_MAX_TOKENS, model: str = MODEL_ID,
+        timeout: float = STRUCTURED_TIMEOUT_SEC,
+    ) -> dict:
+        """tool の呼び出しを強制して送信し、ツール入力（tool["input_schema"] に沿った JSON）を返す"""
+        message = await self._create(
+            prompt, max_tokens, model, timeout=max(timeout, self.timeout),
+            tools=[tool], tool_choice={"type": "tool", "name": tool["name"]},
+        )
+        for block in message.content:
+            if block.type == "tool_use" and block.name == tool["name"]:
+                return block.input
+        raise ReportSchemaError([f"{tool['name']} が呼び出されませんでした（stop_reason={message.stop_reason}）"])
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 同期呼び出し用の共有イベントループ
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# Streamlit のスクリプト / ジョブスレッドから呼ばれるため、専用スレッドのイベントループ上で
+# クライアント（接続プール・セマフォ・バケット）を共有する
+_LOOP: asyncio.AbstractEventLoop | None = None
+_CLIENTS: dict[tuple[str, str | None], AsyncClaudeClient] = {}
+_LOOP_LOCK = threading.Lock()
 
-    message = client.messages.create(
-        model=MODEL_ID,
-        max_tokens=8192,
-        messages=[{"role": "user", "content": prompt}],
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="claude-client", daemon=True).start()
+        return _LOOP
+
+
+def get_client(api_key: str, base_url: str | None = None) -> AsyncClaudeClient:
+    """APIキー（と接続先）ごとに共有される AsyncClaudeClient を返す"""
+    loop = _background_loop()
+    with _LOOP_LOCK:
+        if (api_key, base_url) not in _CLIENTS:
+            # asyncio のプリミティブ・HTTPクライアントは共有ループ上で生成する
+            async def create() -> AsyncClaudeClient:
+                return AsyncClaudeClient(api_key, base_url=base_url)
+            _CLIENTS[(api_key, base_url)] = asyncio.run_coroutine_threadsafe(create(), loop).result()
+        return _CLIENTS[(api_key, base_url)]
+
+
+async def run_analysis_async(
+    client: AsyncClaudeClient,
+    kpi_summary_text: str,
+    creative_jsons: list[dict],
+) -> str:
+    """run_analysis() の非同期版（バッチで複数レポートを並行生成する場合に使う）"""
+    prompt = build_prompt(kpi_summary_text, creative_jsons)
+    check_prompt_size(prompt)
+    return await client.complete(prompt)
+
+
+def run_analysis(
+    api_key: str,
+    kpi_summary_text: str,
+    creative_jsons: list[dict],
+    base_url: str | None = None,
+) -> str:
+    """
+    Claude APIを呼び出してクロス分析レポートを生成する
+
+    Args:
+        api_key: Anthropic API Key
+        kpi_summary_text: build_kpi_text() の出力（kpi_token_budget() を max_tokens に渡して作る）
+        creative_jsons: parse_creative_jsons() の出力リスト
+        base_url: 接続先（省略時は ANTHROPIC_BASE_URL または公式API）
+
+    Returns:
+        分析レポート（Markdown文字列）
+
+    Raises:
+        ValueError: プロンプトの見積もりが MAX_PROMPT_TOKENS を超える場合（APIには送信しない）
+    """
+    client = get_client(api_key, base_url)
+    future = asyncio.run_coroutine_threadsafe(
+        run_analysis_async(client, kpi_summary_text, creative_jsons), _background_loop(),
     )
+    return future.result()
+
+
+async def run_structured_analysis_async(
+    client: AsyncClaudeClient,
+    kpi_summary_text: str,
+    creative_jsons: list[dict],
+    attempts: int = STRUCTURED_ATTEMPTS,
+) -> dict:
+    """run_structured_analysis() の非同期版"""
+    prompt = build_prompt(kpi_summary_text, creative_jsons, structured=True)
+    check_prompt_size(prompt)
+    for attempt in range(attempts):
+        try:
+            return parse_report(await client.complete_tool(prompt, REPORT_TOOL))
+        except ReportSchemaError:
+            if attempt == attempts - 1:
+                raise
+    raise RuntimeError("unreachable")
 
-    return message.content[0].text
+
+def run_structured_analysis(
+    api_key: str,
+    kpi_summary_text: str,
+    creative_jsons: list[dict],
+    base_url: str | None = None,
+) -> dict:
+    """
+    構造化出力モード：Markdown レポートと、スキーマ検証済みの JSON（ランキング・所見・推奨事項・仮説）を1回の呼び出しで生成する
+
+    Returns:
+        {"markdown": 分析レポート, "data": {"rankings", "findings", "recommendations", "hypotheses"}}
+
+    Raises:
+        ReportSchemaError: STRUCTURED_ATTEMPTS 回取り直してもスキーマに合わない場合
+        ValueError: プロンプトの見積もりが MAX_PROMPT_TOKENS を超える場合（APIには送信しない）
+    """
+    client = get_client(api_key, base_url)
+    future = asyncio.run_coroutine_threadsafe(
+        run_structured_analysis_async(client, kpi_summary_text, creative_jsons), _background_loop(),
+    )
+    return future.result()
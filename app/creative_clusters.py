@@ -0,0 +1,269 @@
+"""
+クリエイティブのクラスタリング：広告数が多いときに、グラフと Claude プロンプトをクラスタの代表に要約する
+- 特徴: 尺・フック強度・セグメント構成・種別・has_* フラグ（属性）+ CTR / CPC / CPA / 視聴率（KPI）を標準化
+- 手法: k-means（k-means++ 初期化・消化金額で重み付け）。1反復は 広告数 × k × 次元 の行列演算で、広告数に線形
+- 代表: クラスタ内の日次行を合算して 1クラスタ = 1行のサマリーにする（KPIは合計比、信頼区間も再計算）
+結果は分析期間・紐付けごとの共有キャッシュに載せ、同じデータでは再計算しない。
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from attribute_cube import MISSING_LABEL
+from attribute_effects import flag_columns
+from metrics import SUM_COLUMNS, aggregate, safe_divide, with_derived_columns
+from prompt_data import build_kpi_text, estimate_tokens
+from stats_engine import compute_kpi_intervals
+
+
+CLUSTER_MIN_ADS = 20     # 広告数がこれを超えるとクラスタの代表に要約する
+MAX_CLUSTERS = 12
+KPI_WEIGHT = 0.5         # 距離に占める KPI の比重（残りが属性）
+MAX_ITER = 100
+MAX_MEMBER_NAMES = 5     # プロンプトのクラスタ構成表に載せる所属広告数
+
+ATTR_FEATURES = [
+    "duration_sec", "hook_strength_score", "segment_count",
+    "hook_duration_sec", "body_duration_sec", "cta_duration_sec",
+]
+# KPI → 対数をとるか（コスト系は裾が長いため対数で距離を測る）
+KPI_FEATURES = {"全体CTR": False, "全体CPC": True, "CPA": True, "3秒視聴率": False, "100%視聴率": False}
+
+DATE_COL = "レポート開始日"
+SPEND_COL = "消化金額合計"
+
+# 日次データで合算する列（集計元の列 + 移動窓フリークエンシーの近似に使う日次リーチ）
+_DAILY_SUM_COLUMNS = sorted(set(SUM_COLUMNS.values()) | {"リーチ"})
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 特徴量
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def default_k(n_ads: int) -> int:
+    """広告数からクラスタ数を決める（√(n/2)、2〜MAX_CLUSTERS）"""
+    return int(min(MAX_CLUSTERS, max(2, round(np.sqrt(n_ads / 2)))))
+
+
+def _standardize(block: np.ndarray) -> np.ndarray:
+    """列ごとに標準化し、欠損は平均（= 0）で埋める。定数列は0にする"""
+    with np.errstate(invalid="ignore"):
+        mean = np.nanmean(block, axis=0) if len(block) else np.zeros(block.shape[1])
+        std = np.nanstd(block, axis=0) if len(block) else np.ones(block.shape[1])
+    std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+    return np.nan_to_num((block - np.nan_to_num(mean)) / std)
+
+
+def cluster_features(summary: pd.DataFrame, creatives: list[dict] | None = None) -> np.ndarray:
+    """
+    広告別サマリー → (広告数, 次元) の特徴行列
+    属性ブロックと KPI ブロックは列数に関係なく KPI_WEIGHT の比で距離に効くよう重みを掛ける
+    """
+    n = len(summary)
+    attrs = [pd.to_numeric(summary[c], errors="coerce").to_numpy(dtype=float)
+             for c in ATTR_FEATURES if c in summary.columns]
+    if "creative_type" in summary.columns:
+        codes, _ = pd.factorize(summary["creative_type"].astype(object).fillna(MISSING_LABEL))
+        attrs += list(np.eye(codes.max() + 1)[codes].T) if n else []
+    flags = flag_columns(summary, creatives)
+    attrs += [flags[c].to_numpy(dtype=float) for c in flags.columns]
+
+    kpis = []
+    for col, log in KPI_FEATURES.items():
+        if col in summary.columns:
+            values = pd.to_numeric(summary[col], errors="coerce").to_numpy(dtype=float)
+            values = np.where(np.isfinite(values), values, np.nan)
+            kpis.append(np.log1p(np.clip(values, 0, None)) if log else values)
+
+    blocks = []
+    for columns, weight in ((attrs, 1.0 - KPI_WEIGHT), (kpis, KPI_WEIGHT)):
+        if columns:
+            block = _standardize(np.column_stack(columns))
+            blocks.append(block * np.sqrt(weight / block.shape[1]))
+    return np.hstack(blocks) if blocks else np.zeros((n, 1))
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# k-means（重み付き・ベクトル化）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _sq_distances(X: np.ndarray, centers: np.ndarray, x_sq: np.ndarray) -> np.ndarray:
+    """全点 × 全中心の二乗距離（|x|² − 2x·c + |c|²）"""
+    return np.maximum(x_sq[:, None] - 2.0 * X @ centers.T + (centers ** 2).sum(axis=1)[None, :], 0.0)
+
+
+def kmeans(
+    X: np.ndarray,
+    k: int,
+    weights: np.ndarray | None = None,
+    max_iter: int = MAX_ITER,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    重み付き k-means（k-means++ 初期化 + Lloyd 反復）
+
+    Returns: (各点のクラスタ番号, 中心 (k, 次元))
+    """
+    n = len(X)
+    k = max(1, min(k, n))
+    w = np.ones(n) if weights is None else np.maximum(np.asarray(weights, dtype=float), 1e-12)
+    rng = np.random.default_rng(seed)
+    x_sq = (X ** 2).sum(axis=1)
+
+    # k-means++: 既存の中心からの距離²（× 重み）に比例して次の中心を選ぶ
+    centers = np.empty((k, X.shape[1]))
+    centers[0] = X[rng.choice(n, p=w / w.sum())]
+    closest = _sq_distances(X, centers[:1], x_sq)[:, 0]
+    for j in range(1, k):
+        p = closest * w
+        centers[j] = X[rng.choice(n, p=p / p.sum()) if p.sum() > 0 else rng.integers(n)]
+        closest = np.minimum(closest, _sq_distances(X, centers[j:j + 1], x_sq)[:, 0])
+
+    labels = np.full(n, -1)
+    for _ in range(max_iter):
+        dist = _sq_distances(X, centers, x_sq)
+        new_labels = dist.argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        mass = np.bincount(labels, weights=w, minlength=k)
+        sums = np.column_stack([np.bincount(labels, weights=w * X[:, d], minlength=k) for d in range(X.shape[1])])
+        empty = mass == 0
+        centers[~empty] = sums[~empty] / mass[~empty, None]
+        if empty.any():
+            # 空のクラスタは、今の中心から最も遠い点で置き直す
+            far = np.argsort(-dist[np.arange(n), labels])[:int(empty.sum())]
+            centers[empty] = X[far]
+    return labels, centers
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# クラスタへの割り当て・代表サマリー
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _dominant(values: pd.Series, weights: pd.Series) -> pd.Series:
+    """グループ（index）ごとに重み最大の値"""
+    frame = pd.DataFrame({"v": values.astype(object).fillna(MISSING_LABEL).to_numpy(),
+                          "w": weights.to_numpy(), "g": values.index})
+    totals = frame.groupby(["g", "v"], sort=False)["w"].sum().reset_index()
+    top = totals.sort_values("w", ascending=False, kind="stable").drop_duplicates("g")
+    return top.set_index("g")["v"]
+
+
+def cluster_portfolio(
+    summary: pd.DataFrame, creatives: list[dict] | None = None, k: int | None = None, seed: int = 0,
+) -> pd.DataFrame:
+    """
+    広告をクラスタに割り当てる（消化金額で重み付けし、消化の大きい広告が中心を決める）
+
+    Returns: 広告の名前, クリエイティブ短縮名, クラスタ, クラスタ名, 代表, 中心距離
+        クラスタは消化金額の合計が大きい順に 1, 2, ...。代表 = 中心に最も近い広告
+    """
+    X = cluster_features(summary, creatives)
+    spend = pd.to_numeric(summary[SPEND_COL], errors="coerce").fillna(0).to_numpy(dtype=float)
+    labels, centers = kmeans(X, k or default_k(len(summary)), weights=spend, seed=seed)
+    distance = np.sqrt(((X - centers[labels]) ** 2).sum(axis=1))
+
+    # 番号を消化金額順に振り直す
+    order = np.argsort(-np.bincount(labels, weights=spend, minlength=len(centers)), kind="stable")
+    renumber = np.empty(len(order), dtype=int)
+    renumber[order] = np.arange(1, len(order) + 1)
+    names = summary["クリエイティブ短縮名"] if "クリエイティブ短縮名" in summary.columns else summary["広告の名前"]
+    result = pd.DataFrame({
+        "広告の名前": summary["広告の名前"].to_numpy(),
+        "クリエイティブ短縮名": names.astype(object).fillna(summary["広告の名前"]).to_numpy(),
+        "クラスタ": renumber[labels],
+        "中心距離": distance,
+        "_消化": spend,
+    })
+
+    counts = result["クラスタ"].value_counts()
+    if "creative_type" in summary.columns:
+        types = _dominant(summary["creative_type"].set_axis(result["クラスタ"]), result["_消化"].set_axis(result["クラスタ"]))
+    else:
+        types = pd.Series(dtype=object)
+    result["クラスタ名"] = [
+        f"C{c}・{types[c]}（{counts[c]}本）" if c in types.index else f"C{c}（{counts[c]}本）"
+        for c in result["クラスタ"]
+    ]
+    nearest = result.sort_values(["クラスタ", "中心距離"], kind="stable").drop_duplicates("クラスタ").index
+    result["代表"] = result.index.isin(nearest)
+    return result.sort_values(["クラスタ", "_消化"], ascending=[True, False], kind="stable") \
+        .drop(columns="_消化").reset_index(drop=True)
+
+
+def cluster_daily(active_df: pd.DataFrame, assignments: pd.DataFrame) -> pd.DataFrame:
+    """
+    日次データを クラスタ × 日 に合算する（広告の名前・クリエイティブ短縮名 = クラスタ名）
+    合算後の行は通常の日次データと同じ列を持つため、集計・信頼区間・移動窓KPI・日次グラフにそのまま渡せる
+    """
+    df = with_derived_columns(active_df)
+    labels = df["広告の名前"].map(assignments.set_index("広告の名前")["クラスタ名"])
+    df = df[labels.notna()].assign(広告の名前=labels[labels.notna()])
+    cols = [c for c in _DAILY_SUM_COLUMNS if c in df.columns]
+    daily = df.groupby(["広告の名前", DATE_COL], sort=True)[cols].sum().reset_index()
+    daily["クリエイティブ短縮名"] = daily["広告の名前"]
+    daily["CTR(リンククリックスルー率)"] = safe_divide(daily["リンクのクリック"], daily["インプレッション"], 100)
+    for col in [c for c in cols if c.startswith("動画の") and c.endswith("再生数")]:
+        daily[col.replace("再生数", "再生率")] = safe_divide(daily[col], daily["インプレッション"], 100)
+    return daily
+
+
+def cluster_summary(daily: pd.DataFrame, summary: pd.DataFrame, assignments: pd.DataFrame) -> pd.DataFrame:
+    """
+    1クラスタ = 1行の代表サマリー（build_window_summary() のサマリーと同じ列で、グラフ・KPI表にそのまま渡せる）
+    daily は cluster_daily() の結果。KPI は所属広告の合計比、信頼区間は合算した日次データから再計算し、
+    属性は消化金額で重み付けした代表値
+    """
+    reps = aggregate(daily, "広告の名前")
+    reps = reps.merge(compute_kpi_intervals(daily), on="広告の名前", how="left")
+
+    members = assignments.merge(summary, on="広告の名前", how="left", suffixes=("", "_広告"))
+    key = members["クラスタ名"]
+    spend = pd.to_numeric(members[SPEND_COL], errors="coerce").fillna(0)
+    attrs = pd.DataFrame(index=pd.Index(key.unique(), name="広告の名前"))
+    attrs["クラスタ"] = members.groupby(key, sort=False)["クラスタ"].first()
+    attrs["広告数"] = key.value_counts()
+    attrs["代表広告"] = members[members["代表"]].set_index("クラスタ名")["クリエイティブ短縮名"]
+    for col in ["creative_type", "duration_category", "primary_angle"]:
+        if col in members.columns:
+            attrs[col] = _dominant(members[col].set_axis(key), spend.set_axis(key))
+    for col in ATTR_FEATURES:
+        if col in members.columns:
+            values = pd.to_numeric(members[col], errors="coerce")
+            valid = values.notna()
+            num = (values.fillna(0) * spend).groupby(key).sum()
+            den = spend.where(valid, 0).groupby(key).sum()
+            attrs[col] = safe_divide(num, den)
+    reps = reps.merge(attrs.reset_index(), on="広告の名前", how="left")
+    reps["クリエイティブ短縮名"] = reps["広告の名前"]
+    return reps.sort_values("クラスタ", kind="stable").reset_index(drop=True)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# プロンプト
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def cluster_members_text(assignments: pd.DataFrame, max_names: int = MAX_MEMBER_NAMES) -> str:
+    """クラスタごとの所属広告（中心に近い順に max_names 本）の Markdown 表"""
+    lines = [
+        "\n## クラスタ構成\n",
+        f"※ 広告数が多いため、属性とKPIの近い広告を{assignments['クラスタ'].nunique()}個のクラスタにまとめ、"
+        "上の表はクラスタ単位（所属広告の合計比）で掲載した。代表 = クラスタ中心に最も近い広告。\n",
+        "| クラスタ | 代表 | 所属広告（中心に近い順） |",
+        "|---|---|---|",
+    ]
+    ordered = assignments.sort_values(["クラスタ", "中心距離"], kind="stable")
+    for name, group in ordered.groupby("クラスタ名", sort=False):
+        shown = group["クリエイティブ短縮名"].astype(str).tolist()
+        rest = len(shown) - max_names
+        members = "、".join(shown[:max_names]) + (f" 他{rest}本" if rest > 0 else "")
+        representative = group.loc[group["代表"], "クリエイティブ短縮名"].astype(str).iloc[0]
+        lines.append(f"| {name} | {representative} | {members} |")
+    return "\n".join(lines)
+
+
+def build_cluster_kpi_text(
+    reps: pd.DataFrame, assignments: pd.DataFrame, max_tokens: int | None = None,
+) -> str:
+    """クラスタ代表の KPI 表 + クラスタ構成（予算はクラスタ構成の分を差し引いて build_kpi_text() に渡す）"""
+    members = cluster_members_text(assignments)
+    budget = None if max_tokens is None else max(max_tokens - estimate_tokens(members) - 1, 0)
+    return build_kpi_text(reps, max_tokens=budget) + "\n" + members
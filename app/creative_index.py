@@ -0,0 +1,287 @@
+"""
+クリエイティブ類似検索：Gemini の動画分析 JSON と定性分析テキストから「似た過去クリエイティブ」を引く
+- テキスト: JSON の値 + 定性分析を文字 n-gram にし、符号付きハッシュで固定次元に畳み込んだ TF-IDF（語彙表を持たない）
+- 属性: 尺・フック強度・セグメント構成（標準化）+ 種別・訴求軸（one-hot）+ has_* フラグ
+- どちらも L2 正規化し、重みを掛けて1つの float32 行列に結合して保持（類似度は重み付きコサイン = 1回の行列積）
+- 近傍の検索はクエリをまとめて行列積 + argpartition で上位k件を取り、広告サマリーのKPIを結合する
+外部サービス・追加の依存パッケージは使わない。
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from creative_mapper import normalize
+from metrics import SUM_COLUMNS, add_kpis
+
+
+TEXT_DIM = 1024          # テキスト特徴の次元（ハッシュのバケット数）
+NGRAM_SIZES = (2, 3)
+TEXT_WEIGHT = 0.7        # 類似度 = TEXT_WEIGHT × テキスト類似度 + (1 − TEXT_WEIGHT) × 属性類似度
+TOP_K = 5
+NEIGHBOR_KPIS = ["消化金額合計", "全体CTR", "全体CPC", "CPA", "3秒視聴率", "100%視聴率"]
+QUERY_CHUNK = 256        # 1回の行列積で処理するクエリ数（メモリ使用量 = QUERY_CHUNK × 件数 × 4バイト）
+
+NUMERIC_ATTRS = [
+    "duration_sec", "hook_strength_score", "segment_count",
+    "hook_duration_sec", "body_duration_sec", "cta_duration_sec",
+]
+CATEGORICAL_ATTRS = ["creative_type", "duration_category", "primary_angle"]
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_PRIME = np.uint64(1099511628211)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# テキスト特徴（符号付き特徴ハッシュ）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def creative_text(creative: dict) -> str:
+    """分析 JSON の文字列値（キー名は除く）と定性分析テキストを1つの文書にする"""
+    parts = []
+
+    def walk(value) -> None:
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, dict):
+            for v in value.values():
+                walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+
+    walk(creative.get("_raw_json", {}))
+    parts.append(creative.get("_qualitative_text", ""))
+    return normalize(" ".join(p for p in parts if p))
+
+
+def hash_ngrams(text: str, sizes: tuple[int, ...] = NGRAM_SIZES) -> np.ndarray:
+    """文字 n-gram のハッシュ値（uint64）を文字列の長さに比例する配列演算だけで求める"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = []
+    with np.errstate(over="ignore"):
+        for n in sizes:
+            m = len(codes) - n + 1
+            if m <= 0:
+                continue
+            h = np.full(m, n, dtype=np.uint64)
+            for j in range(n):
+                h = (h * _PRIME) ^ codes[j:j + m]
+            # 下位ビットを混ぜる（バケット番号と符号を独立にするため）
+            h = (h ^ (h >> np.uint64(29))) * _MIX
+            hashes.append(h ^ (h >> np.uint64(32)))
+    return np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+
+
+def text_counts(texts: list[str], dim: int = TEXT_DIM) -> np.ndarray:
+    """文書 × バケット の符号付き n-gram 出現数"""
+    counts = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        h = hash_ngrams(text)
+        if len(h):
+            signs = 1.0 - 2.0 * (h >> np.uint64(63)).astype(np.float32)
+            counts[i] = np.bincount((h % np.uint64(dim)).astype(np.int64), weights=signs, minlength=dim)
+    return counts
+
+
+def _l2_normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0).astype(np.float32)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 類似検索インデックス
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+class CreativeIndex:
+    """
+    クリエイティブの類似検索インデックス
+
+    Usage:
+        index = CreativeIndex.build(creatives)              # parse_creative_jsons() の出力
+        index.neighbors(["core_step_suzuki_demo_01"], k=5, summary=summary)   # 近傍 + KPI
+        index.search(new_creatives, k=5)                    # インデックス外のクリエイティブで検索
+        index.save(".cache/creative_index.npz"); CreativeIndex.load(...)
+    """
+
+    def __init__(self, video_ids, text, attrs, idf, stats: dict, text_weight: float = TEXT_WEIGHT):
+        self.video_ids = np.asarray(video_ids, dtype=object)
+        self.position = {vid: i for i, vid in enumerate(self.video_ids)}
+        self.idf = idf
+        self.stats = stats          # 属性の平均・標準偏差・カテゴリ・フラグ名（検索時の変換に使う）
+        self.text_weight = text_weight
+        # [√w × テキスト | √(1−w) × 属性]（件数, TEXT_DIM + 属性次元）float32。内積がそのまま重み付き類似度になる
+        self.matrix = self._combine(text, attrs)
+        self.text_dim = text.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    @classmethod
+    def build(cls, creatives: list[dict], text_weight: float = TEXT_WEIGHT) -> "CreativeIndex":
+        """クリエイティブ群からインデックスを作る（同じ video_id は後のものを使う）"""
+        creatives = list({cr["video_id"]: cr for cr in creatives}.values())
+        counts = text_counts([creative_text(cr) for cr in creatives])
+        df = (counts != 0).sum(axis=0)
+        idf = (np.log((1 + len(creatives)) / (1 + df)) + 1).astype(np.float32)
+
+        flags = sorted({
+            k for cr in creatives for k, v in cr.get("_raw_json", {}).get("analysis_summary", {}).items()
+            if k.startswith("has_") and isinstance(v, bool)
+        })
+        numeric = cls._numeric(creatives)
+        stats = {
+            "mean": np.nanmean(numeric, axis=0).tolist() if len(creatives) else [0.0] * len(NUMERIC_ATTRS),
+            "std": np.nanstd(numeric, axis=0).tolist() if len(creatives) else [1.0] * len(NUMERIC_ATTRS),
+            "categories": {
+                col: sorted({str(cr.get(col)) for cr in creatives if cr.get(col) not in (None, "")})
+                for col in CATEGORICAL_ATTRS
+            },
+            "flags": flags,
+        }
+        stats["mean"] = [0.0 if np.isnan(m) else m for m in stats["mean"]]
+        stats["std"] = [1.0 if not s or np.isnan(s) else s for s in stats["std"]]
+        text = cls._text_features(counts, idf)
+        attrs = cls._attr_features(creatives, stats)
+        return cls([cr["video_id"] for cr in creatives], text, attrs, idf, stats, text_weight)
+
+    # --- 特徴量 ---
+    @staticmethod
+    def _numeric(creatives: list[dict]) -> np.ndarray:
+        return np.array([
+            [pd.to_numeric(cr.get(col), errors="coerce") for col in NUMERIC_ATTRS] for cr in creatives
+        ], dtype=float).reshape(len(creatives), len(NUMERIC_ATTRS))
+
+    @staticmethod
+    def _text_features(counts: np.ndarray, idf: np.ndarray) -> np.ndarray:
+        # 出現数は対数で圧縮（符号は保つ）してから IDF で重み付けする
+        return _l2_normalize(np.sign(counts) * np.log1p(np.abs(counts)) * idf)
+
+    @classmethod
+    def _attr_features(cls, creatives: list[dict], stats: dict) -> np.ndarray:
+        numeric = (cls._numeric(creatives) - np.array(stats["mean"])) / np.array(stats["std"])
+        blocks = [np.nan_to_num(numeric)]
+        for col in CATEGORICAL_ATTRS:
+            categories = stats["categories"][col]
+            lookup = {c: j for j, c in enumerate(categories)}
+            onehot = np.zeros((len(creatives), len(categories)))
+            for i, cr in enumerate(creatives):
+                j = lookup.get(str(cr.get(col)))
+                if j is not None:
+                    onehot[i, j] = 1.0
+            blocks.append(onehot)
+        summaries = [cr.get("_raw_json", {}).get("analysis_summary", {}) for cr in creatives]
+        blocks.append(np.array([[float(s.get(f) is True) for f in stats["flags"]] for s in summaries])
+                      .reshape(len(creatives), len(stats["flags"])))
+        return _l2_normalize(np.hstack(blocks))
+
+    def _combine(self, text: np.ndarray, attrs: np.ndarray) -> np.ndarray:
+        return np.hstack([
+            np.sqrt(self.text_weight) * text, np.sqrt(1.0 - self.text_weight) * attrs,
+        ]).astype(np.float32)
+
+    def vectorize(self, creatives: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+        """インデックス外のクリエイティブを（このインデックスの IDF・属性統計で）検索用のベクトルにする"""
+        text = self._text_features(text_counts([creative_text(cr) for cr in creatives], self.text_dim), self.idf)
+        return self._combine(text, self._attr_features(creatives, self.stats))
+
+    def split(self, matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """結合済みの行列を重み付け前の (テキスト, 属性) 特徴に戻す"""
+        w = self.text_weight
+        text, attrs = matrix[:, :self.text_dim], matrix[:, self.text_dim:]
+        return (text / np.sqrt(w) if w > 0 else text), (attrs / np.sqrt(1.0 - w) if w < 1 else attrs)
+
+    # --- 検索 ---
+    def top_k(self, queries: np.ndarray, k: int = TOP_K, exclude: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        クエリ行列（件数, 次元）の各行について類似度上位k件の (位置, 類似度) を返す
+        exclude: クエリごとに除外する位置（自分自身など。-1 は除外なし）
+        """
+        k = max(0, min(k, len(self)))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+        positions = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), QUERY_CHUNK):
+            sims = queries[start:start + QUERY_CHUNK] @ self.matrix.T
+            if exclude is not None:
+                rows = np.nonzero(exclude[start:start + QUERY_CHUNK] >= 0)[0]
+                sims[rows, exclude[start:start + QUERY_CHUNK][rows]] = -np.inf
+            part = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < sims.shape[1] else \
+                np.tile(np.arange(sims.shape[1]), (len(sims), 1))
+            part_scores = np.take_along_axis(sims, part, axis=1)
+            order = np.argsort(-part_scores, axis=1, kind="stable")
+            positions[start:start + QUERY_CHUNK] = np.take_along_axis(part, order, axis=1)
+            scores[start:start + QUERY_CHUNK] = np.take_along_axis(part_scores, order, axis=1)
+        return positions, scores
+
+    def neighbors(self, video_ids: list[str] | None = None, k: int = TOP_K,
+                  summary: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        インデックス内のクリエイティブ（省略時は全件）の近傍（自分自身は除く）
+
+        Returns: video_id, 順位, 類似video_id, 類似度, テキスト類似度, 属性類似度（+ summary があれば類似先のKPI）
+        """
+        video_ids = list(self.video_ids) if video_ids is None else [v for v in video_ids if v in self.position]
+        rows = np.array([self.position[v] for v in video_ids], dtype=np.int64)
+        positions, scores = self.top_k(self.matrix[rows], min(k, len(self) - 1), exclude=rows)
+        return self._result(video_ids, positions, scores, self.matrix[rows], summary)
+
+    def search(self, creatives: list[dict], k: int = TOP_K, summary: pd.DataFrame | None = None) -> pd.DataFrame:
+        """インデックス外のクリエイティブ（新しい動画分析など）に似た既存クリエイティブを探す"""
+        queries = self.vectorize(creatives)
+        positions, scores = self.top_k(queries, k)
+        return self._result([cr["video_id"] for cr in creatives], positions, scores, queries, summary)
+
+    def _result(self, query_ids, positions, scores, queries, summary) -> pd.DataFrame:
+        n, k = positions.shape
+        flat = positions.ravel()
+        valid = np.isfinite(scores.ravel())
+        q_text, q_attrs = self.split(np.repeat(queries, k, axis=0))
+        r_text, r_attrs = self.split(self.matrix[flat])
+        result = pd.DataFrame({
+            "video_id": np.repeat(np.asarray(query_ids, dtype=object), k),
+            "順位": np.tile(np.arange(1, k + 1), n),
+            "類似video_id": self.video_ids[flat],
+            "類似度": scores.ravel(),
+            # 内訳（重み付け前のコサイン）
+            "テキスト類似度": np.einsum("ij,ij->i", q_text, r_text),
+            "属性類似度": np.einsum("ij,ij->i", q_attrs, r_attrs),
+        })[valid].reset_index(drop=True)
+        if summary is not None and "video_id" in summary.columns:
+            result = result.merge(
+                video_kpis(summary).rename(columns={"video_id": "類似video_id"}), on="類似video_id", how="left",
+            )
+        return result
+
+    # --- 保存 ---
+    def save(self, path: str | Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        text, attrs = self.split(self.matrix)
+        np.savez(
+            path, video_ids=self.video_ids.astype(str), text=text, attrs=attrs, idf=self.idf,
+            stats=np.array(json.dumps(self.stats, ensure_ascii=False)), text_weight=np.array(self.text_weight),
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> "CreativeIndex":
+        with np.load(path) as data:
+            return cls(
+                data["video_ids"].tolist(), data["text"], data["attrs"], data["idf"],
+                json.loads(str(data["stats"])), float(data["text_weight"]),
+            )
+
+
+def video_kpis(summary: pd.DataFrame) -> pd.DataFrame:
+    """広告別サマリー（build_summary() など）を video_id 単位に合算してKPIを計算し直す"""
+    sums = [c for c in list(SUM_COLUMNS) + ["配信日数"] if c in summary.columns]
+    mapped = summary.dropna(subset=["video_id"])
+    grouped = mapped.groupby("video_id")[sums].sum()
+    grouped["広告数"] = mapped.groupby("video_id").size()
+    kpis = add_kpis(grouped).reset_index()
+    return kpis[["video_id", "広告数", *[c for c in NEIGHBOR_KPIS if c in kpis.columns]]]
@@ -0,0 +1,116 @@
+"""
+広告名 ↔ クリエイティブ（video_id）の自動紐付け
+video_id・ファイル名と広告名を正規化して文字 n-gram の TF-IDF ベクトルにし、
+全広告 × 全クリエイティブの類似度を1回の行列積で計算して候補を提案する。
+過去に確定した紐付け（run_store に保存）があればそれを優先する。
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+NGRAM_SIZES = (2, 3)
+MIN_SCORE = 0.2   # これ未満の候補は「対応なし」として提案する
+MIN_MARGIN = 0.05 # 1位と2位の差がこれ未満なら「要確認」（1位を提案するが自動では決めない）
+TOP_K = 3
+
+_SEPARATORS = re.compile(r"[\s_\-#()（）\[\]【】・/.,]+")
+_EXTENSIONS = re.compile(r"\.(json|md|mp4|mov)$", re.IGNORECASE)
+
+
+def normalize(text: str) -> str:
+    """全角半角・大文字小文字・区切り記号・拡張子の違いを吸収する"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    text = _EXTENSIONS.sub("", text)
+    return _SEPARATORS.sub(" ", text).strip()
+
+
+def char_ngrams(text: str, sizes: tuple[int, ...] = NGRAM_SIZES) -> list[str]:
+    """単語ごとに前後へ空白を付けた文字 n-gram（短い単語も先頭・末尾の一致で拾えるように）"""
+    grams = []
+    for word in normalize(text).split():
+        padded = f" {word} "
+        for n in sizes:
+            grams += [padded[i:i + n] for i in range(max(1, len(padded) - n + 1))]
+    return grams
+
+
+class CreativeMatcher:
+    """
+    クリエイティブ側の n-gram インデックス（TF-IDF・L2正規化済み）
+
+    Usage:
+        matcher = CreativeMatcher(creatives)        # parse_creative_jsons() の出力
+        proposals = matcher.propose(ad_names, confirmed={"体験動画01": "core_step_suzuki_demo_01"})
+        matcher.by_id["core_step_suzuki_demo_01"]   # video_id → クリエイティブ
+    """
+
+    def __init__(self, creatives: list[dict]):
+        self.by_id = {cr["video_id"]: cr for cr in creatives}
+        self.video_ids = list(self.by_id)
+        docs = [
+            char_ngrams(" ".join(filter(None, [vid, self.by_id[vid].get("_filename", "")])))
+            for vid in self.video_ids
+        ]
+        self.vocab = {g: i for i, g in enumerate(sorted({g for doc in docs for g in doc}))}
+        # 多くのクリエイティブに共通する n-gram（"core_step_" など）の重みを下げる
+        df = np.zeros(len(self.vocab), dtype=np.float32)
+        for doc in docs:
+            df[[self.vocab[g] for g in set(doc)]] += 1
+        self.idf = np.log((1 + len(docs)) / (1 + df)) + 1
+        self.matrix = self._vectorize(docs)
+
+    def _vectorize(self, docs: list[list[str]]) -> np.ndarray:
+        mat = np.zeros((len(docs), len(self.vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            cols = [self.vocab[g] for g in doc if g in self.vocab]
+            np.add.at(mat[row], cols, 1.0)
+        mat *= self.idf
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)
+
+    def scores(self, ad_names: list[str]) -> np.ndarray:
+        """広告 × クリエイティブ のコサイン類似度（0〜1）"""
+        if not self.video_ids or not ad_names:
+            return np.zeros((len(ad_names), len(self.video_ids)), dtype=np.float32)
+        return self._vectorize([char_ngrams(name) for name in ad_names]) @ self.matrix.T
+
+    def propose(
+        self,
+        ad_names: list[str],
+        confirmed: dict[str, str] | None = None,
+        min_score: float = MIN_SCORE,
+        top_k: int = TOP_K,
+        min_margin: float = MIN_MARGIN,
+    ) -> pd.DataFrame:
+        """
+        広告ごとの紐付け候補
+
+        Returns: 広告の名前, video_id（提案。該当なしは None）, スコア,
+                 根拠（確定済み / 自動 / 要確認 = 2位との差が min_margin 未満 / 該当なし）, 候補
+        """
+        confirmed = confirmed or {}
+        sim = self.scores(ad_names)
+        k = min(top_k, sim.shape[1])
+        top = np.argsort(-sim, axis=1)[:, :k] if k else np.empty((len(ad_names), 0), dtype=int)
+
+        rows = []
+        for i, ad_name in enumerate(ad_names):
+            candidates = [(self.video_ids[j], float(sim[i, j])) for j in top[i]]
+            label = " / ".join(f"{vid}（{score:.2f}）" for vid, score in candidates if score > 0)
+            if confirmed.get(ad_name) in self.by_id:
+                vid, score, source = confirmed[ad_name], 1.0, "確定済み"
+            elif candidates and candidates[0][1] >= min_score:
+                runner_up = candidates[1][1] if len(candidates) > 1 else 0.0
+                source = "自動" if candidates[0][1] - runner_up >= min_margin else "要確認"
+                vid, score = candidates[0]
+            else:
+                vid, score, source = None, candidates[0][1] if candidates else 0.0, "該当なし"
+            rows.append({
+                "広告の名前": ad_name, "video_id": vid, "スコア": round(score, 3), "根拠": source, "候補": label,
+            })
+        return pd.DataFrame(rows, columns=["広告の名前", "video_id", "スコア", "根拠", "候補"])
@@ -0,0 +1,94 @@
+"""
+日付インデックス：レポート開始日でソートした広告別累積和
+任意期間のサマリーを累積和の差分（O(広告数)）で求め、
+期間スライダーを動かすたびに全行を再フィルタ・再集計しないようにする
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from metrics import DATE_COL, SUM_COLUMNS, add_kpis, with_derived_columns
+
+
+class DateRangeIndex:
+    """
+    広告 × 日付 の累積和インデックス
+
+    Usage:
+        index = DateRangeIndex(active_df)
+        summary = index.summary_for_window("2026-01-23", "2026-02-06", creative_attrs)
+        rows = index.rows_for_window("2026-01-23", "2026-02-06")
+    """
+
+    def __init__(self, active_df: pd.DataFrame):
+        df = with_derived_columns(active_df).sort_values(DATE_COL, kind="stable").reset_index(drop=True)
+        self.rows = df
+        self.row_dates = df[DATE_COL].to_numpy(dtype="datetime64[ns]")
+
+        self.sum_cols = {agg: src for agg, src in SUM_COLUMNS.items() if src in df.columns}
+        ad_codes, self.ads = pd.factorize(df["広告の名前"], sort=True)
+        date_codes, dates = pd.factorize(df[DATE_COL], sort=True)
+        self.dates = np.asarray(dates, dtype="datetime64[ns]")
+        n_ads, n_dates = len(self.ads), len(self.dates)
+
+        # 日別合計 (広告, 日付, 指標) → 先頭に0行を足した累積和
+        values = df[list(self.sum_cols.values())].fillna(0).to_numpy(dtype=float)
+        daily = np.zeros((n_ads, n_dates, values.shape[1]))
+        np.add.at(daily, (ad_codes, date_codes), values)
+        self.cumsum = np.zeros((n_ads, n_dates + 1, values.shape[1]))
+        np.cumsum(daily, axis=1, out=self.cumsum[:, 1:])
+
+        # 配信日数の累積和と、各日付から見た次 / 前の配信日（配信開始日・終了日の O(1) 参照用）
+        active = np.zeros((n_ads, n_dates), dtype=bool)
+        active[ad_codes, date_codes] = True
+        self.day_count = np.zeros((n_ads, n_dates + 1), dtype=np.int64)
+        np.cumsum(active, axis=1, out=self.day_count[:, 1:])
+        idx = np.broadcast_to(np.arange(n_dates), (n_ads, n_dates))
+        self.next_active = np.minimum.accumulate(
+            np.where(active, idx, n_dates)[:, ::-1], axis=1,
+        )[:, ::-1]
+        self.prev_active = np.maximum.accumulate(np.where(active, idx, -1), axis=1)
+
+    @property
+    def min_date(self) -> pd.Timestamp:
+        return pd.Timestamp(self.dates[0])
+
+    @property
+    def max_date(self) -> pd.Timestamp:
+        return pd.Timestamp(self.dates[-1])
+
+    def _bounds(self, start, end) -> tuple[int, int]:
+        """期間 [start, end]（両端含む）を日付配列の半開区間 [i0, i1) に変換する"""
+        i0 = int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start), "ns"), side="left"))
+        i1 = int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end), "ns"), side="right"))
+        return i0, max(i0, i1)
+
+    def summary_for_window(self, start, end, creative_attrs: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        期間内の広告別サマリー（build_summary() と同じ列構成）を累積和の差分で求める
+        期間内に配信の無い広告は含めない
+        """
+        i0, i1 = self._bounds(start, end)
+        sums = self.cumsum[:, i1] - self.cumsum[:, i0]
+        days = self.day_count[:, i1] - self.day_count[:, i0]
+
+        summary = pd.DataFrame(sums, columns=list(self.sum_cols))
+        summary.insert(0, "広告の名前", np.asarray(self.ads))
+        summary.insert(1, "配信日数", days)
+        has_days = days > 0
+        first = np.where(has_days, self.next_active[:, min(i0, len(self.dates) - 1)], 0)
+        last = np.where(has_days, self.prev_active[:, max(i1 - 1, 0)], 0)
+        summary.insert(2, "配信開始日", self.dates[first])
+        summary.insert(3, "配信終了日", self.dates[last])
+        summary = add_kpis(summary[has_days].reset_index(drop=True))
+
+        if creative_attrs is not None and len(creative_attrs) > 0:
+            summary = summary.merge(creative_attrs, on="広告の名前", how="left")
+        return summary
+
+    def rows_for_window(self, start, end) -> pd.DataFrame:
+        """期間内の日次行（グラフ用）を二分探索で切り出す"""
+        lo = np.searchsorted(self.row_dates, np.datetime64(pd.Timestamp(start), "ns"), side="left")
+        hi = np.searchsorted(self.row_dates, np.datetime64(pd.Timestamp(end), "ns"), side="right")
+        return self.rows.iloc[lo:hi].sort_values(["広告の名前", DATE_COL], kind="stable")
@@ -0,0 +1,160 @@
+"""
+図の出力パイプライン：一度だけ描画した図を用途別（画面 / 印刷 / サムネイル / ベクター）に書き出す
+- レイアウト（tight bbox の計算）と描画は1回だけ行い、低解像度のターゲットは縮小で作る
+- 画面用はパレットPNG、サムネイルはWebPに圧縮して容量を抑える
+- 描画結果の内容ハッシュをキーに、ターゲットごとの圧縮済み画像をディスクにキャッシュする
+  （データが変わっていない図は再エンコードしない）
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+from matplotlib.transforms import Bbox
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class FigureTarget:
+    """出力ターゲット（dpi か 幅px のどちらかで解像度を指定。どちらも無ければベクター）"""
+    suffix: str
+    dpi: float | None = None
+    width: int | None = None
+    palette: bool = False  # 256色パレットに減色してPNGを小さくする（グラフは色数が少ないため劣化はほぼ無い）
+    subdir: str = ""
+
+    @property
+    def is_vector(self) -> bool:
+        return self.dpi is None and self.width is None
+
+
+TARGETS = {
+    "screen": FigureTarget(".png", dpi=150, palette=True),            # ブラウザ / Notion 用
+    "print": FigureTarget(".png", dpi=300, subdir="print"),           # 印刷用（フルカラー）
+    "thumbnail": FigureTarget(".webp", width=480, subdir="thumbs"),   # 一覧・プレビュー用
+    "vector": FigureTarget(".svg", subdir="vector"),                  # 拡大しても劣化しない原本
+}
+DEFAULT_TARGETS = ("screen",)
+PAD_INCHES = 0.1  # bbox_inches="tight" と同じ余白
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parents[1] / ".cache" / "figures"
+
+
+def targets_from_env(default: tuple[str, ...] = DEFAULT_TARGETS) -> tuple[str, ...]:
+    """環境変数 FIGURE_TARGETS（例: "screen,print,thumbnail"）から出力ターゲットを決める"""
+    value = os.getenv("FIGURE_TARGETS")
+    if not value:
+        return default
+    names = tuple(t.strip() for t in value.split(",") if t.strip())
+    unknown = [t for t in names if t not in TARGETS]
+    if unknown:
+        raise ValueError(f"不明な出力ターゲット: {', '.join(unknown)}（{', '.join(TARGETS)} から指定）")
+    return names
+
+
+def _target_dpi(target: FigureTarget, bbox: Bbox) -> float:
+    if target.width is not None:
+        return target.width / bbox.width
+    return target.dpi
+
+
+def encode_raster(image: Image.Image, target: FigureTarget) -> bytes:
+    """描画済みの画像をターゲットの形式に圧縮する"""
+    img = image.convert("RGB")
+    buf = io.BytesIO()
+    if target.suffix == ".webp":
+        img.save(buf, format="WEBP", quality=85, method=2)
+    elif target.palette:
+        img.quantize(256, method=Image.Quantize.FASTOCTREE).save(buf, format="PNG", optimize=True)
+    else:
+        img.save(buf, format="PNG", compress_level=6)
+    return buf.getvalue()
+
+
+def _render(fig: plt.Figure, bbox: Bbox, dpi: float) -> Image.Image:
+    # 圧縮は encode_raster で行うため、ここでは RGBA の生バッファで受け取る
+    buf = io.BytesIO()
+    fig.savefig(buf, format="raw", dpi=dpi, bbox_inches=bbox)
+    raw = buf.getvalue()
+    pixels = len(raw) // 4
+    # キャンバスの幅は bbox × dpi の切り捨て / 丸めで決まるため、割り切れる幅を探す
+    for width in (int(bbox.width * dpi), round(bbox.width * dpi), int(bbox.width * dpi) + 1):
+        if width > 0 and pixels % width == 0 and abs(pixels // width - bbox.height * dpi) <= 1:
+            return Image.frombuffer("RGBA", (width, pixels // width), raw, "raw", "RGBA", 0, 1)
+    raise ValueError("描画結果のサイズを特定できませんでした")
+
+
+def render_figure(
+    fig: plt.Figure,
+    targets: tuple[str, ...] = DEFAULT_TARGETS,
+    disk_cache: bool = True,
+    cache_dir: str | Path | None = None,
+) -> dict[str, bytes]:
+    """
+    図をターゲットごとの画像バイト列にする
+
+    ラスタ系のターゲットは、必要な最大解像度で1回だけ描画し、それより小さいものは縮小して作る。
+    disk_cache=True なら描画結果のハッシュ × ターゲット名で圧縮済み画像をキャッシュする
+    （アプリでは共有キャッシュ側で保持するため False で呼ぶ）。
+
+    Returns: {ターゲット名: 画像バイト列}
+    """
+    specs = {name: TARGETS[name] for name in targets}
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(PAD_INCHES)
+    outputs: dict[str, bytes] = {}
+
+    raster = {name: _target_dpi(t, bbox) for name, t in specs.items() if not t.is_vector}
+    if raster:
+        master_dpi = max(raster.values())
+        master = _render(fig, bbox, master_dpi)
+        cache = Path(cache_dir or os.getenv("FIGURE_CACHE_DIR") or DEFAULT_CACHE_DIR) if disk_cache else None
+        key = hashlib.blake2b(master.tobytes(), digest_size=12).hexdigest() if cache else ""
+        for name, dpi in raster.items():
+            target = specs[name]
+            cache_path = cache / f"{key}_{name}{target.suffix}" if cache else None
+            if cache_path is not None and cache_path.exists():
+                outputs[name] = cache_path.read_bytes()
+                continue
+            image = master
+            if dpi < master_dpi:
+                size = (max(1, round(master.width * dpi / master_dpi)), max(1, round(master.height * dpi / master_dpi)))
+                image = master.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            outputs[name] = encode_raster(image, target)
+            if cache_path is not None:
+                cache.mkdir(parents=True, exist_ok=True)
+                cache_path.write_bytes(outputs[name])
+
+    for name, target in specs.items():
+        if target.is_vector:
+            # ID用のソルトと日付を固定して、同じ図なら同じバイト列になるようにする
+            with plt.rc_context({"svg.hashsalt": "figure_output"}):
+                buf = io.BytesIO()
+                fig.savefig(buf, format="svg", bbox_inches=bbox, metadata={"Date": None})
+            outputs[name] = buf.getvalue()
+    return outputs
+
+
+def save_figure(
+    fig: plt.Figure,
+    out_dir: str | Path,
+    stem: str,
+    targets: tuple[str, ...] | None = None,
+) -> dict[str, Path]:
+    """
+    図を各ターゲットに書き出して閉じる（スクリプト用）
+    out_dir（/ターゲットのsubdir）/stem.拡張子 に保存し、ターゲット名 → パスを返す
+    """
+    outputs = render_figure(fig, targets or targets_from_env())
+    plt.close(fig)
+    paths = {}
+    for name, data in outputs.items():
+        target = TARGETS[name]
+        path = Path(out_dir) / target.subdir / f"{stem}{target.suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        paths[name] = path
+    return paths
@@ -0,0 +1,367 @@
+"""
+Markdown → HTML エクスポート
+1パスのトークナイザ（ブロックは行単位の状態機械、インラインは1つの正規表現で1回だけ変換）で
+レポートを HTML にする。画像は
+- inline    : 縮小・再圧縮して base64 埋め込み（1ファイル。Notion へのペースト用）
+- external  : 縮小した画像を別ファイル（assets/）として出力し、loading="lazy" で参照
+- thumbnail : サムネイルを遅延読み込みし、クリックで原寸画像を開く
+から選べる。04_export_html.py とアプリの Step 4 の両方から使う。
+"""
+from __future__ import annotations
+
+import base64
+import html
+import io
+import re
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from typing import Callable
+
+from PIL import Image
+
+
+IMAGE_MODES = ("inline", "external", "thumbnail")
+MAX_IMAGE_WIDTH = 1600
+THUMBNAIL_WIDTH = 480
+
+STYLE_TABLE = "border-collapse:collapse; width:100%; margin:16px 0; font-size:14px;"
+STYLE_TH = "background:#2C3E50; color:white; font-weight:bold; padding:10px 12px; border:1px solid #ddd; text-align:center;"
+STYLE_TD = "padding:10px 12px; border:1px solid #ddd; text-align:center;"
+STYLE_PRE = "background:#f4f4f4; padding:16px; border-radius:8px; overflow-x:auto; font-size:13px;"
+STYLE_CODE = "background:#f0f0f0; padding:2px 6px; border-radius:3px; font-size:13px;"
+STYLE_IMG = "max-width:100%; margin:16px 0; border-radius:8px; box-shadow:0 2px 8px rgba(0,0,0,0.1);"
+STYLE_HR = "border:none; border-top:2px solid #eee; margin:32px 0;"
+HEADING_SIZES = {1: "28px", 2: "24px", 3: "20px", 4: "17px", 5: "15px", 6: "14px"}
+HEADING_MARGINS = {1: "40px 0 16px", 2: "32px 0 12px", 3: "24px 0 10px", 4: "20px 0 8px"}
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{title}</title>
+<style>
+  body {{
+    font-family: -apple-system, BlinkMacSystemFont, 'Hiragino Sans', 'Segoe UI', sans-serif;
+    max-width: 900px;
+    margin: 0 auto;
+    padding: 40px 24px;
+    line-height: 1.8;
+    color: #333;
+    background: #fff;
+  }}
+  p {{ margin: 8px 0; }}
+  li {{ margin: 4px 0; }}
+  strong {{ color: #1a1a2e; }}
+  table {{ border-collapse: collapse; width: 100%; margin: 16px 0; }}
+  th {{ background: #2C3E50; color: white; }}
+  td, th {{ padding: 10px 12px; border: 1px solid #ddd; text-align: center; font-size: 14px; }}
+  tr:nth-child(even) td {{ background: #f9f9f9; }}
+  img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>"""
+
+# インライン要素: 画像 / リンク / 太字 / コード を1つの正規表現でまとめて走査する
+INLINE_RE = re.compile(
+    r"!\[(?P<img_alt>[^\]]*)\]\((?P<img_src>[^)]+)\)"
+    r"|\[(?P<link_text>[^\]]+)\]\((?P<link_href>[^)]+)\)"
+    r"|\*\*(?P<bold>.+?)\*\*"
+    r"|`(?P<code>[^`]+)`"
+)
+
+
+@dataclass
+class ExportResult:
+    html: str
+    assets: dict[str, bytes] = field(default_factory=dict)  # 相対パス → バイト列（external / thumbnail）
+    render_ms: float = 0.0
+    image_count: int = 0
+
+    @property
+    def html_bytes(self) -> int:
+        return len(self.html.encode("utf-8"))
+
+    @property
+    def asset_bytes(self) -> int:
+        return sum(len(b) for b in self.assets.values())
+
+    def summary(self) -> str:
+        """出力サイズと処理時間の1行サマリー"""
+        text = f"HTML {self.html_bytes / 1024:,.0f} KB"
+        if self.assets:
+            text += f" + 画像 {len(self.assets)} ファイル {self.asset_bytes / 1024:,.0f} KB"
+        return text + f"（画像 {self.image_count} 枚 / {self.render_ms:,.0f} ms）"
+
+    def to_zip(self, html_name: str = "index.html") -> bytes:
+        """HTML と画像アセットを1つの zip にまとめる"""
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(html_name, self.html)
+            for path, data in self.assets.items():
+                zf.writestr(path, data)
+        return buf.getvalue()
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 画像
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def encode_image(data: bytes, max_width: int, fmt: str = "webp", quality: int = 85) -> bytes:
+    """画像を max_width 以下に縮小し、指定形式（webp / png / jpeg）で再エンコードする"""
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        if img.width > max_width:
+            height = round(img.height * max_width / img.width)
+            # reducing_gap: 整数倍の縮小を先に行ってからリサンプリングする（300dpiの図で数倍速い）
+            img = img.resize((max_width, height), Image.LANCZOS, reducing_gap=3.0)
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        if fmt == "png":
+            img.save(out, format="PNG", optimize=True)
+        elif fmt == "webp":
+            img.save(out, format="WEBP", quality=quality, method=2)
+        else:
+            img.save(out, format=fmt.upper(), quality=quality)
+        return out.getvalue()
+
+
+class _ImageRenderer:
+    """
+    画像参照を出力モードに応じた <img> に変換する
+    走査中はプレースホルダを返し、finish() でまとめて（スレッド並列で）縮小・再エンコードする
+    """
+
+    PLACEHOLDER_RE = re.compile("\x00IMG(\\d+):(.*?)\x00", re.S)
+
+    def __init__(self, resolve, mode, image_format, max_width, asset_dir):
+        self.resolve = resolve
+        self.mode = mode
+        self.format = image_format
+        self.max_width = max_width
+        self.asset_dir = asset_dir
+        self.assets: dict[str, bytes] = {}
+        self._sources: dict[str, int] = {}  # src → 画像番号（同じ画像は1回だけ変換）
+        self._data: list[bytes] = []
+        self._names: list[str] = []  # 書き出し時のファイル名（拡張子なし。画像ごとに一意）
+
+    @property
+    def count(self) -> int:
+        return len(self._data)
+
+    def __call__(self, alt: str, src: str) -> str:
+        if src not in self._sources:
+            data = self.resolve(src) if self.resolve else None
+            if data is None:
+                return f"<p>[Image not found: {html.escape(src)}]</p>"
+            self._sources[src] = len(self._data)
+            self._data.append(data)
+            self._names.append(self._unique_name(PurePosixPath(src).stem))
+        return f"\x00IMG{self._sources[src]}:{html.escape(alt)}\x00"
+
+    def _unique_name(self, stem: str) -> str:
+        """別の画像と同じ名前（サムネイルの "_thumb" を含む）にならないよう、重複時は画像番号を付ける"""
+        taken = {n for name in self._names for n in (name, f"{name}_thumb")}
+        name, i = stem, len(self._names)
+        while name in taken or f"{name}_thumb" in taken:
+            name, i = f"{stem}_{i}", i + 1
+        return name
+
+    def _encode_all(self) -> list[dict[str, bytes]]:
+        jobs = [("full", d, self.max_width) for d in self._data]
+        if self.mode == "thumbnail":
+            jobs += [("thumb", d, THUMBNAIL_WIDTH) for d in self._data]
+        with ThreadPoolExecutor() as pool:
+            encoded = list(pool.map(lambda j: encode_image(j[1], j[2], self.format), jobs))
+        results = [{} for _ in self._data]
+        for (kind, _, _), data, i in zip(jobs, encoded, list(range(len(self._data))) * 2):
+            results[i][kind] = data
+        return results
+
+    def finish(self, text: str) -> str:
+        """プレースホルダを最終的な <img> タグに置き換える"""
+        if not self._data:
+            return text
+        ext = "jpg" if self.format == "jpeg" else self.format
+        mime = "image/jpeg" if self.format == "jpeg" else f"image/{self.format}"
+        img_style = f'style="{STYLE_IMG}"'
+        tags = []
+        for name, encoded in zip(self._names, self._encode_all()):
+            if self.mode == "inline":
+                src = f"data:{mime};base64,{base64.b64encode(encoded['full']).decode()}"
+                tags.append(f'<img src="{src}" alt="{{alt}}" {img_style}>')
+            elif self.mode == "external":
+                path = f"{self.asset_dir}/{name}.{ext}"
+                self.assets[path] = encoded["full"]
+                tags.append(f'<img src="{path}" alt="{{alt}}" loading="lazy" {img_style}>')
+            else:  # thumbnail
+                full = f"{self.asset_dir}/{name}.{ext}"
+                thumb = f"{self.asset_dir}/{name}_thumb.{ext}"
+                self.assets[full] = encoded["full"]
+                self.assets[thumb] = encoded["thumb"]
+                tags.append(
+                    f'<a href="{full}" target="_blank">'
+                    f'<img src="{thumb}" alt="{{alt}}" loading="lazy" {img_style}></a>'
+                )
+        return self.PLACEHOLDER_RE.sub(lambda m: tags[int(m.group(1))].replace("{alt}", m.group(2)), text)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# Markdown → HTML
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _inline(text: str, image: Callable[[str, str], str]) -> str:
+    """インライン要素を1回の走査で変換する（それ以外のテキストはHTMLエスケープ）"""
+    out = []
+    pos = 0
+    for m in INLINE_RE.finditer(text):
+        out.append(html.escape(text[pos:m.start()], quote=False))
+        if m.group("img_src") is not None:
+            out.append(image(m.group("img_alt"), m.group("img_src").strip()))
+        elif m.group("link_href") is not None:
+            out.append(f'<a href="{html.escape(m.group("link_href").strip())}">{_inline(m.group("link_text"), image)}</a>')
+        elif m.group("bold") is not None:
+            out.append(f"<strong>{_inline(m.group('bold'), image)}</strong>")
+        else:
+            out.append(f'<code style="{STYLE_CODE}">{html.escape(m.group("code"), quote=False)}</code>')
+        pos = m.end()
+    out.append(html.escape(text[pos:], quote=False))
+    return "".join(out)
+
+
+def _is_table_separator(cells: list[str]) -> bool:
+    return all(set(c) <= set("- :") for c in cells)
+
+
+def markdown_to_html(
+    md_text: str,
+    resolve_image: Callable[[str], bytes | None] | None = None,
+    image_mode: str = "inline",
+    image_format: str = "webp",
+    max_image_width: int = MAX_IMAGE_WIDTH,
+    asset_dir: str = "assets",
+    title: str = "クリエイティブ分析レポート",
+) -> ExportResult:
+    """
+    Markdown を HTML ページに変換する
+
+    Args:
+        md_text: Markdown 文字列
+        resolve_image: 画像の参照（![alt](src) の src）→ 画像バイト列。None を返すと「見つからない」表示
+        image_mode: "inline" / "external" / "thumbnail"
+        image_format: 出力画像の形式（"webp" / "png" / "jpeg"）
+        max_image_width: 出力画像の最大幅（px）
+        asset_dir: external / thumbnail で画像を置く相対ディレクトリ
+        title: <title>
+
+    Returns: ExportResult（html・画像アセット・処理時間）
+    """
+    if image_mode not in IMAGE_MODES:
+        raise ValueError(f"image_mode は {IMAGE_MODES} のいずれかを指定してください: {image_mode}")
+    started = time.perf_counter()
+    image = _ImageRenderer(resolve_image, image_mode, image_format, max_image_width, asset_dir)
+
+    out: list[str] = []
+    block = None  # None / "code" / "table" / "ul"
+
+    def close_block():
+        nonlocal block
+        if block == "table":
+            out.append("</table>")
+        elif block == "ul":
+            out.append("</ul>")
+        block = None
+
+    for line in md_text.split("\n"):
+        stripped = line.strip()
+
+        # コードブロック（中身はエスケープのみ）
+        if stripped.startswith("```"):
+            if block == "code":
+                out.append("</code></pre>")
+                block = None
+            else:
+                close_block()
+                out.append(f'<pre style="{STYLE_PRE}"><code>')
+                block = "code"
+            continue
+        if block == "code":
+            out.append(html.escape(line, quote=False))
+            continue
+
+        # テーブル（先頭行を見出し行とする）
+        if stripped.startswith("|") or (stripped.count("|") >= 2 and not stripped.startswith("<")):
+            cells = [c.strip() for c in stripped.strip("|").split("|")]
+            if _is_table_separator(cells):
+                continue
+            if block != "table":
+                close_block()
+                out.append(f'<table style="{STYLE_TABLE}">')
+                block = "table"
+                tag, style = "th", STYLE_TH
+            else:
+                tag, style = "td", STYLE_TD
+            out.append("<tr>" + "".join(f'<{tag} style="{style}">{_inline(c, image)}</{tag}>' for c in cells) + "</tr>")
+            continue
+
+        # 箇条書き
+        m = re.match(r"^[-*]\s+(.*)", stripped)
+        if m and stripped not in ("---", "***"):
+            if block != "ul":
+                close_block()
+                out.append("<ul>")
+                block = "ul"
+            out.append(f"  <li>{_inline(m.group(1), image)}</li>")
+            continue
+        close_block()
+
+        m = re.match(r"^(\d+)\.\s+(.*)", stripped)
+        if m:
+            out.append(f'<div style="margin-left:24px; margin-bottom:4px;">{m.group(1)}. {_inline(m.group(2), image)}</div>')
+            continue
+
+        # 見出し
+        m = re.match(r"^(#{1,6})\s+(.*)", stripped)
+        if m:
+            level = len(m.group(1))
+            color = "#1a1a2e" if level <= 2 else "#2C3E50"
+            border = "border-bottom:2px solid #3498DB; padding-bottom:8px;" if level <= 2 else ""
+            out.append(
+                f'<h{level} style="font-size:{HEADING_SIZES[level]}; '
+                f'margin:{HEADING_MARGINS.get(level, "16px 0 8px")}; color:{color}; {border}">'
+                f"{_inline(m.group(2), image)}</h{level}>"
+            )
+            continue
+
+        # 水平線
+        if re.fullmatch(r"(-{3,}|\*{3,})", stripped):
+            out.append(f'<hr style="{STYLE_HR}">')
+            continue
+
+        if not stripped:
+            out.append("")
+            continue
+
+        # 画像だけの行は段落で囲まない
+        if INLINE_RE.fullmatch(stripped) and stripped.startswith("!["):
+            out.append(_inline(stripped, image))
+            continue
+
+        out.append(f"<p>{_inline(stripped, image)}</p>")
+
+    if block == "code":
+        out.append("</code></pre>")
+    close_block()
+
+    page = PAGE_TEMPLATE.format(title=html.escape(title), body=image.finish("\n".join(out)))
+    return ExportResult(
+        html=page,
+        assets=image.assets,
+        render_ms=(time.perf_counter() - started) * 1000,
+        image_count=image.count,
+    )
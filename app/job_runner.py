@@ -0,0 +1,164 @@
+"""
+バックグラウンドジョブ：分析処理をスクリプトスレッドの外（スレッドプール）で実行する
+Streamlit の再実行でスクリプトが中断されても処理は継続し、
+session_state にはジョブIDだけを保持して部分結果（サマリー → グラフ → レポート）をポーリングで表示する。
+"""
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+import matplotlib.pyplot as plt
+
+from figure_output import render_figure
+
+
+MAX_WORKERS = 4
+MAX_FINISHED_JOBS = 64  # 保持する完了済みジョブ数（古いものから破棄）
+
+# pyplot はスレッドセーフではないため、図の生成〜PNG化はこのロック内で行う
+PLOT_LOCK = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたことを示す（ステージの区切りで送出）"""
+
+
+class Job:
+    """1回の分析実行。ワーカーは publish() で部分結果を書き込み、UIは results を読む"""
+
+    def __init__(self, job_id: str, stages: list[str]):
+        self.id = job_id
+        self.stages = stages
+        self.status = "queued"  # queued / running / done / error / cancelled
+        self.stage = ""
+        self.results: dict[str, Any] = {}
+        self.error: str | None = None
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        self.future: Future | None = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error", "cancelled")
+
+    @property
+    def progress(self) -> float:
+        """完了したステージの割合（0〜1）"""
+        if self.status == "done":
+            return 1.0
+        if self.stage not in self.stages:
+            return 0.0
+        return self.stages.index(self.stage) / len(self.stages)
+
+    def set_stage(self, stage: str) -> None:
+        """次のステージへ進む（キャンセル済みならここで中断）"""
+        self.check_cancelled()
+        self.stage = stage
+
+    def publish(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.results[key] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        """描画用に部分結果のコピーを返す"""
+        with self._lock:
+            return dict(self.results)
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self._finish("cancelled")
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def _finish(self, status: str, error: str | None = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+
+
+class JobRunner:
+    """
+    プロセス共通のスレッドプール
+
+    Usage:
+        runner = get_runner()
+        job_id = runner.submit(fn, ["summary", "charts", "report"], *args)
+        job = runner.get(job_id)
+        runner.cancel(job_id)
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., None], stages: list[str], *args, **kwargs) -> str:
+        """fn(job, *args, **kwargs) をバックグラウンドで実行し、ジョブIDを返す"""
+        job = Job(uuid.uuid4().hex[:12], stages)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job.future = self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id: str | None) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> None:
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+
+    @staticmethod
+    def _run(job: Job, fn: Callable[..., None], args: tuple, kwargs: dict) -> None:
+        if job.cancel_requested:
+            job._finish("cancelled")
+            return
+        job.status = "running"
+        try:
+            fn(job, *args, **kwargs)
+        except JobCancelled:
+            job._finish("cancelled")
+        except Exception as e:  # noqa: BLE001 - ワーカー内の例外はUIに表示する
+            job._finish("error", f"{type(e).__name__}: {e}")
+        else:
+            job._finish("done")
+
+    def _prune(self) -> None:
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+
+_RUNNER: JobRunner | None = None
+_RUNNER_LOCK = threading.Lock()
+
+
+def get_runner() -> JobRunner:
+    """プロセス共通の JobRunner を返す（Streamlit の再実行・複数セッションで共有）"""
+    global _RUNNER
+    with _RUNNER_LOCK:
+        if _RUNNER is None:
+            _RUNNER = JobRunner()
+        return _RUNNER
+
+
+def figure_to_png(fig: plt.Figure, target: str = "screen") -> bytes:
+    """図を出力ターゲット（既定は画面用パレットPNG）の画像にして閉じる（ワーカースレッドで図を保持し続けないため）"""
+    data = render_figure(fig, (target,), disk_cache=False)[target]
+    plt.close(fig)
+    return data
@@ -0,0 +1,138 @@
+"""
+指標定義レイヤー：KPIを「分子 / 分母」の組で一度だけ定義し、
+安全な除算と任意粒度の加重集計（合計比）を提供する
+
+NaNの扱い:
+- 分母が0・欠損の比率（例: 購入0件のCPA）は未定義としてNaN
+- 表示時は format_kpi() で "N/A" に変換する
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+DATE_COL = "レポート開始日"
+
+# 集計列名 → 日次データの列名（グループ内で合計する）
+SUM_COLUMNS = {
+    "消化金額合計": "消化金額 (JPY)",
+    "インプレッション合計": "インプレッション",
+    "リーチ合計": "リーチ",
+    "リンククリック合計": "リンクのクリック",
+    "購入合計": "購入",
+    "購入金額合計": "_購入金額",
+    "_3秒再生合計": "動画の3秒再生数",
+    "_25再生合計": "動画の25%再生数",
+    "_50再生合計": "動画の50%再生数",
+    "_75再生合計": "動画の75%再生数",
+    "_95再生合計": "動画の95%再生数",
+    "_100再生合計": "動画の100%再生数",
+}
+
+# KPI名 → (分子の集計列, 分母の集計列, 倍率)
+KPIS = {
+    "全体CTR": ("リンククリック合計", "インプレッション合計", 100.0),
+    "全体CPC": ("消化金額合計", "リンククリック合計", 1.0),
+    "全体CPM": ("消化金額合計", "インプレッション合計", 1000.0),
+    "CPA": ("消化金額合計", "購入合計", 1.0),
+    "ROAS": ("購入金額合計", "消化金額合計", 1.0),
+    "平均フリークエンシー": ("インプレッション合計", "リーチ合計", 1.0),
+    "日次平均消化": ("消化金額合計", "配信日数", 1.0),
+    "3秒視聴率": ("_3秒再生合計", "インプレッション合計", 100.0),
+    "25%視聴率": ("_25再生合計", "インプレッション合計", 100.0),
+    "50%視聴率": ("_50再生合計", "インプレッション合計", 100.0),
+    "75%視聴率": ("_75再生合計", "インプレッション合計", 100.0),
+    "95%視聴率": ("_95再生合計", "インプレッション合計", 100.0),
+    "100%視聴率": ("_100再生合計", "インプレッション合計", 100.0),
+}
+
+# 旧来の列名（日次比率の単純平均だったもの）→ 加重集計に置き換えたKPI
+KPI_ALIASES = {
+    "平均CTR": "全体CTR",
+    "平均CPC": "全体CPC",
+    "平均CPM": "全体CPM",
+}
+
+
+def safe_divide(num, den, scale: float = 1.0):
+    """
+    ベクトル化された安全な除算。分母が0以下・NaNの要素はNaNを返す。
+    Series を渡した場合は分子のindexを保ったSeriesを返す。
+    """
+    num_arr = np.asarray(num, dtype=float)
+    den_arr = np.asarray(den, dtype=float)
+    out = np.full(np.broadcast(num_arr, den_arr).shape, np.nan)
+    np.divide(num_arr, den_arr, out=out, where=np.nan_to_num(den_arr, nan=0.0) > 0)
+    out = out * scale
+    if isinstance(num, pd.Series):
+        return pd.Series(out, index=num.index, name=num.name)
+    return out
+
+
+def daily_pair(kpi: str) -> tuple[str, str, float]:
+    """KPIを日次データの (分子列, 分母列, 倍率) で返す（日次行単位で比率を扱うエンジン用）"""
+    num, den, scale = KPIS[KPI_ALIASES.get(kpi, kpi)]
+    return SUM_COLUMNS[num], SUM_COLUMNS[den], scale
+
+
+def with_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """集計に必要な派生列を付与する（日次ROASから購入金額を復元: ROAS = 購入金額 / 消化金額）"""
+    if "_購入金額" in df.columns:
+        return df
+    df = df.copy()
+    if "購入ROAS(広告費用対効果)" in df.columns:
+        df["_購入金額"] = df["購入ROAS(広告費用対効果)"].fillna(0) * df["消化金額 (JPY)"]
+    else:
+        df["_購入金額"] = 0.0
+    return df
+
+
+def add_kpis(frame: pd.DataFrame) -> pd.DataFrame:
+    """合計列を持つDataFrameに全KPI（合計比）を付与する。材料の無いKPIはスキップ"""
+    frame = frame.copy()
+    for kpi, (num, den, scale) in KPIS.items():
+        if num in frame.columns and den in frame.columns:
+            frame[kpi] = safe_divide(frame[num], frame[den], scale)
+    for alias, kpi in KPI_ALIASES.items():
+        if kpi in frame.columns:
+            frame[alias] = frame[kpi]
+    return frame
+
+
+def aggregate(df: pd.DataFrame, by: str | list[str] | None = None) -> pd.DataFrame:
+    """
+    日次行を任意の粒度で合計し、全KPIを合計比で付与する
+
+    Args:
+        df: 日次データ（process_excel() の出力、またはアクティブ日のみの部分集合）
+        by: グループ化キー。None なら全体を1行に集計
+
+    Returns: 1行 = 1グループ のDataFrame（配信日数・配信開始日・配信終了日・合計列・KPI列）
+    """
+    df = with_derived_columns(df)
+    cols = {src: agg for agg, src in SUM_COLUMNS.items() if src in df.columns}
+    if by is None:
+        df = df.assign(_all="全体")
+        by = "_all"
+    keys = [by] if isinstance(by, str) else list(by)
+
+    grouped = df.groupby(keys, observed=True, sort=True)
+    sums = grouped[list(cols)].sum().rename(columns=cols)
+    if DATE_COL in df.columns:
+        dates = grouped[DATE_COL].agg(配信日数="nunique", 配信開始日="min", 配信終了日="max")
+        sums = dates.join(sums)
+    sums = sums.reset_index()
+    if "_all" in sums.columns:
+        sums = sums.drop(columns="_all")
+    return add_kpis(sums)
+
+
+def format_kpi(value, fmt: str, na: str = "N/A") -> str:
+    """NaN・無限大を na に置き換えて書式化する（例: format_kpi(cpa, "¥{:,.0f}")）"""
+    try:
+        if value is None or not np.isfinite(value):
+            return na
+    except TypeError:
+        return na
+    return fmt.format(value)
@@ -0,0 +1,277 @@
+"""
+プロンプト用データの構築：広告別サマリーを Claude API に渡す Markdown 表に変換する
+- 書式化は列単位（欠損・無限大のマスクを使い、行ループ・iterrows を使わない）
+- トークン予算を指定すると、消化金額の上位N本だけを個別に載せ、
+  残りはクリエイティブ種別ごとの「その他」行にまとめ、属性別ロールアップを添える
+- 送信前にプロンプト全体のサイズを見積もり、上限を超えるものは送らない
+"""
+from __future__ import annotations
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from attribute_cube import MISSING_LABEL, AttributeCube
+from metrics import SUM_COLUMNS, add_kpis
+
+
+# プロンプト全体（テンプレート + KPI表 + クリエイティブJSON）の入力トークン上限（環境変数で上書き可）
+MAX_PROMPT_TOKENS = int(os.getenv("CLAUDE_MAX_PROMPT_TOKENS", "150000"))
+
+# 予算内に載せきれない広告をまとめる属性（サマリーに無ければ1行の「その他」にする）
+TAIL_GROUP_COLUMN = "creative_type"
+
+SPEND_COL = "消化金額合計"
+
+
+def estimate_tokens(text: str) -> int:
+    """入力トークン数の概算（日本語は概ね1文字1トークン以下のため文字数を上限として使う）"""
+    return len(text)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 列単位の書式化
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 書式指定「{接頭辞}{:,.Nf}{接尾辞}」（"¥{:,.0f}", "{:.2f}%" など）は numpy の文字列演算で一括変換する
+_FIXED_FORMAT = re.compile(r"^([^{}]*)\{:(,?)\.(\d+)f\}([^{}]*)$")
+
+
+def _group_thousands(text: np.ndarray, decimals: int) -> np.ndarray:
+    """符号なし固定小数点文字列の整数部に3桁区切りを入れる（右詰めした文字の行列で一括処理）"""
+    width = int(np.char.str_len(text).max())
+    int_width = width - (decimals + 1 if decimals else 0)
+    n_commas = (int_width - 1) // 3
+    if n_commas <= 0:
+        return text
+    chars = np.char.rjust(text, width).astype(f"<U{width}").view(np.uint32).reshape(len(text), width)
+    out = np.full((len(text), width + n_commas), ord(" "), dtype=np.uint32)
+    # 整数部の各桁を、右から数えた桁位置に応じて区切りの数だけ右へずらす
+    from_right = np.arange(int_width)[::-1]
+    dest = np.arange(int_width) + n_commas - from_right // 3
+    out[:, dest] = chars[:, :int_width]
+    out[:, int_width + n_commas:] = chars[:, int_width:]
+    # 区切り位置の左に数字がある行だけ "," にする（桁数の少ない行は空白のまま）
+    commas = dest[(from_right % 3 == 2) & (from_right < 3 * n_commas)] - 1
+    out[:, commas] = np.where(out[:, commas - 1] != ord(" "), ord(","), ord(" "))
+    return np.char.lstrip(out.view(f"<U{width + n_commas}").ravel(), " ")
+
+
+def format_column(values, fmt: str, na: str = "N/A") -> pd.Series:
+    """数値列を fmt で書式化する（NaN・無限大は na。format_kpi() の列版）"""
+    arr = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=float)
+    finite = np.isfinite(arr)
+    out = np.full(len(arr), na, dtype=object)
+    match = _FIXED_FORMAT.match(fmt)
+    if match is None:
+        out[finite] = [fmt.format(v) for v in arr[finite].tolist()]
+    elif finite.any():
+        prefix, comma, digits, suffix = match.groups()
+        vals = arr[finite]
+        text = np.char.mod(f"%.{digits}f", np.abs(vals))
+        if comma:
+            text = _group_thousands(text, int(digits))
+        sign = np.where(np.signbit(vals), "-", "")
+        out[finite] = np.char.add(np.char.add(prefix, np.char.add(sign, text)), suffix).astype(object)
+    return pd.Series(out, index=getattr(values, "index", None), dtype=object)
+
+
+def format_interval(frame: pd.DataFrame, col: str, fmt: str) -> pd.Series:
+    """「{指標}_下限/_上限」列があれば ' [下限–上限]' を返す（上限が発散する場合は ∞）"""
+    if f"{col}_下限" not in frame.columns:
+        return pd.Series("", index=frame.index, dtype=object)
+    lo = pd.to_numeric(frame[f"{col}_下限"], errors="coerce")
+    hi = pd.to_numeric(frame[f"{col}_上限"], errors="coerce")
+    text = " [" + format_column(lo, fmt) + "–" + format_column(hi, fmt).where(hi != np.inf, "∞") + "]"
+    # 全リサンプルで分母0（例: 購入0件）→ 区間も定義できない
+    text = text.where(lo != np.inf, "")
+    if "_合算" in frame.columns:
+        text = text.where(~frame["_合算"].fillna(False).astype(bool), "")
+    return text
+
+
+def _names(frame: pd.DataFrame) -> pd.Series:
+    if "クリエイティブ短縮名" in frame.columns:
+        return frame["クリエイティブ短縮名"].astype(object).fillna(frame["広告の名前"]).astype(str)
+    return frame["広告の名前"].astype(str)
+
+
+def _table_rows(cells: list[pd.Series]) -> pd.Series:
+    """セル列のリストを Markdown の行（'| a | b |'）に連結する"""
+    row = "| " + cells[0].astype(object)
+    for cell in cells[1:]:
+        row = row + " | " + cell.astype(object)
+    return row + " |"
+
+
+def _kpi_rows(frame: pd.DataFrame) -> pd.Series:
+    def kpi(col: str, fmt: str) -> pd.Series:
+        return format_column(frame[col], fmt) + format_interval(frame, col, fmt)
+
+    return _table_rows([
+        _names(frame),
+        format_column(frame["配信日数"], "{:.0f}日"),
+        format_column(frame["消化金額合計"], "¥{:,.0f}"),
+        format_column(frame["インプレッション合計"], "{:,.0f}"),
+        kpi("全体CTR", "{:.2f}%"),
+        kpi("全体CPC", "¥{:,.0f}"),
+        kpi("CPA", "¥{:,.0f}"),
+        kpi("3秒視聴率", "{:.1f}%"),
+        kpi("100%視聴率", "{:.1f}%"),
+    ])
+
+
+def _retention_rows(frame: pd.DataFrame) -> pd.Series:
+    return _table_rows([_names(frame)] + [
+        format_column(frame[f"{p}視聴率"], "{:.1f}%") for p in ["3秒", "25%", "50%", "75%", "95%", "100%"]
+    ])
+
+
+def _reach_rows(frame: pd.DataFrame) -> pd.Series:
+    return _table_rows([
+        _names(frame),
+        format_column(frame["推定リーチ"], "{:,.0f}"),
+        format_column(frame["推定フリークエンシー"], "{:.2f}"),
+    ])
+
+
+def _rollup_rows(marginals: pd.DataFrame) -> pd.Series:
+    return _table_rows([
+        marginals["属性"].astype(str),
+        marginals["値"].astype(str),
+        format_column(marginals["広告数"], "{:.0f}本"),
+        format_column(marginals["消化金額合計"], "¥{:,.0f}"),
+        format_column(marginals["全体CTR"], "{:.2f}%"),
+        format_column(marginals["CPA"], "¥{:,.0f}"),
+        format_column(marginals["3秒視聴率"], "{:.1f}%"),
+        format_column(marginals["100%視聴率"], "{:.1f}%"),
+    ])
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 予算内に載せる広告の選択
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def group_tail(tail: pd.DataFrame, by: str | None = TAIL_GROUP_COLUMN) -> pd.DataFrame:
+    """個別に載せない広告を種別（by）ごとに合算し、合計比でKPIを計算し直す（by=None なら1行）"""
+    if len(tail) == 0:
+        return tail.iloc[0:0]
+    if by in tail.columns:
+        keys = tail[by].astype(object).fillna(MISSING_LABEL).astype(str)
+    else:
+        keys = pd.Series("", index=tail.index)
+    sums = [c for c in SUM_COLUMNS if c in tail.columns]
+    grouped = tail[sums].groupby(keys.to_numpy(), sort=False).sum()
+    grouped["配信日数"] = tail["配信日数"].groupby(keys.to_numpy(), sort=False).max()
+    counts = keys.value_counts(sort=False)
+    grouped = add_kpis(grouped).sort_values(SPEND_COL, ascending=False)
+    grouped["広告の名前"] = [
+        f"その他・{key}（{counts[key]}本）" if key else f"その他（{counts[key]}本）" for key in grouped.index
+    ]
+    grouped["_合算"] = True
+    return grouped.reset_index(drop=True)
+
+
+def _row_lengths(frame: pd.DataFrame, has_reach: bool) -> np.ndarray:
+    """広告1本を載せたときに増える文字数（全ての表の行の合計）"""
+    lengths = _kpi_rows(frame).str.len() + _retention_rows(frame).str.len() + 2
+    if has_reach:
+        lengths = lengths + _reach_rows(frame).str.len() + 1
+    return lengths.to_numpy()
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# KPIサマリーテキスト生成（Claude APIへの入力用）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def interval_label(summary: pd.DataFrame) -> str:
+    """compute_kpi_intervals() で使った信頼水準の表示（例: "95%"。不明なら空文字）"""
+    if "信頼水準" not in summary.columns:
+        return ""
+    levels = pd.to_numeric(summary["信頼水準"], errors="coerce").dropna()
+    return f"{levels.iloc[0]:.0%}" if len(levels) else ""
+
+
+def _render(shown: pd.DataFrame, has_interval: bool, has_reach: bool,
+            rollup: pd.DataFrame | None = None, n_individual: int = 0, omitted: int = 0,
+            level: str = "") -> str:
+    lines = ["## クリエイティブ別KPIサマリー\n"]
+    if has_interval:
+        lines.append(f"※ [ ] 内は{level}信頼区間。区間が重なる差は誤差の範囲として扱うこと。\n")
+    if omitted:
+        lines.append(
+            f"※ 消化金額の上位{n_individual}本を個別に掲載し、"
+            f"残り{omitted}本は「その他」行に合算した（合計比で再計算。信頼区間・リーチは省略）。\n"
+        )
+    lines.append("| クリエイティブ | 配信日数 | 消化金額 | Imp | CTR | CPC | CPA | 3秒視聴率 | 100%視聴率 |")
+    lines.append("|---|---|---|---|---|---|---|---|---|")
+    lines += _kpi_rows(shown).tolist()
+
+    # 視聴維持率テーブル
+    lines.append("\n## 視聴維持率\n")
+    lines.append("| クリエイティブ | 3秒 | 25% | 50% | 75% | 95% | 100% |")
+    lines.append("|---|---|---|---|---|---|---|")
+    lines += _retention_rows(shown).tolist()
+
+    # 期間ユニークリーチ（日次リーチの合計は重複を含むため推定値を渡す）
+    if has_reach:
+        lines.append("\n## 推定ユニークリーチ\n")
+        lines.append("※ 日次リーチの合計ではなく、日次フリークエンシーから推定した期間ユニークリーチ。\n")
+        lines.append("| クリエイティブ | 推定リーチ | 推定フリークエンシー |")
+        lines.append("|---|---|---|")
+        # ユニークリーチは広告をまたいで合算できないため「その他」行は載せない
+        individual = shown["_合算"].isna() if "_合算" in shown.columns else slice(None)
+        lines += _reach_rows(shown[individual]).tolist()
+
+    # 個別に載せきれない場合は、全広告の属性別ロールアップで全体像を補う
+    if rollup is not None and len(rollup):
+        lines.append("\n## 属性別ロールアップ（全広告）\n")
+        lines.append("| 属性 | 値 | 広告数 | 消化金額 | CTR | CPA | 3秒視聴率 | 100%視聴率 |")
+        lines.append("|---|---|---|---|---|---|---|---|")
+        lines += _rollup_rows(rollup).tolist()
+
+    return "\n".join(lines)
+
+
+def build_kpi_text(summary: pd.DataFrame, max_tokens: int | None = None) -> str:
+    """
+    Claude APIに渡すためのKPIサマリーテキストを生成
+
+    max_tokens を指定すると、見積もりがそれを超えないよう消化金額の上位N本だけを個別に載せ、
+    残りは「その他」行と属性別ロールアップにまとめる（None なら全広告を載せる）。
+    広告を1本も載せなくても超える場合は、ロールアップ → 種別ごとの「その他」行の順に省き、
+    それでも収まらなければ ValueError
+    """
+    has_interval = "全体CTR_下限" in summary.columns
+    has_reach = "推定リーチ" in summary.columns
+    level = interval_label(summary)
+    full = _render(summary, has_interval, has_reach, level=level)
+    if max_tokens is None or estimate_tokens(full) <= max_tokens:
+        return full
+
+    ranked = summary.sort_values(SPEND_COL, ascending=False, kind="stable").reset_index(drop=True)
+    cube = AttributeCube(ranked)
+    marginals = cube.marginals() if cube.dims else None
+
+    def render(n: int) -> str:
+        shown = pd.concat([ranked.iloc[:n], group_tail(ranked.iloc[n:], by)], ignore_index=True)
+        return _render(shown, has_interval, has_reach, rollup, n, len(ranked) - n, level)
+
+    # 広告を1本も載せない場合（全て「その他」）の文字数を固定費とし、残りを上位から詰める。
+    # 固定費だけで予算を超える場合は、ロールアップ → 種別ごとの「その他」行（1行に合算）の順に省く
+    for rollup, by in [(marginals, TAIL_GROUP_COLUMN), (None, TAIL_GROUP_COLUMN), (None, None)]:
+        base = estimate_tokens(render(0))
+        if base <= max_tokens:
+            break
+    else:
+        raise ValueError(
+            f"KPIサマリーが入力トークンの予算に収まりません（広告0本でも見積もり {base:,} > 予算 {max_tokens:,}）。"
+            "クリエイティブ数を減らすか CLAUDE_MAX_PROMPT_TOKENS を見直してください。"
+        )
+    cumulative = np.cumsum(_row_lengths(ranked, has_reach))
+    n = int(np.searchsorted(cumulative, max_tokens - base, side="right"))
+    text = render(n)
+    # 「その他」行の数が変わって見積もりを超えた場合は1本ずつ減らす
+    while n > 0 and estimate_tokens(text) > max_tokens:
+        n -= 1
+        text = render(n)
+    return text
@@ -0,0 +1,181 @@
+"""
+リーチ推定エンジン：日をまたいだユニークリーチの推定
+リーチは日をまたいで加算できない（日次リーチの合計は重複ユーザーを数え過ぎる）ため、
+- ユーザー単位のイベントがある場合: 広告×日ごとの HyperLogLog スケッチ（レジスタの max でマージ）
+- 日次データしか無い場合: 日次フリークエンシーから母集団サイズを推定するポアソンモデル
+でリーチを推定する。スケッチはユーザーIDのハッシュのみから作り、生IDは保持しない。
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from metrics import DATE_COL, safe_divide
+
+
+AD_COL = "広告の名前"
+DEFAULT_PRECISION = 12  # レジスタ数 2^12 = 4096（標準誤差 ≈ 1.04 / √4096 ≈ 1.6%）
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# HyperLogLog
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """uint64 配列のビット長（0 は 0）。float64 の丸めを避けるため上位・下位32bitに分けて求める"""
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        hi_len = np.where(hi > 0, np.floor(np.log2(hi)) + 33, 0)
+        lo_len = np.where(lo > 0, np.floor(np.log2(lo)) + 1, 0)
+    return np.where(hi > 0, hi_len, lo_len).astype(np.int64)
+
+
+def hash_ids(ids) -> np.ndarray:
+    """ユーザーID列を64bitハッシュ（uint64）に変換する"""
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+
+def _registers(hashes: np.ndarray, precision: int) -> tuple[np.ndarray, np.ndarray]:
+    """ハッシュ → (レジスタ番号, 先頭ゼロ数+1)"""
+    shift = np.uint64(64 - precision)
+    bucket = (hashes >> shift).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    rank = (64 - precision) - _bit_length(rest) + 1
+    return bucket, rank.astype(np.uint8)
+
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """
+    レジスタ配列（最終軸がレジスタ）からユニーク数を推定する
+    小さい基数では線形カウンティングに切り替える（HyperLogLog の標準的な補正）
+    """
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=-1)
+    zeros = np.sum(registers == 0, axis=-1)
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class ReachSketchIndex:
+    """
+    広告 × 日 の HyperLogLog スケッチ（ユーザー単位のイベントエクスポート向けの API）
+
+    現状のアプリ・スクリプトの入力は日次集計のエクスポートのみのため、期間リーチには
+    estimate_reach_from_frequency() を使っており、このクラスはどこからも呼ばれていない。
+
+    レジスタは 広告 × 日 × 2^precision の密な配列では持たず、0 でないレジスタだけを
+    (日, 広告, レジスタ番号, 値) の並びとして日付順に保持する（メモリは 0 でないレジスタ数に比例し、
+    イベント数と 配信した広告×日 × レジスタ数 のどちらも超えない）。
+    任意の期間・広告グループのリーチは該当期間の並びのレジスタ max で求まる
+    （マージ結果は期間の長さによらず 広告数 × レジスタ数 バイト）
+
+    Usage:
+        index = ReachSketchIndex(events, user_col="user_id")
+        index.reach_for_window("2026-01-23", "2026-02-06")          # 広告別
+        index.reach_for_window("2026-01-23", "2026-02-06", by=None) # 全広告のユニークリーチ
+    """
+
+    def __init__(self, events: pd.DataFrame, user_col: str = "user_id", precision: int = DEFAULT_PRECISION):
+        self.precision = precision
+        m = 1 << precision
+        ad_codes, self.ads = pd.factorize(events[AD_COL], sort=True)
+        date_codes, dates = pd.factorize(pd.to_datetime(events[DATE_COL]), sort=True)
+        self.dates = np.asarray(dates, dtype="datetime64[ns]")
+
+        bucket, rank = _registers(hash_ids(events[user_col]), precision)
+        # (日, 広告, レジスタ) ごとに最大値だけを残す（日付順に並ぶので期間は二分探索で切り出せる）
+        key = (date_codes.astype(np.int64) * len(self.ads) + ad_codes) * m + bucket
+        order = np.lexsort((rank, key))
+        key, rank = key[order], rank[order]
+        last = np.r_[key[1:] != key[:-1], True] if len(key) else np.zeros(0, dtype=bool)
+        key = key[last]
+        self._rank = rank[last]
+        self._bucket = (key % m).astype(np.uint16 if precision <= 16 else np.int32)
+        self._ad = (key // m % len(self.ads)).astype(np.int32) if len(self.ads) else np.zeros(0, dtype=np.int32)
+        self._date = (key // m // max(len(self.ads), 1)).astype(np.int32)
+
+    def _bounds(self, start, end) -> tuple[int, int]:
+        i0 = int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start), "ns"), side="left"))
+        i1 = int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end), "ns"), side="right"))
+        return i0, max(i0, i1)
+
+    def merged(self, start=None, end=None, ads: list[str] | None = None) -> np.ndarray:
+        """期間・広告を絞ってマージしたスケッチ（広告別, レジスタ）を返す"""
+        regs = np.zeros((len(self.ads), 1 << self.precision), dtype=np.uint8)
+        if len(self.dates):
+            d0, d1 = self._bounds(start or self.dates[0], end or self.dates[-1])
+            j0, j1 = np.searchsorted(self._date, [d0, d1], side="left")
+            np.maximum.at(regs, (self._ad[j0:j1], self._bucket[j0:j1]), self._rank[j0:j1])
+        if ads is not None:
+            regs = regs[self.ads.get_indexer(ads)]
+        return regs
+
+    def reach_for_window(self, start=None, end=None, by: str | None = AD_COL) -> pd.DataFrame:
+        """期間内のユニークリーチ推定（by=None なら全広告の和集合を1行で返す）"""
+        regs = self.merged(start, end)
+        if by is None:
+            return pd.DataFrame({"推定リーチ": hll_estimate(regs.max(axis=0, initial=0))[None]})
+        return pd.DataFrame({AD_COL: np.asarray(self.ads), "推定リーチ": hll_estimate(regs)})
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 日次データからの推定（ポアソン母集団モデル）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def _poisson_rate(freq: np.ndarray, n_iter: int = 60) -> np.ndarray:
+    """f = λ / (1 - e^-λ) を λ について解く（f ≥ 1、二分法。λ は [0, f] にある）"""
+    f = np.maximum(freq, 1.0)
+    lo, hi = np.zeros_like(f), f.copy()
+    for _ in range(n_iter):
+        mid = (lo + hi) / 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            val = np.where(mid > 0, mid / -np.expm1(-mid), 1.0)
+        too_low = val < f
+        lo = np.where(too_low, mid, lo)
+        hi = np.where(too_low, hi, mid)
+    return (lo + hi) / 2
+
+
+def estimate_reach_from_frequency(active_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    日次のインプレッション・リーチから期間ユニークリーチを推定する
+
+    モデル: 広告ごとに大きさ N の母集団があり、各ユーザーへの接触回数は
+    期間中のインプレッションに比例したポアソン分布に従う。
+    - 日 d のリーチ r_d = N (1 - e^{-λ_d})、λ_d = I_d / N
+      → 日次フリークエンシー f_d = I_d / r_d = λ_d / (1 - e^{-λ_d}) から λ_d を逆算
+    - 母集団は N = ΣI_d / Σλ_d（日をまたいで一定と仮定）
+    - 期間リーチ R = N (1 - e^{-ΣI_d / N})
+    R は 最大日次リーチ ≤ R ≤ 日次リーチ合計 に収まる（その範囲にクリップする）。
+    日次フリークエンシーが全日1.0のときは N → ∞ となり、R = 日次リーチ合計。
+
+    Returns: 広告の名前, 推定リーチ, 推定フリークエンシー, 推定母集団, 日次リーチ合計, 最大日次リーチ
+    """
+    daily = active_df.groupby([AD_COL, DATE_COL], sort=True)[["インプレッション", "リーチ"]].sum()
+    daily = daily[(daily["インプレッション"] > 0) & (daily["リーチ"] > 0)]
+    imps = daily["インプレッション"].to_numpy(dtype=float)
+    reach = daily["リーチ"].to_numpy(dtype=float)
+    lam = _poisson_rate(imps / reach)
+
+    codes, ads = pd.factorize(daily.index.get_level_values(AD_COL), sort=True)
+    n = len(ads)
+    total_imps = np.bincount(codes, weights=imps, minlength=n)
+    total_lam = np.bincount(codes, weights=lam, minlength=n)
+    reach_sum = np.bincount(codes, weights=reach, minlength=n)
+    reach_max = np.zeros(n)
+    np.maximum.at(reach_max, codes, reach)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pool = np.where(total_lam > 0, total_imps / total_lam, np.inf)
+        est = np.where(np.isfinite(pool), pool * -np.expm1(-total_imps / pool), reach_sum)
+    est = np.clip(est, reach_max, reach_sum)
+
+    return pd.DataFrame({
+        AD_COL: np.asarray(ads),
+        "推定リーチ": est,
+        "推定フリークエンシー": safe_divide(total_imps, est),
+        "推定母集団": pool,
+        "日次リーチ合計": reach_sum,
+        "最大日次リーチ": reach_max,
+    })
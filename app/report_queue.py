@@ -0,0 +1,281 @@
+"""
+レポート生成キュー：多数のアカウント × 期間の Claude レポートをまとめて生成する
+投入したジョブ（組み立て済みプロンプト）はローカルの SQLite に永続化し、
+同時実行数を絞って順に処理し、完了したレポートは1件ごとにチェックポイントとして書き込む。
+途中でプロセスが落ちても、再実行すれば完了済みのジョブは呼び出さずに未完了分だけを処理する。
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+from claude_client import MAX_CONCURRENCY, MODEL_ID, AsyncClaudeClient, build_prompt, check_prompt_size
+from shared_cache import content_hash
+
+
+DEFAULT_PATH = Path(__file__).resolve().parents[1] / "data" / "report_queue.sqlite3"
+
+MAX_ATTEMPTS = 3  # クライアント側の再試行を使い切った失敗を何回まで再投入するか
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_jobs (
+    job_key      TEXT PRIMARY KEY,         -- モデル + アカウント + 期間 + プロンプトの内容ハッシュ
+    account      TEXT NOT NULL,
+    window_start TEXT NOT NULL,
+    window_end   TEXT NOT NULL,
+    model        TEXT NOT NULL,
+    prompt       TEXT NOT NULL,
+    status       TEXT NOT NULL,            -- pending / running / done / error / superseded
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    report       TEXT,
+    error        TEXT,
+    created_at   TEXT NOT NULL,
+    updated_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs (status, created_at);
+"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class ReportQueue:
+    """
+    永続化されたレポート生成キュー
+
+    Usage:
+        queue = ReportQueue()
+        queue.enqueue("kids向け", ("2026-01-23", "2026-02-13"), kpi_text, creative_jsons)
+        run_queue(queue, api_key, concurrency=4)   # 中断しても再実行で続きから
+        queue.status()                             # アカウント × 期間ごとの状態
+        queue.reports()                            # 完了したレポート
+    """
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path or os.getenv("REPORT_QUEUE_PATH") or DEFAULT_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def enqueue(
+        self,
+        account: str,
+        date_range: tuple,
+        kpi_text: str,
+        creative_jsons: list[dict],
+        model: str = MODEL_ID,
+    ) -> str:
+        """
+        プロンプトを組み立ててジョブを投入し、job_key を返す
+        同じアカウント × 期間で同じ内容のジョブが既にあれば（完了済みを含め）追加しない。
+        同じアカウント × 期間の別の内容のジョブ（データ・紐付けの変更前）は superseded にして、
+        実行・状態表示・書き出しの対象から外す（同じ内容を再投入すれば元の状態に戻す）
+        """
+        prompt = build_prompt(kpi_text, creative_jsons)
+        check_prompt_size(prompt)
+        start, end = (pd.Timestamp(d).date().isoformat() for d in date_range)
+        # 別のアカウント・期間が同じプロンプトになっても1件にまとめない（API 呼び出しの重複は実行時に省く）
+        job_key = content_hash(model, account, start, end, prompt)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE report_jobs SET status = 'superseded', updated_at = ?"
+                " WHERE account = ? AND window_start = ? AND window_end = ? AND job_key != ?"
+                " AND status != 'superseded'",
+                (_now(), account, start, end, job_key),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO report_jobs"
+                " (job_key, account, window_start, window_end, model, prompt, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)",
+                (job_key, account, start, end, model, prompt, _now(), _now()),
+            )
+            conn.execute(
+                "UPDATE report_jobs SET status = CASE WHEN report IS NULL THEN 'pending' ELSE 'done' END,"
+                " updated_at = ? WHERE job_key = ? AND status = 'superseded'",
+                (_now(), job_key),
+            )
+        return job_key
+
+    def recover(self) -> int:
+        """前回の実行中に中断されたジョブ（running のまま）を pending に戻し、件数を返す"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE report_jobs SET status = 'pending', updated_at = ? WHERE status = 'running'", (_now(),),
+            ).rowcount
+
+    def retry_errors(self) -> int:
+        """失敗したジョブを試行回数をリセットして pending に戻す"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE report_jobs SET status = 'pending', attempts = 0, error = NULL, updated_at = ?"
+                " WHERE status = 'error'", (_now(),),
+            ).rowcount
+
+    def pending(self) -> list[str]:
+        """未処理のジョブ（投入順）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_key FROM report_jobs WHERE status = 'pending' ORDER BY created_at, job_key",
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def load(self, job_key: str) -> dict:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM report_jobs WHERE job_key = ?", (job_key,)).fetchone()
+        return dict(row)
+
+    def completed_report(self, model: str, prompt: str) -> str | None:
+        """同じモデル・プロンプトで完了済みのレポート（別のアカウント・期間のジョブを含む。無ければ None）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT report FROM report_jobs WHERE model = ? AND prompt = ? AND report IS NOT NULL LIMIT 1",
+                (model, prompt),
+            ).fetchone()
+        return row[0] if row else None
+
+    def mark_running(self, job_key: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE report_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE job_key = ?",
+                (_now(), job_key),
+            )
+
+    def mark_done(self, job_key: str, report: str) -> None:
+        """完了したレポートを書き込む（これ以降の再実行ではこのジョブを呼び出さない）"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE report_jobs SET status = CASE WHEN status = 'superseded' THEN status ELSE 'done' END,"
+                " report = ?, error = NULL, updated_at = ? WHERE job_key = ?",
+                (report, _now(), job_key),
+            )
+
+    def mark_failed(self, job_key: str, error: str, max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """失敗を記録する。試行回数が残っていれば pending に戻して True を返す"""
+        with self._connect() as conn:
+            attempts, status = conn.execute(
+                "SELECT attempts, status FROM report_jobs WHERE job_key = ?", (job_key,),
+            ).fetchone()
+            # 実行中に置き換えられたジョブは再投入しない
+            retry = attempts < max_attempts and status != "superseded"
+            conn.execute(
+                "UPDATE report_jobs SET status = ?, error = ?, updated_at = ? WHERE job_key = ?",
+                ("superseded" if status == "superseded" else "pending" if retry else "error", error, _now(), job_key),
+            )
+        return retry
+
+    def status(self, include_superseded: bool = False) -> pd.DataFrame:
+        """ジョブ一覧（プロンプト・レポート本文は除く。既定では置き換えられたジョブを含めない）"""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT job_key, account, window_start, window_end, status, attempts, error,"
+                " length(prompt) AS prompt_chars, created_at, updated_at FROM report_jobs"
+                + ("" if include_superseded else " WHERE status != 'superseded'")
+                + " ORDER BY created_at, job_key",
+                conn,
+            )
+
+    def counts(self) -> dict[str, int]:
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM report_jobs GROUP BY status").fetchall())
+
+    def reports(self) -> pd.DataFrame:
+        """完了したレポート（account, window_start, window_end, report）"""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT job_key, account, window_start, window_end, report FROM report_jobs"
+                " WHERE status = 'done' ORDER BY account, window_start, window_end",
+                conn,
+            )
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# キューの実行
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+async def run_queue_async(
+    queue: ReportQueue,
+    client: AsyncClaudeClient,
+    concurrency: int = MAX_CONCURRENCY,
+    max_attempts: int = MAX_ATTEMPTS,
+    on_update: Callable[[str, str], None] | None = None,
+) -> dict[str, int]:
+    """
+    pending のジョブを concurrency 本のワーカーで処理する
+    レポートは1件完了するごとに SQLite に書き込み、失敗は max_attempts 回まで再投入する。
+    同じモデル・プロンプトのレポートが既に完了していれば API を呼ばずにそれを使う
+    """
+    queue.recover()
+    todo: asyncio.Queue[str] = asyncio.Queue()
+    for job_key in queue.pending():
+        todo.put_nowait(job_key)
+
+    async def worker() -> None:
+        while True:
+            try:
+                job_key = todo.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            job = queue.load(job_key)
+            queue.mark_running(job_key)
+            try:
+                report = queue.completed_report(job["model"], job["prompt"])
+                if report is None:
+                    report = await client.complete(job["prompt"], model=job["model"])
+            except Exception as e:
+                retry = queue.mark_failed(job_key, f"{type(e).__name__}: {e}", max_attempts)
+                if retry:
+                    todo.put_nowait(job_key)
+                if on_update:
+                    on_update(job_key, "pending" if retry else "error")
+                continue
+            queue.mark_done(job_key, report)
+            if on_update:
+                on_update(job_key, "done")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return queue.counts()
+
+
+def run_queue(
+    queue: ReportQueue,
+    api_key: str,
+    base_url: str | None = None,
+    concurrency: int = MAX_CONCURRENCY,
+    max_attempts: int = MAX_ATTEMPTS,
+    on_update: Callable[[str, str], None] | None = None,
+) -> dict[str, int]:
+    """
+    run_queue_async() の同期版（バッチ用のクライアントを作り、処理後に閉じる）
+
+    Args:
+        base_url: 接続先（スタブサーバーで確認する場合は "http://127.0.0.1:8765"）
+
+    Returns:
+        状態ごとの件数（例: {"done": 24, "error": 1}）
+    """
+    async def main() -> dict[str, int]:
+        client = AsyncClaudeClient(api_key, base_url=base_url, max_concurrency=concurrency)
+        try:
+            return await run_queue_async(queue, client, concurrency, max_attempts, on_update)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(main())
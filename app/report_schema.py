@@ -0,0 +1,197 @@
+"""
+構造化レポート：Claude に Markdown レポートと同じ内容を JSON でも返させるためのスキーマと検証
+ツール（submit_analysis_report）の入力スキーマとして渡して呼び出しを強制し、
+返ってきた JSON をここで検証してから、ランキング・所見・推奨事項の表として下流に渡す。
+（ランキングは分析履歴に保存し、実行をまたいだ集計に使う）
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+
+PRIORITIES = ["High", "Medium", "Low"]
+SECTIONS = ["performance", "retention", "cross", "loss"]
+
+_TEXT = {"type": "string", "minLength": 1}
+
+REPORT_SCHEMA = {
+    "type": "object",
+    "required": ["rankings", "findings", "recommendations", "hypotheses"],
+    "properties": {
+        "rankings": {
+            "type": "array",
+            "minItems": 1,
+            "description": "総合ランキング（1位から順に全クリエイティブ）",
+            "items": {
+                "type": "object",
+                "required": ["rank", "creative", "score", "strength", "weakness"],
+                "properties": {
+                    "rank": {"type": "integer", "minimum": 1},
+                    "creative": {**_TEXT, "description": "KPI表のクリエイティブ名"},
+                    "score": {"type": "number", "minimum": 0, "maximum": 100, "description": "総合評価（0〜100）"},
+                    "strength": {**_TEXT, "description": "最大の強み"},
+                    "weakness": {**_TEXT, "description": "最大の課題"},
+                },
+            },
+        },
+        "findings": {
+            "type": "array",
+            "description": "クリエイティブ別の所見（定量根拠付き）",
+            "items": {
+                "type": "object",
+                "required": ["creative", "section", "finding", "evidence"],
+                "properties": {
+                    "creative": _TEXT,
+                    "section": {"type": "string", "enum": SECTIONS,
+                                "description": "performance=KPI / retention=視聴維持率 / cross=構造×KPI / loss=敗因"},
+                    "finding": _TEXT,
+                    "evidence": {**_TEXT, "description": "根拠となる数値（例: CTR 2.20% vs 平均 1.45%）"},
+                },
+            },
+        },
+        "recommendations": {
+            "type": "array",
+            "minItems": 1,
+            "description": "改善アクション（優先度順）",
+            "items": {
+                "type": "object",
+                "required": ["priority", "action", "target", "expected_effect", "difficulty"],
+                "properties": {
+                    "priority": {"type": "string", "enum": PRIORITIES},
+                    "action": _TEXT,
+                    "target": {**_TEXT, "description": "対象クリエイティブ（全体なら「全体」）"},
+                    "expected_effect": _TEXT,
+                    "difficulty": {"type": "string", "enum": PRIORITIES, "description": "実施難易度"},
+                },
+            },
+        },
+        "hypotheses": {
+            "type": "array",
+            "description": "検証すべき仮説（3〜5個）",
+            "items": {
+                "type": "object",
+                "required": ["hypothesis", "test_method", "expected_effect"],
+                "properties": {
+                    "hypothesis": _TEXT,
+                    "test_method": _TEXT,
+                    "expected_effect": _TEXT,
+                    "required_assets": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+REPORT_TOOL = {
+    "name": "submit_analysis_report",
+    "description": "分析レポートを提出する。markdown にレポート全文、その他のフィールドに同じ内容を構造化して渡す。",
+    "input_schema": {
+        **REPORT_SCHEMA,
+        "required": ["markdown", *REPORT_SCHEMA["required"]],
+        "properties": {
+            "markdown": {**_TEXT, "description": "指定された構成の Markdown レポート全文"},
+            **REPORT_SCHEMA["properties"],
+        },
+    },
+}
+
+STRUCTURED_INSTRUCTIONS = (
+    "\n\n## 提出方法\n"
+    f"- レポートは必ず `{REPORT_TOOL['name']}` ツールで提出すること\n"
+    "- `markdown` には上記の構成のレポート全文を入れ、rankings / findings / recommendations / hypotheses には"
+    "同じ内容を構造化して入れること（Markdown と数値・順位を一致させる）\n"
+    "- creative にはKPI表のクリエイティブ名をそのまま使うこと\n"
+)
+
+
+class ReportSchemaError(ValueError):
+    """モデルの出力がスキーマに合わない"""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("構造化レポートの検証エラー: " + " / ".join(errors[:5]) + (" ..." if len(errors) > 5 else ""))
+        self.errors = errors
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 検証（このスキーマで使う JSON Schema のサブセットのみ対応）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def validate(value, schema: dict, path: str = "$") -> list[str]:
+    """schema に合わない箇所を「パス: 理由」のリストで返す（空なら妥当）"""
+    expected = schema.get("type")
+    if expected and (not isinstance(value, _TYPES[expected]) or (isinstance(value, bool) and expected != "boolean")):
+        return [f"{path}: {expected} ではありません（{type(value).__name__}）"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} は {schema['enum']} のいずれでもありません")
+    if "minimum" in schema and value < schema["minimum"]:
+        errors.append(f"{path}: {value} < {schema['minimum']}")
+    if "maximum" in schema and value > schema["maximum"]:
+        errors.append(f"{path}: {value} > {schema['maximum']}")
+    if "minLength" in schema and len(value.strip()) < schema["minLength"]:
+        errors.append(f"{path}: 空文字列です")
+    if expected == "object":
+        errors += [f"{path}.{key}: 必須項目がありません" for key in schema.get("required", []) if key not in value]
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                errors += validate(value[key], sub, f"{path}.{key}")
+    if expected == "array":
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: 要素が {schema['minItems']} 個未満です")
+        for i, item in enumerate(value):
+            errors += validate(item, schema.get("items", {}), f"{path}[{i}]")
+    return errors
+
+
+def parse_report(tool_input: dict) -> dict:
+    """
+    ツール入力を検証し {"markdown": str, "data": {rankings, findings, recommendations, hypotheses}} にする
+
+    Raises:
+        ReportSchemaError: スキーマ違反、または順位の重複・欠番
+    """
+    errors = validate(tool_input, REPORT_TOOL["input_schema"])
+    if not errors:
+        ranks = sorted(r["rank"] for r in tool_input["rankings"])
+        if ranks != list(range(1, len(ranks) + 1)):
+            errors.append(f"$.rankings: 順位が 1〜{len(ranks)} の連番になっていません（{ranks}）")
+    if errors:
+        raise ReportSchemaError(errors)
+    data = {key: tool_input[key] for key in REPORT_SCHEMA["properties"]}
+    data["rankings"] = sorted(data["rankings"], key=lambda r: r["rank"])
+    return {"markdown": tool_input["markdown"], "data": data}
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 表示・集計用の表
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+_COLUMNS = {
+    "rankings": {"rank": "順位", "creative": "クリエイティブ", "score": "総合評価",
+                 "strength": "最大の強み", "weakness": "最大の課題"},
+    "findings": {"creative": "クリエイティブ", "section": "観点", "finding": "所見", "evidence": "根拠"},
+    "recommendations": {"priority": "優先度", "action": "アクション", "target": "対象クリエイティブ",
+                        "expected_effect": "期待効果", "difficulty": "実施難易度"},
+    "hypotheses": {"hypothesis": "仮説", "test_method": "検証方法", "expected_effect": "期待効果",
+                   "required_assets": "必要素材"},
+}
+
+
+def report_frames(data: dict) -> dict[str, pd.DataFrame]:
+    """構造化レポートの各配列を日本語列名の DataFrame にする（推奨事項は優先度順）"""
+    frames = {
+        key: pd.DataFrame(data.get(key, []), columns=list(columns)).rename(columns=columns)
+        for key, columns in _COLUMNS.items()
+    }
+    rec = frames["recommendations"]
+    rec["優先度"] = pd.Categorical(rec["優先度"], categories=PRIORITIES, ordered=True)
+    frames["recommendations"] = rec.sort_values("優先度", kind="stable").reset_index(drop=True)
+    return frames
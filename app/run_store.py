@@ -0,0 +1,324 @@
+"""
+分析履歴ストア：分析結果（サマリー・グラフ・レポート）をローカルの SQLite に保存する
+アカウント × 分析期間 で索引し、過去の分析を再計算なしで読み込み、
+2回分のKPIテーブルを SQL の結合だけで差分比較できるようにする。
+分析に使った 広告名 → video_id の紐付けも保存し、次回アップロード時の初期値にする。
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_PATH = Path(__file__).resolve().parents[1] / "data" / "run_history.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    inputs_hash  TEXT NOT NULL UNIQUE,
+    account      TEXT NOT NULL,
+    window_start TEXT NOT NULL,
+    window_end   TEXT NOT NULL,
+    created_at   TEXT NOT NULL,
+    summary_json TEXT NOT NULL,
+    report       TEXT,
+    meta_json    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_account_window ON runs (account, window_start, window_end);
+
+-- 差分比較用: 広告 × KPI の縦持ちテーブル
+CREATE TABLE IF NOT EXISTS run_kpis (
+    run_id  INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    ad_name TEXT NOT NULL,
+    label   TEXT,
+    kpi     TEXT NOT NULL,
+    value   REAL,
+    PRIMARY KEY (run_id, ad_name, kpi)
+);
+
+CREATE TABLE IF NOT EXISTS run_figures (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    name   TEXT NOT NULL,
+    png    BLOB NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+
+-- 構造化レポート（JSON 全体）と、実行をまたいだ集計用のランキング
+CREATE TABLE IF NOT EXISTS run_report_data (
+    run_id    INTEGER PRIMARY KEY REFERENCES runs (run_id) ON DELETE CASCADE,
+    data_json TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS run_rankings (
+    run_id   INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    rank     INTEGER NOT NULL,
+    creative TEXT NOT NULL,
+    score    REAL,
+    PRIMARY KEY (run_id, rank)
+);
+CREATE INDEX IF NOT EXISTS idx_run_rankings_creative ON run_rankings (creative);
+
+-- 確定済みの 広告名 → video_id 紐付け（次回アップロード時の初期値に使う）
+CREATE TABLE IF NOT EXISTS ad_mappings (
+    account    TEXT NOT NULL,
+    ad_name    TEXT NOT NULL,
+    video_id   TEXT NOT NULL,
+    short_name TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (account, ad_name)
+);
+"""
+
+
+class RunStore:
+    """
+    分析履歴ストア
+
+    Usage:
+        store = RunStore()
+        run_id = store.save_run(inputs_hash, "kids向け", ("2026-01-23", "2026-02-13"), summary, figures, report)
+        store.list_runs(account="kids向け")
+        store.load_run(run_id)            # {"summary", "figures", "report", ...}
+        store.diff_runs(old_id, new_id)   # 広告 × KPI の前回 / 今回 / 差分 / 変化率
+        store.ranking_history("kids向け")  # 構造化レポートの順位を実行をまたいで並べる
+        store.save_mappings("kids向け", {"体験動画01": "core_step_suzuki_demo_01"})
+    """
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path or os.getenv("RUN_STORE_PATH") or DEFAULT_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # スレッドごと・呼び出しごとに接続する（Streamlit のセッション / ジョブスレッドから並行に使うため）
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save_run(
+        self,
+        inputs_hash: str,
+        account: str,
+        window: tuple,
+        summary: pd.DataFrame,
+        figures: dict[str, bytes] | None = None,
+        report: str | None = None,
+        meta: dict | None = None,
+        report_data: dict | None = None,
+    ) -> int:
+        """
+        分析結果を保存して run_id を返す。同じ入力ハッシュの実行は上書き（レポートが無ければ既存を残す）
+        report_data（構造化レポート）があれば JSON とランキングも保存する
+        """
+        window_start, window_end = (pd.Timestamp(w).strftime("%Y-%m-%d") for w in window)
+        numeric = summary.select_dtypes("number").replace([np.inf, -np.inf], np.nan)
+        labels = summary.get("クリエイティブ短縮名", summary["広告の名前"])
+        kpi_rows = (
+            numeric.assign(ad_name=summary["広告の名前"], label=labels)
+            .melt(id_vars=["ad_name", "label"], var_name="kpi", value_name="value")
+        )
+        kpi_rows["value"] = kpi_rows["value"].astype(float).where(kpi_rows["value"].notna(), None)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO runs (inputs_hash, account, window_start, window_end, created_at, summary_json, report, meta_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (inputs_hash) DO UPDATE SET
+                    created_at = excluded.created_at,
+                    summary_json = excluded.summary_json,
+                    report = COALESCE(excluded.report, runs.report),
+                    meta_json = excluded.meta_json
+                """,
+                (
+                    inputs_hash, account, window_start, window_end,
+                    datetime.now().isoformat(timespec="seconds"),
+                    summary.to_json(orient="split", date_format="iso", force_ascii=False),
+                    report,
+                    json.dumps(meta or {}, ensure_ascii=False, default=str),
+                ),
+            )
+            run_id = conn.execute("SELECT run_id FROM runs WHERE inputs_hash = ?", (inputs_hash,)).fetchone()[0]
+            conn.execute("DELETE FROM run_kpis WHERE run_id = ?", (run_id,))
+            conn.executemany(
+                "INSERT INTO run_kpis (run_id, ad_name, label, kpi, value) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, r.ad_name, r.label, r.kpi, r.value) for r in kpi_rows.itertuples(index=False)],
+            )
+            for name, png in (figures or {}).items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO run_figures (run_id, name, png) VALUES (?, ?, ?)", (run_id, name, png),
+                )
+            if report_data is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO run_report_data (run_id, data_json) VALUES (?, ?)",
+                    (run_id, json.dumps(report_data, ensure_ascii=False)),
+                )
+                conn.execute("DELETE FROM run_rankings WHERE run_id = ?", (run_id,))
+                conn.executemany(
+                    "INSERT INTO run_rankings (run_id, rank, creative, score) VALUES (?, ?, ?, ?)",
+                    [(run_id, r["rank"], r["creative"], r.get("score")) for r in report_data.get("rankings", [])],
+                )
+        return run_id
+
+    def list_runs(self, account: str | None = None, start=None, end=None) -> pd.DataFrame:
+        """
+        保存済みの実行一覧（新しい順）
+        start / end を指定すると、分析期間がその範囲と重なる実行に絞る
+        """
+        query = "SELECT run_id, account, window_start, window_end, created_at, report IS NOT NULL AS has_report FROM runs"
+        where, params = [], []
+        if account is not None:
+            where.append("account = ?")
+            params.append(account)
+        if end is not None:
+            where.append("window_start <= ?")
+            params.append(pd.Timestamp(end).strftime("%Y-%m-%d"))
+        if start is not None:
+            where.append("window_end >= ?")
+            params.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY window_end DESC, created_at DESC"
+        with self._connect() as conn:
+            runs = pd.read_sql_query(query, conn, params=params)
+        runs["has_report"] = runs["has_report"].astype(bool)
+        return runs
+
+    def accounts(self) -> list[str]:
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT account FROM runs ORDER BY account")]
+
+    def load_run(self, run_id: int) -> dict | None:
+        """保存済みの実行を読み込む（サマリーは保存時の列構成のまま復元）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT account, window_start, window_end, created_at, summary_json, report, meta_json "
+                "FROM runs WHERE run_id = ?",
+                (run_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            figures = dict(conn.execute("SELECT name, png FROM run_figures WHERE run_id = ?", (run_id,)).fetchall())
+            data_row = conn.execute("SELECT data_json FROM run_report_data WHERE run_id = ?", (run_id,)).fetchone()
+        account, window_start, window_end, created_at, summary_json, report, meta_json = row
+        summary = pd.read_json(io.StringIO(summary_json), orient="split")
+        for col in ("配信開始日", "配信終了日"):
+            if col in summary.columns:
+                summary[col] = pd.to_datetime(summary[col])
+        return {
+            "run_id": run_id,
+            "account": account,
+            "window": (window_start, window_end),
+            "created_at": created_at,
+            "summary": summary,
+            "figures": figures,
+            "report": report,
+            "report_data": json.loads(data_row[0]) if data_row else None,
+            "meta": json.loads(meta_json or "{}"),
+        }
+
+    def diff_runs(self, base_run_id: int, new_run_id: int, kpis: list[str] | None = None) -> pd.DataFrame:
+        """
+        2回の実行のKPIを広告単位で比較する（保存済みの縦持ちテーブルの結合のみ・再計算なし）
+        どちらか一方にしか無い広告も含める
+
+        Returns: 広告の名前, クリエイティブ短縮名, KPI, 前回, 今回, 差分, 変化率(%)
+        """
+        query = """
+            SELECT k.ad_name, COALESCE(n.label, b.label) AS label, k.kpi,
+                   b.value AS base_value, n.value AS new_value
+            FROM (SELECT DISTINCT ad_name, kpi FROM run_kpis WHERE run_id IN (:new, :base)) AS k
+            LEFT JOIN run_kpis AS n ON n.run_id = :new AND n.ad_name = k.ad_name AND n.kpi = k.kpi
+            LEFT JOIN run_kpis AS b ON b.run_id = :base AND b.ad_name = k.ad_name AND b.kpi = k.kpi
+        """
+        with self._connect() as conn:
+            diff = pd.read_sql_query(query, conn, params={"new": new_run_id, "base": base_run_id})
+        if kpis is not None:
+            diff = diff[diff["kpi"].isin(kpis)]
+            diff["kpi"] = pd.Categorical(diff["kpi"], categories=kpis, ordered=True)
+        diff = diff.sort_values(["ad_name", "kpi"]).reset_index(drop=True)
+        diff["kpi"] = diff["kpi"].astype(str)
+        base = diff["base_value"].astype(float)
+        new = diff["new_value"].astype(float)
+        diff["差分"] = new - base
+        diff["変化率(%)"] = np.where(base.abs() > 0, (new - base) / base.abs() * 100, np.nan)
+        return diff.rename(columns={
+            "ad_name": "広告の名前",
+            "label": "クリエイティブ短縮名",
+            "kpi": "KPI",
+            "base_value": "前回",
+            "new_value": "今回",
+        })
+
+    def ranking_history(self, account: str | None = None) -> pd.DataFrame:
+        """
+        構造化レポートの総合ランキングを実行ごとに並べる（レポート本文を読み直さず SQL だけで集計）
+
+        Returns: run_id, アカウント, 開始日, 終了日, クリエイティブ, 順位, 総合評価（期間の古い順）
+        """
+        query = """
+            SELECT r.run_id, r.account, r.window_start, r.window_end, k.creative, k.rank, k.score
+            FROM run_rankings AS k JOIN runs AS r USING (run_id)
+            WHERE (:account IS NULL OR r.account = :account)
+            ORDER BY r.window_start, r.window_end, r.run_id, k.rank
+        """
+        with self._connect() as conn:
+            history = pd.read_sql_query(query, conn, params={"account": account})
+        return history.rename(columns={
+            "account": "アカウント",
+            "window_start": "開始日",
+            "window_end": "終了日",
+            "creative": "クリエイティブ",
+            "rank": "順位",
+            "score": "総合評価",
+        })
+
+    def delete_run(self, run_id: int) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    def save_mappings(self, account: str, mapping: dict[str, str], short_names: dict[str, str] | None = None) -> None:
+        """ユーザーが確認した 広告名 → video_id の紐付け（と短縮名）を確定済みとして保存する"""
+        now = datetime.now().isoformat(timespec="seconds")
+        short_names = short_names or {}
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO ad_mappings (account, ad_name, video_id, short_name, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (account, ad_name) DO UPDATE SET
+                    video_id = excluded.video_id, short_name = excluded.short_name, updated_at = excluded.updated_at
+                """,
+                [(account, ad, vid, short_names.get(ad), now) for ad, vid in mapping.items()],
+            )
+
+    def delete_mappings(self, account: str, ad_names: list[str]) -> None:
+        """確定済みの紐付けを取り消す（対応なしに直された広告）"""
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM ad_mappings WHERE account = ? AND ad_name = ?", [(account, ad) for ad in ad_names],
+            )
+
+    def load_mappings(self, account: str) -> pd.DataFrame:
+        """確定済みの紐付け（広告の名前, video_id, クリエイティブ短縮名）"""
+        with self._connect() as conn:
+            mappings = pd.read_sql_query(
+                "SELECT ad_name, video_id, short_name FROM ad_mappings WHERE account = ?", conn, params=[account],
+            )
+        return mappings.rename(columns={
+            "ad_name": "広告の名前", "short_name": "クリエイティブ短縮名",
+        })
@@ -0,0 +1,180 @@
+"""
+共有キャッシュ：セッションをまたいでプロセス全体で共有する計算結果キャッシュ
+同じ週次エクスポート・クリエイティブを複数の担当者がアップロードしても再計算しないよう、
+内容ハッシュをキーに パース結果 / サマリー / グラフ / Claudeレポート を保持する。
+合計メモリ上限を超えたら最も長く使われていないものから破棄する（LRU）。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_MAX_MB = 512
+
+
+def content_hash(*parts) -> str:
+    """bytes / str / DataFrame / JSON化できる値 の並びから内容ハッシュ（SHA-256）を作る"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(bytes(part))
+        elif isinstance(part, str):
+            h.update(part.encode("utf-8"))
+        elif isinstance(part, pd.DataFrame):
+            h.update(json.dumps(list(map(str, part.columns)), ensure_ascii=False).encode("utf-8"))
+            h.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        elif part is None:
+            h.update(b"\x00")
+        else:
+            h.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x1f")  # 区切り（("ab", "c") と ("a", "bc") を区別する）
+    return h.hexdigest()
+
+
+def estimate_size(value: Any) -> int:
+    """キャッシュ値のおおよそのメモリ使用量（バイト）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if hasattr(value, "nbytes"):
+        # Arrow テーブル / 配列・PagedTable など
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if hasattr(value, "__dict__"):
+        # DateRangeIndex などの配列を保持するオブジェクトは属性の合計
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in vars(value).values())
+    return sys.getsizeof(value)
+
+
+class SharedCache:
+    """
+    メモリ上限つき LRU キャッシュ（スレッドセーフ）
+
+    Usage:
+        cache = get_cache()
+        df = cache.get_or_compute("export", content_hash(raw_bytes), lambda: process_excel(f))
+        cache.stats()  # 名前空間ごとのヒット / ミス / 破棄数とメモリ使用量
+
+    キャッシュした値は全セッションで共有されるため、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, str], tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: dict[tuple[str, str], threading.Lock] = {}
+        self._counters: dict[str, dict[str, int]] = {}
+
+    def _count(self, namespace: str, event: str) -> None:
+        counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0, "evictions": 0})
+        counters[event] += 1
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._lookup(namespace, key)
+            self._count(namespace, "hits" if entry is not None else "misses")
+            return default if entry is None else entry[0]
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        size = estimate_size(value)
+        with self._lock:
+            old = self._entries.pop((namespace, key), None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                return  # 上限より大きい値は保持しない
+            self._entries[(namespace, key)] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                (ns, _), (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._count(ns, "evictions")
+
+    def _lookup(self, namespace: str, key: str) -> tuple[Any, int] | None:
+        """エントリを取り出してLRU順を更新する（ロック内で呼ぶ）"""
+        entry = self._entries.get((namespace, key))
+        if entry is not None:
+            self._entries.move_to_end((namespace, key))
+        return entry
+
+    def get_or_compute(self, namespace: str, key: str, compute: Callable[[], Any]) -> Any:
+        """キャッシュにあれば返し、無ければ compute() の結果を保存して返す（同一キーの同時計算は1回にまとめる）"""
+        with self._lock:
+            entry = self._lookup(namespace, key)
+            if entry is not None:
+                self._count(namespace, "hits")
+                return entry[0]
+            key_lock = self._inflight.setdefault((namespace, key), threading.Lock())
+        with key_lock:
+            # 待っている間に他のセッションが計算済みならそれを使う
+            with self._lock:
+                entry = self._lookup(namespace, key)
+                self._count(namespace, "hits" if entry is not None else "misses")
+            if entry is not None:
+                return entry[0]
+            try:
+                value = compute()
+                self.put(namespace, key, value)
+            finally:
+                with self._lock:
+                    self._inflight.pop((namespace, key), None)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> pd.DataFrame:
+        """名前空間ごとの 件数 / メモリ / ヒット / ミス / 破棄 / ヒット率"""
+        with self._lock:
+            rows = {ns: {"件数": 0, "メモリ(MB)": 0.0, **c} for ns, c in self._counters.items()}
+            for (ns, _), (_, size) in self._entries.items():
+                row = rows.setdefault(ns, {"件数": 0, "メモリ(MB)": 0.0, "hits": 0, "misses": 0, "evictions": 0})
+                row["件数"] += 1
+                row["メモリ(MB)"] += size / 1024 ** 2
+        stats = pd.DataFrame.from_dict(rows, orient="index").rename_axis("名前空間").reset_index()
+        if len(stats) == 0:
+            return stats
+        stats = stats.rename(columns={"hits": "ヒット", "misses": "ミス", "evictions": "破棄"})
+        total = stats["ヒット"] + stats["ミス"]
+        stats["ヒット率"] = np.where(total > 0, stats["ヒット"] / total.where(total > 0, 1), np.nan)
+        return stats
+
+    @property
+    def used_bytes(self) -> int:
+        return self._bytes
+
+
+_CACHE: SharedCache | None = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> SharedCache:
+    """プロセス共通の SharedCache を返す（上限は環境変数 SHARED_CACHE_MAX_MB、既定512MB）"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            max_mb = float(os.getenv("SHARED_CACHE_MAX_MB", DEFAULT_MAX_MB))
+            _CACHE = SharedCache(int(max_mb * 1024 ** 2))
+        return _CACHE
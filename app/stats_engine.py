@@ -0,0 +1,117 @@
+"""
+統計エンジン：KPIの信頼区間推定
+日次行を「広告 × 配信日」の行列に展開し、全広告分のブートストラップ再標本化と
+Beta事後分布のサンプリングをNumPyで一括処理する
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from metrics import daily_pair
+
+
+# 再標本化1チャンクあたりの最大要素数（広告 × リサンプル × 日数）
+_CHUNK_ELEMENTS = 4_000_000
+
+# 日次ブートストラップで区間を求める比率KPI（分子・分母は metrics.KPIS の定義）
+BOOTSTRAP_KPIS = ["全体CPC", "CPA"]
+
+# Beta事後分布（Jeffreys事前分布）で区間を求める比率KPI（分子 = 成功数、分母 = 試行数）
+BETA_KPIS = ["全体CTR", "3秒視聴率", "100%視聴率"]
+
+
+def _daily_matrix(active_df: pd.DataFrame, cols: list[str]) -> tuple[pd.Index, np.ndarray, dict[str, np.ndarray]]:
+    """
+    日次行を (広告, 日) の行列に展開する。配信日数が少ない広告は0でパディングする。
+
+    Returns: (広告名Index, 各広告の配信日数, {列名: (n_ads, max_days) 行列})
+    """
+    codes, ads = pd.factorize(active_df["広告の名前"], sort=True)
+    pos = active_df.groupby(codes).cumcount().to_numpy()
+    n_days = np.bincount(codes, minlength=len(ads))
+    max_days = int(n_days.max()) if len(n_days) else 0
+
+    mats = {}
+    for col in cols:
+        mat = np.zeros((len(ads), max_days))
+        mat[codes, pos] = active_df[col].fillna(0).to_numpy(dtype=float)
+        mats[col] = mat
+    return pd.Index(ads, name="広告の名前"), n_days, mats
+
+
+def _bootstrap_sums(
+    n_days: np.ndarray, mats: dict[str, np.ndarray], n_boot: int, rng: np.random.Generator,
+) -> dict[str, np.ndarray]:
+    """
+    配信日を復元抽出し、各列の合計をリサンプルごとに求める（全列で同じ抽出を共有）。
+
+    Returns: {列名: (n_ads, n_boot) 行列}
+    """
+    n_ads, max_days = next(iter(mats.values())).shape
+    sums = {col: np.zeros((n_ads, n_boot)) for col in mats}
+    if n_ads == 0 or max_days == 0:
+        return sums
+
+    valid = np.arange(max_days)[None, None, :] < n_days[:, None, None]
+    step = max(1, _CHUNK_ELEMENTS // (n_ads * max_days))
+    for b0 in range(0, n_boot, step):
+        b1 = min(b0 + step, n_boot)
+        idx = rng.integers(0, np.maximum(n_days, 1)[:, None, None], size=(n_ads, b1 - b0, max_days))
+        ad_idx = np.arange(n_ads)[:, None, None]
+        for col, mat in mats.items():
+            sums[col][:, b0:b1] = np.where(valid, mat[ad_idx, idx], 0.0).sum(axis=2)
+    return sums
+
+
+def compute_kpi_intervals(
+    active_df: pd.DataFrame,
+    n_boot: int = 2000,
+    ci: float = 0.95,
+    seed: int | None = 0,
+) -> pd.DataFrame:
+    """
+    広告別KPIの信頼区間を推定する
+
+    - CPC / CPA: 配信日単位のブートストラップ（合計比 = 分子合計 / 分母合計）
+    - CTR / 視聴率: 合計カウントに対する Beta(k+0.5, n-k+0.5) 事後分布の分位点
+
+    Args:
+        active_df: build_summary() が返す日次データ（アクティブ日のみ）
+        n_boot: リサンプル回数
+        ci: 信頼水準
+        seed: 乱数シード（再現性のため既定で固定）
+
+    Returns:
+        広告の名前 + 「{指標}_下限」「{指標}_上限」列 + 信頼水準（= ci）のDataFrame
+    """
+    rng = np.random.default_rng(seed)
+    q = [(1 - ci) / 2, 1 - (1 - ci) / 2]
+
+    cols = sorted({c for kpi in BOOTSTRAP_KPIS for c in daily_pair(kpi)[:2]})
+    ads, n_days, mats = _daily_matrix(active_df, cols)
+    sums = _bootstrap_sums(n_days, mats, n_boot, rng)
+
+    result = pd.DataFrame(index=ads)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for kpi in BOOTSTRAP_KPIS:
+            num, den, scale = daily_pair(kpi)
+            # 分母0のリサンプル（例: 購入0件）は無限大として扱い、上限が発散する（区間の上限のみ inf）
+            ratio = np.where(sums[den] > 0, sums[num] / sums[den], np.inf) * scale
+            lo, hi = np.quantile(ratio, q, axis=1, method="inverted_cdf")
+            result[f"{kpi}_下限"] = lo
+            result[f"{kpi}_上限"] = hi
+
+    beta_cols = sorted({c for kpi in BETA_KPIS for c in daily_pair(kpi)[:2]})
+    totals = active_df.groupby("広告の名前")[beta_cols].sum().reindex(ads).fillna(0)
+    for kpi in BETA_KPIS:
+        succ, trials, scale = daily_pair(kpi)
+        k = totals[succ].to_numpy(dtype=float)
+        n = np.maximum(totals[trials].to_numpy(dtype=float), k)
+        draws = rng.beta(k[:, None] + 0.5, (n - k)[:, None] + 0.5, size=(len(k), n_boot))
+        lo, hi = np.quantile(draws, q, axis=1) * scale
+        result[f"{kpi}_下限"] = lo
+        result[f"{kpi}_上限"] = hi
+
+    result["信頼水準"] = ci
+    return result.reset_index()
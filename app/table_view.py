@@ -0,0 +1,124 @@
+"""
+大きな表のページ表示：DataFrame を Arrow テーブルとして保持し、
+フィルタ・ソート・ページの切り出しをサーバー側（pyarrow.compute）で行う。
+表示側には1ページ分だけを渡すため、数百万行のエクスポートでも書式設定・転送は1ページ分で済む。
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class PagedTable:
+    """
+    ページ表示用の Arrow テーブル
+
+    Usage:
+        paged = PagedTable(df, key=content_hash(raw_bytes))
+        indices = paged.query_indices(filters=[("広告の名前", "contains", "体験")], sort_by="CTR", descending=True)
+        page_df = paged.page(indices, page=0)       # 1ページ分だけ pandas に変換
+    """
+
+    def __init__(self, df: pd.DataFrame, key: str = ""):
+        self.key = key
+        try:
+            self.table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 数値と文字列が混在する列などは文字列として保持する（欠損はそのまま）
+            mixed = df.select_dtypes("object").columns
+            df = df.assign(**{c: df[c].where(df[c].isna(), df[c].astype(str)) for c in mixed})
+            self.table = pa.Table.from_pandas(df, preserve_index=False)
+
+    @property
+    def columns(self) -> list[str]:
+        return self.table.column_names
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def is_numeric(self, column: str) -> bool:
+        t = self.table.schema.field(column).type
+        return pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t)
+
+    def value_range(self, column: str) -> tuple[float, float] | None:
+        """数値列の最小値・最大値（全て欠損なら None）"""
+        mm = pc.min_max(self.table.column(column))
+        lo, hi = mm["min"].as_py(), mm["max"].as_py()
+        if lo is None or hi is None or not (math.isfinite(lo) and math.isfinite(hi)):
+            return None
+        return float(lo), float(hi)
+
+    def _mask(self, column: str, op: str, value) -> pa.ChunkedArray:
+        col = self.table.column(column)
+        if op == "contains":
+            if pa.types.is_dictionary(col.type):
+                # カテゴリ列は辞書（ユニーク値）側だけを照合し、行にはインデックスで展開する
+                return pa.chunked_array([
+                    pc.take(pc.match_substring(pc.cast(chunk.dictionary, pa.string()), str(value), ignore_case=True),
+                            chunk.indices)
+                    for chunk in col.chunks
+                ], type=pa.bool_())
+            text = col if pa.types.is_string(col.type) or pa.types.is_large_string(col.type) else pc.cast(col, pa.string())
+            return pc.match_substring(text, str(value), ignore_case=True)
+        if op == "between":
+            lo, hi = value
+            return pc.and_(pc.greater_equal(col, lo), pc.less_equal(col, hi))
+        if op == "in":
+            return pc.is_in(col, value_set=pa.array(list(value)))
+        raise ValueError(f"未対応のフィルタ: {op}")
+
+    def query_indices(
+        self,
+        filters: list[tuple[str, str, object]] | None = None,
+        sort_by: str | None = None,
+        descending: bool = False,
+    ) -> pa.Array:
+        """
+        フィルタ（列, "contains" | "between" | "in", 値）を AND で適用し、ソート後の行番号を返す
+        欠損はフィルタでは除外し、ソートでは末尾に置く
+        """
+        mask = None
+        for column, op, value in filters or []:
+            m = pc.fill_null(self._mask(column, op, value), False)
+            mask = m if mask is None else pc.and_(mask, m)
+        if mask is None:
+            indices = pa.array(np.arange(self.num_rows, dtype=np.int64))
+        else:
+            indices = pc.indices_nonzero(mask).cast(pa.int64())
+
+        if sort_by:
+            keys = self._sort_keys(sort_by).take(indices)
+            indices = indices.take(pc.array_sort_indices(keys, order="descending" if descending else "ascending"))
+        return indices
+
+    def _sort_keys(self, column: str) -> pa.ChunkedArray:
+        col = self.table.column(column)
+        if not pa.types.is_dictionary(col.type):
+            return col
+        # カテゴリ列は辞書値の順位（整数）に置き換えてからソートする
+        col = col.unify_dictionaries()
+        dictionary = col.chunk(0).dictionary if col.num_chunks else pa.array([], pa.string())
+        rank = np.empty(len(dictionary), dtype=np.int64)
+        rank[pc.array_sort_indices(dictionary).to_numpy()] = np.arange(len(dictionary))
+        rank = pa.array(rank)
+        return pa.chunked_array([pc.take(rank, chunk.indices) for chunk in col.chunks], type=pa.int64())
+
+    def page_count(self, indices: pa.Array, page_size: int = DEFAULT_PAGE_SIZE) -> int:
+        return max(1, math.ceil(len(indices) / page_size))
+
+    def page(self, indices: pa.Array, page: int, page_size: int = DEFAULT_PAGE_SIZE) -> pd.DataFrame:
+        """page 番目（0始まり）の行だけを取り出して DataFrame にする"""
+        start = page * page_size
+        return self.table.take(indices[start:start + page_size]).to_pandas()
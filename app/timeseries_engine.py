@@ -0,0 +1,174 @@
+"""
+時系列エンジン：移動窓KPI・前週比・疲弊指標
+日次データを広告×日に集約し、グループ単位の時間窓ローリング合計から
+比率（分子合計 / 分母合計）を計算する。コストは行数に対して線形。
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from metrics import daily_pair, safe_divide, with_derived_columns
+
+
+DATE_COL = "レポート開始日"
+AD_COL = "広告の名前"
+
+# 移動窓で計算する比率KPI: 列名の接頭辞 → metrics.KPIS のKPI名
+ROLLING_KPIS = {
+    "CTR": "全体CTR",
+    "CPC": "全体CPC",
+    "CPM": "全体CPM",
+    "CPA": "CPA",
+    "ROAS": "ROAS",
+}
+
+
+def _daily_base(active_df: pd.DataFrame) -> pd.DataFrame:
+    """比率計算に必要な分子・分母列を 広告×日 に集約する（同日複数行は合算）"""
+    df = with_derived_columns(active_df)
+    base_cols = sorted({c for kpi in ROLLING_KPIS.values() for c in daily_pair(kpi)[:2]} | {"リーチ"})
+    base_cols = [c for c in base_cols if c in df.columns]
+    daily = df.groupby([AD_COL, DATE_COL], sort=True)[base_cols].sum().reset_index()
+    if "クリエイティブ短縮名" in df.columns:
+        short = df.drop_duplicates(AD_COL).set_index(AD_COL)["クリエイティブ短縮名"]
+        daily["クリエイティブ短縮名"] = daily[AD_COL].map(short)
+    return daily
+
+
+def compute_rolling_kpis(active_df: pd.DataFrame, windows: tuple[int, ...] = (3, 7, 14)) -> pd.DataFrame:
+    """
+    広告別の移動窓KPIを計算する
+
+    比率は「窓内の分子合計 / 窓内の分母合計」で求める（日次比率の単純平均ではない）。
+    窓は暦日ベース（例: 7日窓 = 当日を含む直近7暦日）のため、配信停止日があっても
+    窓幅は変わらない。
+
+    追加される列:
+        {KPI}_{w}日       : 移動窓比率（CTR / CPC / CPM / CPA / ROAS）
+        {KPI}_7日_前週比   : 7日窓比率の前週同日比（%）
+        CTR_7日_ピーク比   : 7日窓CTR ÷ それまでの最大7日窓CTR（疲弊指標）
+        フリークエンシー_7日: 7日窓インプレッション ÷ 7日窓リーチ
+        累計インプレッション / 累計フリークエンシー
+        累計接触回数       : 日次フリークエンシーの累積（同一オーディエンスへの配信を仮定した上限値）
+
+    Returns: 1行 = 1広告 × 1日 のDataFrame
+    """
+    daily = _daily_base(active_df)
+    base_cols = [c for c in daily.columns if c not in (AD_COL, DATE_COL, "クリエイティブ短縮名")]
+    grouped = daily.groupby(AD_COL, sort=False)
+
+    for w in windows:
+        # daily は (広告, 日付) でソート済みのため、グループ順に連結された結果と行順が一致する
+        rolled = grouped.rolling(f"{w}D", on=DATE_COL)[base_cols].sum()
+        rolled = rolled.reset_index(drop=True).set_axis(daily.index)
+        for prefix, kpi in ROLLING_KPIS.items():
+            num, den, scale = daily_pair(kpi)
+            daily[f"{prefix}_{w}日"] = safe_divide(rolled[num], rolled[den], scale)
+        if w == 7 and "リーチ" in rolled.columns:
+            # リーチは日をまたいで加算できないため、窓内合計からの近似値
+            daily["フリークエンシー_7日"] = safe_divide(rolled["インプレッション"], rolled["リーチ"], 1.0)
+
+    # 前週比（7日窓同士を7日ずらして突き合わせる）
+    if 7 in windows:
+        wk_cols = [f"{prefix}_7日" for prefix in ROLLING_KPIS]
+        prev = daily[[AD_COL, DATE_COL] + wk_cols].copy()
+        prev[DATE_COL] = prev[DATE_COL] + pd.Timedelta(days=7)
+        merged = daily[[AD_COL, DATE_COL]].merge(prev, on=[AD_COL, DATE_COL], how="left")
+        for col in wk_cols:
+            daily[f"{col}_前週比"] = (safe_divide(daily[col].to_numpy(), merged[col].to_numpy()) - 1) * 100
+
+        # 疲弊指標：ピークからのCTR低下
+        peak = daily.groupby(AD_COL, sort=False)["CTR_7日"].cummax()
+        daily["CTR_7日_ピーク比"] = safe_divide(daily["CTR_7日"], peak, 1.0)
+
+    daily["累計インプレッション"] = grouped["インプレッション"].cumsum()
+    if "リーチ" in daily.columns:
+        daily["累計フリークエンシー"] = safe_divide(daily["累計インプレッション"], grouped["リーチ"].cumsum(), 1.0)
+        daily["累計接触回数"] = (
+            safe_divide(daily["インプレッション"], daily["リーチ"], 1.0).fillna(0)
+            .groupby(daily[AD_COL], sort=False).cumsum()
+        )
+
+    return daily
+
+
+def latest_period_comparison(rolling: pd.DataFrame) -> pd.DataFrame:
+    """compute_rolling_kpis() の結果から各広告の最終配信日の行（直近7日と前週比）を抜き出す"""
+    latest = rolling.sort_values([AD_COL, DATE_COL]).groupby(AD_COL, sort=False).tail(1)
+    cols = [AD_COL, "クリエイティブ短縮名", DATE_COL]
+    cols += [c for c in latest.columns if c.endswith("_7日") or c.endswith("_前週比") or c.endswith("ピーク比")]
+    return latest[[c for c in cols if c in latest.columns]].reset_index(drop=True)
+
+
+def detect_fatigue(
+    rolling: pd.DataFrame,
+    threshold: float = 0.7,
+    min_days: int = 5,
+) -> pd.DataFrame:
+    """
+    クリエイティブ疲弊を検出する
+
+    広告ごとに log(CTR) = a + b × 累計接触回数 をインプレッション加重の最小二乗で当てはめ、
+    累計接触回数1（初回接触）時点のCTRに対する現在のCTRの残存率で判定する。
+    全広告の回帰は np.bincount による加重和から一括で解く。
+
+    Args:
+        rolling: compute_rolling_kpis() の結果
+        threshold: CTR残存率がこれを下回る広告を疲弊とみなす
+        min_days: 判定に必要な最低配信日数
+
+    Returns: 1行 = 1広告 のDataFrame（疲弊フラグ列「疲弊」を含む）
+    """
+    df = rolling[rolling["インプレッション"] > 0]
+    codes, ads = pd.factorize(df[AD_COL], sort=True)
+    n_ads = len(ads)
+
+    imps = df["インプレッション"].to_numpy(dtype=float)
+    x = df["累計接触回数"].to_numpy(dtype=float)
+    # クリック0の日も扱えるよう 0.5 / 1 の補正を入れた対数CTR
+    y = np.log((df["リンクのクリック"].to_numpy(dtype=float) + 0.5) / (imps + 1.0))
+
+    def wsum(v):
+        return np.bincount(codes, weights=imps * v, minlength=n_ads)
+
+    sw, sx, sy, sxx, sxy = wsum(1.0), wsum(x), wsum(y), wsum(x * x), wsum(x * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denom = sw * sxx - sx * sx
+        slope = np.where(denom > 0, (sw * sxy - sx * sy) / denom, 0.0)
+        intercept = (sy - slope * sx) / sw
+
+        # 加重決定係数
+        y_mean = sy / sw
+        resid = y - (intercept[codes] + slope[codes] * x)
+        ss_res = np.bincount(codes, weights=imps * resid ** 2, minlength=n_ads)
+        ss_tot = np.bincount(codes, weights=imps * (y - y_mean[codes]) ** 2, minlength=n_ads)
+        r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+
+    n_days = np.bincount(codes, minlength=n_ads)
+    last = df.groupby(codes).tail(1)
+    freq_now = np.empty(n_ads)
+    freq_now[codes[df.index.get_indexer(last.index)]] = last["累計接触回数"].to_numpy()
+
+    ctr_start = np.exp(intercept + slope) * 100
+    ctr_now = np.exp(intercept + slope * freq_now) * 100
+    retention = np.exp(slope * (freq_now - 1.0))
+    with np.errstate(divide="ignore"):
+        half_life = np.where(slope < 0, 1.0 + np.log(2) / -slope, np.inf)
+
+    result = pd.DataFrame({
+        AD_COL: ads,
+        "配信日数": n_days,
+        "減衰係数": slope,
+        "初回接触CTR推定": ctr_start,
+        "現在CTR推定": ctr_now,
+        "現在累計接触回数": freq_now,
+        "CTR残存率": retention,
+        "CTR半減接触回数": half_life,
+        "決定係数": r2,
+    })
+    result["疲弊"] = (result["配信日数"] >= min_days) & (slope < 0) & (retention < threshold)
+    if "クリエイティブ短縮名" in df.columns:
+        short = df.drop_duplicates(AD_COL).set_index(AD_COL)["クリエイティブ短縮名"]
+        result.insert(1, "クリエイティブ短縮名", result[AD_COL].map(short))
+    return result
@@ -3,8 +3,11 @@ Phase 1: データ前処理・統合
 - Excelパフォーマンスデータの読み込み・クリーニング
 - クリエイティブ属性情報の構造化
 - 統合テーブルの作成と保存
+
+期間を絞る場合: python 01_data_preprocessing.py 2026-01-23 2026-02-06
 """
 
+import sys
 import pandas as pd
 import numpy as np
 import json
@@ -12,6 +15,11 @@ from pathlib import Path
 
 # ── パス設定 ──────────────────────────────────────────
 ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "app"))
+from metrics import aggregate, safe_divide  # noqa: E402
+from date_index import DateRangeIndex  # noqa: E402
+from breakdown import BreakdownRollup, collapse_breakdowns, detect_breakdowns  # noqa: E402
+from reach_engine import estimate_reach_from_frequency  # noqa: E402
 RAW_DIR = ROOT / "data" / "raw"
 OUT_DIR = ROOT / "data" / "processed" / "ad_analysis"
 OUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -29,14 +37,15 @@ df["レポート終了日"] = pd.to_datetime(df["レポート終了日"])
 # 配信停止日（消化金額=0）のフラグ
 df["is_active"] = df["消化金額 (JPY)"] > 0
 
-# 短縮名の付与（分析用）
-name_map = {
-    "体験動画(フロリオ・コーチ)": "フロリオ・コーチ",
-    "体験動画01": "鈴木啓太",
-    "体験動画04(#56_20260106_フロリオサッカースクール#5)": "疑い深い親子",
-    "体験動画05(#57_20260106_フロリオサッカースクール#6)": "純粋無垢な少年",
-}
-df["クリエイティブ短縮名"] = df["広告の名前"].map(name_map)
+# ブレイクダウン（配置・年齢・性別など）付きエクスポートの場合は次元別の合計を保持し、
+# 以降の処理用に 広告 × 日 の1行へ合算する
+breakdowns = detect_breakdowns(df)
+breakdown_rollup = None
+if breakdowns:
+    for col in breakdowns:
+        df[col] = df[col].astype("category")
+    breakdown_rollup = BreakdownRollup(df)
+    df = collapse_breakdowns(df)
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 2. クリエイティブ属性テーブルの構築
@@ -136,6 +145,11 @@ creative_attrs = pd.DataFrame([
     },
 ])
 
+# 短縮名の付与（分析用・属性テーブルの紐付けから引く）
+df["クリエイティブ短縮名"] = df["広告の名前"].map(
+    creative_attrs.set_index("広告の名前")["クリエイティブ短縮名"].to_dict()
+)
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 3. パフォーマンス集計テーブル（アクティブ日のみ）
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -145,45 +159,21 @@ active_df = df[df["is_active"]].copy()
 for col in ["動画の3秒再生数", "動画の25%再生数", "動画の50%再生数",
             "動画の75%再生数", "動画の95%再生数", "動画の100%再生数"]:
     rate_col = col.replace("再生数", "再生率")
-    active_df[rate_col] = active_df[col] / active_df["インプレッション"] * 100
-
-# クリエイティブ別集計
-summary = active_df.groupby("広告の名前").agg(
-    配信日数=("レポート開始日", "nunique"),
-    配信開始日=("レポート開始日", "min"),
-    配信終了日=("レポート開始日", "max"),
-    消化金額合計=("消化金額 (JPY)", "sum"),
-    インプレッション合計=("インプレッション", "sum"),
-    リーチ合計=("リーチ", "sum"),
-    リンククリック合計=("リンクのクリック", "sum"),
-    購入合計=("購入", "sum"),
-    平均CTR=("CTR(リンククリックスルー率)", "mean"),
-    平均CPC=("CPC(リンククリックの単価) (JPY)", "mean"),
-    平均CPM=("CPM(インプレッション単価) (JPY)", "mean"),
-    平均フリークエンシー=("フリークエンシー", "mean"),
-    # 視聴維持（合計ベースで後から率に変換）
-    _3秒再生合計=("動画の3秒再生数", "sum"),
-    _25再生合計=("動画の25%再生数", "sum"),
-    _50再生合計=("動画の50%再生数", "sum"),
-    _75再生合計=("動画の75%再生数", "sum"),
-    _95再生合計=("動画の95%再生数", "sum"),
-    _100再生合計=("動画の100%再生数", "sum"),
-).reset_index()
-
-# 集計ベース指標
-summary["全体CTR"] = summary["リンククリック合計"] / summary["インプレッション合計"] * 100
-summary["全体CPC"] = summary["消化金額合計"] / summary["リンククリック合計"]
-summary["全体CPM"] = summary["消化金額合計"] / summary["インプレッション合計"] * 1000
-summary["CPA"] = summary["消化金額合計"] / summary["購入合計"]
-summary["日次平均消化"] = summary["消化金額合計"] / summary["配信日数"]
-
-# 視聴維持率（集計ベース）
-summary["3秒視聴率"] = summary["_3秒再生合計"] / summary["インプレッション合計"] * 100
-summary["25%視聴率"] = summary["_25再生合計"] / summary["インプレッション合計"] * 100
-summary["50%視聴率"] = summary["_50再生合計"] / summary["インプレッション合計"] * 100
-summary["75%視聴率"] = summary["_75再生合計"] / summary["インプレッション合計"] * 100
-summary["95%視聴率"] = summary["_95再生合計"] / summary["インプレッション合計"] * 100
-summary["100%視聴率"] = summary["_100再生合計"] / summary["インプレッション合計"] * 100
+    active_df[rate_col] = safe_divide(active_df[col], active_df["インプレッション"], 100)
+
+# クリエイティブ別集計（KPIは metrics.KPIS の定義 = 分子合計 / 分母合計）
+if len(sys.argv) == 3:
+    # 分析期間の指定あり（日付インデックスで期間内の行・サマリーを取得）
+    date_index = DateRangeIndex(active_df)
+    active_df = date_index.rows_for_window(sys.argv[1], sys.argv[2])
+    summary = date_index.summary_for_window(sys.argv[1], sys.argv[2])
+    print(f"分析期間: {sys.argv[1]} 〜 {sys.argv[2]}")
+else:
+    summary = aggregate(active_df, "広告の名前")
+
+# 期間ユニークリーチの推定（リーチ合計は日次リーチの単純合計で重複を含む）
+reach = estimate_reach_from_frequency(active_df)
+summary = summary.merge(reach[["広告の名前", "推定リーチ", "推定フリークエンシー"]], on="広告の名前", how="left")
 
 # クリエイティブ属性と結合
 summary = summary.merge(creative_attrs, on="広告の名前", how="left")
@@ -200,11 +190,20 @@ creative_attrs.to_csv(OUT_DIR / "creative_attributes.csv", index=False, encoding
 # クリエイティブ別サマリー（属性付き）
 summary.to_csv(OUT_DIR / "creative_summary.csv", index=False, encoding="utf-8-sig")
 
+# ブレイクダウン別サマリー（広告 × 各ブレイクダウン次元）
+period = (sys.argv[1], sys.argv[2]) if len(sys.argv) == 3 else ()
+for col in breakdowns:
+    breakdown_rollup.kpis(["広告の名前", col], *period).to_csv(
+        OUT_DIR / f"breakdown_{col}_summary.csv", index=False, encoding="utf-8-sig",
+    )
+
 print("=== Phase 1 完了 ===")
 print(f"\n保存先: {OUT_DIR}")
 print(f"  - daily_performance.csv : {len(active_df)} rows")
 print(f"  - creative_attributes.csv : {len(creative_attrs)} rows")
 print(f"  - creative_summary.csv : {len(summary)} rows")
+for col in breakdowns:
+    print(f"  - breakdown_{col}_summary.csv")
 
 # サマリー確認
 print("\n=== クリエイティブ別KPIサマリー ===")
@@ -4,8 +4,12 @@ Phase 2: パフォーマンス基礎分析 + 可視化
 - 日次推移グラフ
 - 動画視聴維持率カーブ
 - コスト効率比較
+
+図は既定で画面用（150dpi パレットPNG）のみ出力。印刷用などが必要な場合は環境変数で指定:
+    FIGURE_TARGETS=screen,print,thumbnail,vector python src/ad_analysis/02_performance_analysis.py
 """
 
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -15,6 +19,10 @@ from pathlib import Path
 
 # ── パス設定 ──────────────────────────────────────────
 ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "app"))
+from figure_output import save_figure  # noqa: E402
+from metrics import format_kpi  # noqa: E402
+from timeseries_engine import compute_rolling_kpis, detect_fatigue  # noqa: E402
 DATA_DIR = ROOT / "data" / "processed" / "ad_analysis"
 FIG_DIR = ROOT / "reports" / "figures" / "ad_creative_analysis"
 TBL_DIR = ROOT / "reports" / "tables"
@@ -24,6 +32,9 @@ TBL_DIR.mkdir(parents=True, exist_ok=True)
 # ── データ読み込み ────────────────────────────────────────
 daily = pd.read_csv(DATA_DIR / "daily_performance.csv", parse_dates=["レポート開始日", "レポート終了日"])
 summary = pd.read_csv(DATA_DIR / "creative_summary.csv")
+# 日次の CTR / CPC / ROAS は件数が少なくノイズが大きいため、推移は7日移動窓の比率（窓内合計の比）で描く
+rolling = compute_rolling_kpis(daily)
+WINDOW = 7
 
 # ── スタイル設定（FigureGuide_v2準拠）─────────────────────
 def setup_style(font_size=14):
@@ -77,8 +88,9 @@ for ax, (col, ylabel, _) in zip(axes.flat, metrics):
         linewidth=0.5,
     )
     for bar, val in zip(bars, summary[col]):
-        fmt = f"{val:.2f}%" if "%" in ylabel or "CTR" in ylabel else f"¥{val:,.0f}" if "円" in ylabel else f"{val:.1f}%"
-        ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() * 1.02,
+        fmt = format_kpi(val, "{:.2f}%") if "%" in ylabel or "CTR" in ylabel else format_kpi(val, "¥{:,.0f}") if "円" in ylabel else format_kpi(val, "{:.1f}%")
+        height = bar.get_height() if np.isfinite(bar.get_height()) else 0
+        ax.text(bar.get_x() + bar.get_width() / 2, height * 1.02,
                 fmt, ha="center", va="bottom", fontsize=11, fontweight="bold")
     ax.set_ylabel(ylabel, fontsize=12)
     ax.set_title(col, fontsize=14, fontweight="bold", pad=10)
@@ -88,8 +100,7 @@ for ax, (col, ylabel, _) in zip(axes.flat, metrics):
 
 fig.suptitle("CORE STEP クリエイティブ別 主要KPI比較", fontsize=18, fontweight="bold", y=1.02)
 plt.tight_layout()
-plt.savefig(FIG_DIR / "01_kpi_comparison.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "01_kpi_comparison")
 print("01_kpi_comparison.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -114,21 +125,24 @@ ax.set_ylim(0, vmax * 1.35)
 ax = axes[1]
 for name, group in daily.groupby("クリエイティブ短縮名"):
     g = group[group["CTR(リンククリックスルー率)"].notna()]
-    if len(g) > 0:
-        ax.plot(g["レポート開始日"], g["CTR(リンククリックスルー率)"],
-                color=COLORS[name], marker=MARKERS[name], label=name,
-                linewidth=2, markersize=6)
+    if len(g) == 0:
+        continue
+    ax.scatter(g["レポート開始日"], g["CTR(リンククリックスルー率)"],
+               color=COLORS[name], marker=MARKERS[name], s=25, alpha=0.35)
+    r = rolling[rolling["クリエイティブ短縮名"] == name]
+    ax.plot(r["レポート開始日"], r[f"CTR_{WINDOW}日"],
+            color=COLORS[name], label=f"{name}（{WINDOW}日移動）", linewidth=2.5)
 ax.set_ylabel("CTR（%）", fontsize=12)
 ax.set_xlabel("日付", fontsize=12)
-ax.set_title("日次 CTR推移", fontsize=14, fontweight="bold", pad=15)
+ax.set_title(f"日次 CTR推移（{WINDOW}日移動CTR = 窓内クリック合計 ÷ 窓内Imp合計、点は日次値）",
+             fontsize=14, fontweight="bold", pad=15)
 ax.legend(fontsize=10, loc="upper right")
 vmax = daily["CTR(リンククリックスルー率)"].dropna().max()
 ax.set_ylim(0, vmax * 1.35 if vmax > 0 else 5)
 
 fig.suptitle("CORE STEP 日次パフォーマンス推移", fontsize=18, fontweight="bold", y=1.02)
 plt.tight_layout()
-plt.savefig(FIG_DIR / "02_daily_trend.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "02_daily_trend")
 print("02_daily_trend.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -162,8 +176,7 @@ vmax = summary[retention_points].max().max()
 ax.set_ylim(0, vmax * 1.35)
 
 plt.tight_layout()
-plt.savefig(FIG_DIR / "03_video_retention_curve.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "03_video_retention_curve")
 print("03_video_retention_curve.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -177,7 +190,7 @@ for _, row in summary.iterrows():
                s=row["消化金額合計"] / 30,  # バブルサイズ
                color=COLORS[name], edgecolors="black", linewidth=0.8,
                alpha=0.8, zorder=5)
-    ax.annotate(f"{name}\n(¥{row['CPA']:,.0f})",
+    ax.annotate(f"{name}\n({format_kpi(row['CPA'], '¥{:,.0f}')})",
                 (row["全体CTR"], row["CPA"]),
                 textcoords="offset points", xytext=(15, 10),
                 fontsize=11, fontweight="bold", color=COLORS[name],
@@ -196,8 +209,7 @@ ax.set_ylim(0, summary["CPA"].max() * 1.35)
 ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, p: f"¥{x:,.0f}"))
 
 plt.tight_layout()
-plt.savefig(FIG_DIR / "04_cost_efficiency_matrix.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "04_cost_efficiency_matrix")
 print("04_cost_efficiency_matrix.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -209,12 +221,16 @@ fig, axes = plt.subplots(2, 1, figsize=(16, 12), sharex=True)
 ax = axes[0]
 for name, group in daily.groupby("クリエイティブ短縮名"):
     g = group[group["CPC(リンククリックの単価) (JPY)"].notna()]
-    if len(g) > 0:
-        ax.plot(g["レポート開始日"], g["CPC(リンククリックの単価) (JPY)"],
-                color=COLORS[name], marker=MARKERS[name], label=name,
-                linewidth=2, markersize=6)
+    if len(g) == 0:
+        continue
+    ax.scatter(g["レポート開始日"], g["CPC(リンククリックの単価) (JPY)"],
+               color=COLORS[name], marker=MARKERS[name], s=25, alpha=0.35)
+    r = rolling[rolling["クリエイティブ短縮名"] == name]
+    ax.plot(r["レポート開始日"], r[f"CPC_{WINDOW}日"],
+            color=COLORS[name], label=f"{name}（{WINDOW}日移動）", linewidth=2.5)
 ax.set_ylabel("CPC（円）", fontsize=12)
-ax.set_title("日次 CPC推移", fontsize=14, fontweight="bold", pad=15)
+ax.set_title(f"日次 CPC推移（{WINDOW}日移動CPC = 窓内消化合計 ÷ 窓内クリック合計、点は日次値）",
+             fontsize=14, fontweight="bold", pad=15)
 ax.legend(fontsize=10, loc="upper right")
 ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, p: f"¥{x:,.0f}"))
 
@@ -222,20 +238,23 @@ ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, p: f"¥{x:,.0f}"))
 ax = axes[1]
 for name, group in daily.groupby("クリエイティブ短縮名"):
     g = group[group["購入ROAS(広告費用対効果)"].notna()]
-    if len(g) > 0:
-        ax.plot(g["レポート開始日"], g["購入ROAS(広告費用対効果)"],
-                color=COLORS[name], marker=MARKERS[name], label=name,
-                linewidth=2, markersize=6)
+    if len(g) == 0:
+        continue
+    ax.scatter(g["レポート開始日"], g["購入ROAS(広告費用対効果)"],
+               color=COLORS[name], marker=MARKERS[name], s=25, alpha=0.35)
+    r = rolling[rolling["クリエイティブ短縮名"] == name]
+    ax.plot(r["レポート開始日"], r[f"ROAS_{WINDOW}日"],
+            color=COLORS[name], label=f"{name}（{WINDOW}日移動）", linewidth=2.5)
 ax.axhline(y=1.0, color="red", linestyle="--", alpha=0.5, label="ROAS=1.0（損益分岐）")
 ax.set_ylabel("ROAS", fontsize=12)
 ax.set_xlabel("日付", fontsize=12)
-ax.set_title("日次 ROAS推移", fontsize=14, fontweight="bold", pad=15)
+ax.set_title(f"日次 ROAS推移（{WINDOW}日移動ROAS = 窓内購入金額合計 ÷ 窓内消化合計、点は日次値）",
+             fontsize=14, fontweight="bold", pad=15)
 ax.legend(fontsize=10, loc="upper right")
 
 fig.suptitle("CORE STEP コスト効率の日次推移", fontsize=18, fontweight="bold", y=1.02)
 plt.tight_layout()
-plt.savefig(FIG_DIR / "05_daily_cpc_roas.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "05_daily_cpc_roas")
 print("05_daily_cpc_roas.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -244,7 +263,7 @@ print("05_daily_cpc_roas.png saved")
 kpi_cols = [
     "クリエイティブ短縮名", "creative_type_ja", "duration_sec", "duration_category",
     "配信日数", "消化金額合計", "インプレッション合計", "リーチ合計",
-    "リンククリック合計", "購入合計", "全体CTR", "全体CPC", "全体CPM",
+    "推定リーチ", "推定フリークエンシー", "リンククリック合計", "購入合計", "全体CTR", "全体CPC", "全体CPM",
     "CPA", "日次平均消化",
     "3秒視聴率", "25%視聴率", "50%視聴率", "75%視聴率", "95%視聴率", "100%視聴率",
     "hook_strength_score", "primary_angle_ja", "hook_technique_ja",
@@ -252,4 +271,17 @@ kpi_cols = [
 summary[kpi_cols].to_csv(TBL_DIR / "01_kpi_summary_table.csv", index=False, encoding="utf-8-sig")
 print("\n01_kpi_summary_table.csv saved")
 
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# クリエイティブ疲弊検出（CTR × 累計接触回数）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+fatigue = detect_fatigue(rolling)
+fatigue.to_csv(TBL_DIR / "03_fatigue_table.csv", index=False, encoding="utf-8-sig")
+print("03_fatigue_table.csv saved")
+
+print("\n=== クリエイティブ疲弊検出 ===")
+for _, row in fatigue.iterrows():
+    status = "⚠ 疲弊" if row["疲弊"] else "OK"
+    print(f"  {row['クリエイティブ短縮名']}: {status} "
+          f"(CTR残存率 {row['CTR残存率']:.0%} / 累計接触回数 {row['現在累計接触回数']:.1f}回)")
+
 print("\n=== Phase 2 完了 ===")
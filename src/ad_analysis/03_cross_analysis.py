@@ -4,6 +4,10 @@ Phase 3-4: クリエイティブ構造×パフォーマンスのクロス分析
 - フック手法・動画構造と視聴維持率の関係
 - 短尺 vs 長尺の効率性比較
 - 勝ちパターン抽出・敗因分析
+- 属性効果の回帰（インプレッション加重・ブートストラップ区間。広告数が少ない場合は推定しない）
+
+図は既定で画面用（150dpi パレットPNG）のみ出力。印刷用などが必要な場合は環境変数で指定:
+    FIGURE_TARGETS=screen,print,thumbnail,vector python src/ad_analysis/03_cross_analysis.py
 """
 
 import pandas as pd
@@ -12,10 +16,17 @@ import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import matplotlib.patches as mpatches
 import seaborn as sns
+import sys
 from pathlib import Path
 
 # ── パス設定 ──────────────────────────────────────────
 ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "app"))
+from figure_output import save_figure  # noqa: E402
+from metrics import format_kpi  # noqa: E402
+from attribute_cube import AttributeCube  # noqa: E402
+from attribute_effects import MIN_ADS, fit_attribute_effects  # noqa: E402
+from analysis_engine import generate_effect_chart  # noqa: E402
 DATA_DIR = ROOT / "data" / "processed" / "ad_analysis"
 FIG_DIR = ROOT / "reports" / "figures" / "ad_creative_analysis"
 TBL_DIR = ROOT / "reports" / "tables"
@@ -24,6 +35,9 @@ TBL_DIR = ROOT / "reports" / "tables"
 summary = pd.read_csv(DATA_DIR / "creative_summary.csv")
 daily = pd.read_csv(DATA_DIR / "daily_performance.csv", parse_dates=["レポート開始日"])
 
+# 属性 × KPI キューブ（属性別の比較はすべてここから引く）
+cube = AttributeCube(summary)
+
 # ── スタイル設定 ──────────────────────────────────────────
 def setup_style(font_size=14):
     sns.set_style("whitegrid")
@@ -126,7 +140,7 @@ for _, row in auth_data.iterrows():
     x_pos = 0 if row["has_authority_figure"] else 1
     ax.scatter(x_pos, row["CPA"],
                s=300, color=COLORS[name], edgecolors="black", linewidth=0.8, zorder=5)
-    ax.annotate(f"{name}\n¥{row['CPA']:,.0f}",
+    ax.annotate(f"{name}\n{format_kpi(row['CPA'], '¥{:,.0f}')}",
                 (x_pos, row["CPA"]),
                 textcoords="offset points", xytext=(15, 5), fontsize=9, color=COLORS[name])
 ax.set_xticks([0, 1])
@@ -139,8 +153,7 @@ ax.set_ylim(0, auth_data["CPA"].max() * 1.35)
 fig.suptitle("クリエイティブ構造 × パフォーマンス 多角的分析",
              fontsize=18, fontweight="bold", y=1.02)
 plt.tight_layout()
-plt.savefig(FIG_DIR / "06_creative_structure_analysis.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "06_creative_structure_analysis")
 print("06_creative_structure_analysis.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -174,7 +187,7 @@ for i, (_, row) in enumerate(summary.iterrows()):
     # 右端にKPI
     total = row["duration_sec"]
     ax.text(total + 1, i,
-            f"CTR={row['全体CTR']:.2f}% | CPA=¥{row['CPA']:,.0f}",
+            f"CTR={format_kpi(row['全体CTR'], '{:.2f}%')} | CPA={format_kpi(row['CPA'], '¥{:,.0f}')}",
             ha="left", va="center", fontsize=10, fontweight="bold")
 
 ax.set_yticks(y_positions)
@@ -189,8 +202,7 @@ ax.legend(handles=patches, loc="upper right", fontsize=10)
 
 ax.invert_yaxis()
 plt.tight_layout()
-plt.savefig(FIG_DIR / "07_video_structure_timeline.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "07_video_structure_timeline")
 print("07_video_structure_timeline.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -198,56 +210,60 @@ print("07_video_structure_timeline.png saved")
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 fig, axes = plt.subplots(1, 2, figsize=(18, 8))
 
-# 長尺グループ（フロリオ + 鈴木）vs 短尺グループ（04 + 05）
-long_form = summary[summary["duration_category"] == "長尺"]
-short_form = summary[summary["duration_category"] == "短尺"]
-
-# 比較指標の正規化（0-100スケール）
+# 比較指標の正規化（0-100スケール）: 指標名 → (サマリー列, キューブ列, 高い方が良いか)
 compare_metrics = {
-    "CTR": ("全体CTR", True),       # 高い方が良い
-    "CPC効率": ("全体CPC", False),   # 低い方が良い
-    "CPA効率": ("CPA", False),       # 低い方が良い
-    "3秒視聴率": ("3秒視聴率", True),
-    "視聴完了率": ("100%視聴率", True),
-    "Hook強度": ("hook_strength_score", True),
+    "CTR": ("全体CTR", "全体CTR", True),
+    "CPC効率": ("全体CPC", "全体CPC", False),
+    "CPA効率": ("CPA", "CPA", False),
+    "3秒視聴率": ("3秒視聴率", "3秒視聴率", True),
+    "視聴完了率": ("100%視聴率", "100%視聴率", True),
+    "Hook強度": ("hook_strength_score", "平均hook_strength_score", True),
 }
 
-# 各クリエイティブの正規化値を計算
-for metric_name, (col, higher_better) in compare_metrics.items():
+
+def normalize(values, col, higher_better):
+    """クリエイティブ別の最小〜最大を0-100に写像する（グループ値も同じ尺度で比較できる）"""
     vmin = summary[col].min()
     vmax = summary[col].max()
     if vmax == vmin:
-        summary[f"norm_{metric_name}"] = 50
-    elif higher_better:
-        summary[f"norm_{metric_name}"] = (summary[col] - vmin) / (vmax - vmin) * 100
-    else:
-        summary[f"norm_{metric_name}"] = (1 - (summary[col] - vmin) / (vmax - vmin)) * 100
+        return values * 0 + 50
+    scaled = (values - vmin) / (vmax - vmin) * 100
+    return scaled if higher_better else 100 - scaled
+
+
+# 各クリエイティブの正規化値を計算
+for metric_name, (col, _, higher_better) in compare_metrics.items():
+    summary[f"norm_{metric_name}"] = normalize(summary[col], col, higher_better)
 
-# 長尺 vs 短尺 棒グラフ比較
 norm_cols = [f"norm_{m}" for m in compare_metrics.keys()]
 metric_labels = list(compare_metrics.keys())
 
-long_avg = summary[summary["duration_category"] == "長尺"][norm_cols].mean()
-short_avg = summary[summary["duration_category"] == "短尺"][norm_cols].mean()
+# 尺カテゴリ別（キューブのロールアップ = 合計比）の正規化値
+by_duration = cube.rollup(["duration_category"])
+duration_range = summary.groupby("duration_category")["duration_sec"].agg(["min", "max"])
+group_colors = ["#3498DB", "#F39C12", "#2ECC71", "#E74C3C"]
 
 # 左: グループ比較
 ax = axes[0]
 x = np.arange(len(metric_labels))
-w = 0.35
-bars1 = ax.bar(x - w/2, long_avg.values, w, label="長尺（48-50秒）", color="#3498DB", edgecolor="black", linewidth=0.5)
-bars2 = ax.bar(x + w/2, short_avg.values, w, label="短尺（12-19秒）", color="#F39C12", edgecolor="black", linewidth=0.5)
-
-for bar, val in zip(bars1, long_avg.values):
-    ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 1, f"{val:.0f}",
-            ha="center", va="bottom", fontsize=9, fontweight="bold")
-for bar, val in zip(bars2, short_avg.values):
-    ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 1, f"{val:.0f}",
-            ha="center", va="bottom", fontsize=9, fontweight="bold")
+w = 0.7 / max(len(by_duration), 1)
+for gi, (_, grow) in enumerate(by_duration.iterrows()):
+    cat = grow["duration_category"]
+    vals = np.array([
+        normalize(grow[cube_col], col, higher_better)
+        for col, cube_col, higher_better in compare_metrics.values()
+    ], dtype=float)
+    label = f"{cat}（{duration_range.loc[cat, 'min']:.0f}-{duration_range.loc[cat, 'max']:.0f}秒）" if cat in duration_range.index else str(cat)
+    bars = ax.bar(x + (gi - (len(by_duration) - 1) / 2) * w, vals, w, label=label,
+                  color=group_colors[gi % len(group_colors)], edgecolor="black", linewidth=0.5)
+    for bar, val in zip(bars, vals):
+        ax.text(bar.get_x() + bar.get_width()/2, np.nan_to_num(bar.get_height()) + 1, format_kpi(val, "{:.0f}"),
+                ha="center", va="bottom", fontsize=9, fontweight="bold")
 
 ax.set_xticks(x)
 ax.set_xticklabels(metric_labels, fontsize=10, rotation=20, ha="right")
 ax.set_ylabel("正規化スコア（0-100）", fontsize=11)
-ax.set_title("長尺 vs 短尺：パフォーマンス比較", fontsize=14, fontweight="bold")
+ax.set_title(" vs ".join(by_duration["duration_category"].astype(str)) + "：パフォーマンス比較（合計比）", fontsize=14, fontweight="bold")
 ax.legend(fontsize=10, loc="upper right")
 ax.set_ylim(0, 120)
 
@@ -269,8 +285,7 @@ ax.set_ylim(0, 120)
 
 fig.suptitle("動画フォーマット別 効率性比較", fontsize=18, fontweight="bold", y=1.02)
 plt.tight_layout()
-plt.savefig(FIG_DIR / "08_format_efficiency_comparison.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "08_format_efficiency_comparison")
 print("08_format_efficiency_comparison.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -310,8 +325,7 @@ ax.legend(fontsize=11, loc="upper right")
 ax.set_ylim(0, 100)
 
 plt.tight_layout()
-plt.savefig(FIG_DIR / "09_dropoff_analysis.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "09_dropoff_analysis")
 print("09_dropoff_analysis.png saved")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -324,23 +338,18 @@ ax.axis("off")
 table_data = []
 headers = [
     "クリエイティブ", "タイプ", "尺", "フック手法",
-    "CTR", "CPC", "CPA", "ROAS日平均",
+    "CTR", "CPC", "CPA", "ROAS",
     "3秒率", "完了率", "Hook強度", "総合評価"
 ]
 
 for _, row in summary.iterrows():
-    # ROAS計算（日次平均）
-    cr_daily = daily[daily["クリエイティブ短縮名"] == row["クリエイティブ短縮名"]]
-    roas_vals = cr_daily["購入ROAS(広告費用対効果)"].dropna()
-    avg_roas = roas_vals.mean() if len(roas_vals) > 0 else 0
-
-    # 総合評価（独自スコアリング）
+    # 総合評価（独自スコアリング。未定義の指標（NaN）は0点）
     score = 0
-    score += min(row["全体CTR"] / 2.5 * 30, 30)  # CTR（最大30点）
-    score += min(max(0, 1 - row["CPA"] / 20000) * 25, 25)  # CPA効率（最大25点）
-    score += min(row["3秒視聴率"] / 45 * 20, 20)  # 3秒視聴率（最大20点）
-    score += min(row["100%視聴率"] / 8 * 15, 15)  # 完了率（最大15点）
-    score += min(row["hook_strength_score"] / 10 * 10, 10)  # フック強度（最大10点）
+    score += np.nan_to_num(min(row["全体CTR"] / 2.5 * 30, 30))  # CTR（最大30点）
+    score += np.nan_to_num(min(max(0, 1 - row["CPA"] / 20000) * 25, 25))  # CPA効率（最大25点）
+    score += np.nan_to_num(min(row["3秒視聴率"] / 45 * 20, 20))  # 3秒視聴率（最大20点）
+    score += np.nan_to_num(min(row["100%視聴率"] / 8 * 15, 15))  # 完了率（最大15点）
+    score += np.nan_to_num(min(row["hook_strength_score"] / 10 * 10, 10))  # フック強度（最大10点）
 
     # 評価ランク
     if score >= 75:
@@ -357,12 +366,12 @@ for _, row in summary.iterrows():
         row["creative_type_ja"],
         f"{int(row['duration_sec'])}秒",
         row["hook_technique_ja"],
-        f"{row['全体CTR']:.2f}%",
-        f"¥{row['全体CPC']:,.0f}",
-        f"¥{row['CPA']:,.0f}",
-        f"{avg_roas:.2f}" if avg_roas > 0 else "N/A",
-        f"{row['3秒視聴率']:.1f}%",
-        f"{row['100%視聴率']:.1f}%",
+        format_kpi(row["全体CTR"], "{:.2f}%"),
+        format_kpi(row["全体CPC"], "¥{:,.0f}"),
+        format_kpi(row["CPA"], "¥{:,.0f}"),
+        format_kpi(row["ROAS"], "{:.2f}"),
+        format_kpi(row["3秒視聴率"], "{:.1f}%"),
+        format_kpi(row["100%視聴率"], "{:.1f}%"),
         f"{row['hook_strength_score']}",
         f"{rank} ({score:.0f}点)",
     ])
@@ -402,10 +411,24 @@ ax.set_title("CORE STEP クリエイティブ 総合スコアカード",
              fontsize=18, fontweight="bold", pad=30)
 
 plt.tight_layout()
-plt.savefig(FIG_DIR / "10_scorecard.png", dpi=300, bbox_inches="tight")
-plt.close()
+save_figure(plt.gcf(), FIG_DIR, "10_scorecard")
 print("10_scorecard.png saved")
 
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 図11: 属性効果（全広告の加重回帰。図6の散布図を他の属性で調整した版）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 広告数が MIN_ADS 未満（同梱データの4本など）では推定しないため、図と表は出力しない
+# （以前の実行で残った図・表は、今回のデータの結果と取り違えないよう削除する）
+effects = fit_attribute_effects(summary)
+if len(effects) > 0:
+    save_figure(generate_effect_chart(effects), FIG_DIR, "11_attribute_effects")
+    print("11_attribute_effects.png saved")
+else:
+    for stale in [*FIG_DIR.glob("11_attribute_effects.*"), *FIG_DIR.glob("*/11_attribute_effects.*"),
+                  TBL_DIR / "05_attribute_effects_table.csv"]:
+        stale.unlink(missing_ok=True)
+    print(f"11_attribute_effects skipped（広告{len(summary)}本 < {MIN_ADS}本のため属性効果は推定しない）")
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # クロス分析テーブル出力
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -420,4 +443,13 @@ cross_cols = [
 summary[cross_cols].to_csv(TBL_DIR / "02_cross_analysis_table.csv", index=False, encoding="utf-8-sig")
 print("\n02_cross_analysis_table.csv saved")
 
+# 属性別ロールアップ（全属性 × 合計比KPI）
+cube.marginals().to_csv(TBL_DIR / "04_attribute_rollup_table.csv", index=False, encoding="utf-8-sig")
+print("04_attribute_rollup_table.csv saved")
+
+# 属性効果（指標 × 特徴の効果とブートストラップ区間。推定していない場合は出力しない）
+if len(effects) > 0:
+    effects.to_csv(TBL_DIR / "05_attribute_effects_table.csv", index=False, encoding="utf-8-sig")
+    print("05_attribute_effects_table.csv saved")
+
 print("\n=== Phase 3-4 完了 ===")
@@ -0,0 +1,194 @@
+"""
+レポート一括生成：複数アカウント × 期間の Claude レポートをキュー（app/report_queue.py）経由で生成する
+- enqueue: マニフェストの各アカウント・期間について KPI サマリーを集計し、プロンプトをキューに永続化
+- run:     未完了のジョブを同時実行数を絞って処理（完了ごとに保存。中断後は再実行で続きから）
+- status / export: 進捗の確認と、完了したレポートの Markdown 書き出し
+
+マニフェスト（JSON。パスはリポジトリ相対）:
+    [
+      {"account": "kids向け",
+       "excel": "data/raw/kids向け動画CR_-_-_2026_01_23-_-2026_02_13.xlsx",
+       "creatives": ["data/creatives/kids/*.json", "data/creatives/kids/*.md"],
+       "periods": [["2026-01-23", "2026-02-06"], ["2026-02-07", "2026-02-13"]]}
+    ]
+    periods は省略するとデータの全期間、"monthly" なら暦月ごと。
+    広告名 ↔ video_id の紐付けは、アプリで確定した紐付け（分析履歴）を優先し、残りは自動提案を使う
+    （1位と2位の候補が近い「要確認」の広告は、アプリで確定するまで紐付けずに一覧を表示する）。
+
+Usage:
+    python src/ad_analysis/batch_reports.py enqueue manifest.json
+    python src/ad_analysis/batch_reports.py run --concurrency 4
+    python src/ad_analysis/batch_reports.py run --base-url http://127.0.0.1:8765   # スタブサーバーで確認
+    python src/ad_analysis/batch_reports.py status
+    python src/ad_analysis/batch_reports.py export --out reports/batch
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "app"))
+from analysis_engine import (  # noqa: E402
+    build_creative_attrs,
+    build_window_summary,
+    parse_creative_jsons,
+    parse_creative_md,
+    prepare_active_df,
+    process_excel,
+)
+from attribute_effects import build_effects_text, fit_attribute_effects  # noqa: E402
+from claude_client import MAX_CONCURRENCY, kpi_token_budget  # noqa: E402
+from creative_mapper import CreativeMatcher  # noqa: E402
+from date_index import DateRangeIndex  # noqa: E402
+from prompt_data import build_kpi_text, estimate_tokens  # noqa: E402
+from report_queue import MAX_ATTEMPTS, ReportQueue, run_queue  # noqa: E402
+from run_store import RunStore  # noqa: E402
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# ジョブの投入
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def load_creatives(patterns: list[str]) -> list[dict]:
+    """JSON / MD のクリエイティブ分析ファイルを読み込む（アプリのアップロードと同じ形式に変換）"""
+    parsed = []
+    for path in sorted({p for pattern in patterns for p in glob.glob(str(ROOT / pattern))}):
+        path = Path(path)
+        if path.suffix == ".md":
+            result = parse_creative_md(path.read_text(encoding="utf-8"), path.name)
+            if not result["ok"]:
+                print(f"  ⚠ {path.name}: JSON検出失敗（スキップ）")
+                continue
+            parsed.append(result["result"])
+        else:
+            parsed.append({"filename": path.name, "content": json.loads(path.read_text(encoding="utf-8"))})
+    return parse_creative_jsons(parsed)
+
+
+def resolve_periods(periods, min_date: pd.Timestamp, max_date: pd.Timestamp) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    if not periods:
+        return [(min_date, max_date)]
+    if periods == "monthly":
+        months = pd.period_range(min_date, max_date, freq="M")
+        return [(max(m.start_time, min_date), min(m.end_time.normalize(), max_date)) for m in months]
+    return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in periods]
+
+
+def enqueue_manifest(manifest_path: Path, queue: ReportQueue) -> list[str]:
+    entries = json.loads(manifest_path.read_text(encoding="utf-8"))
+    store = RunStore()
+    job_keys = []
+    for entry in entries:
+        account = entry["account"]
+        print(f"■ {account}")
+        df = process_excel(ROOT / entry["excel"])
+        creatives = load_creatives(entry.get("creatives", []))
+        ad_names = df["広告の名前"].unique().tolist()
+
+        # 紐付け: 確定済み（分析履歴）を優先し、残りは自動提案（要確認はアプリで確定するまで紐付けない）
+        confirmed = store.load_mappings(account)
+        confirmed_short = confirmed.dropna(subset=["クリエイティブ短縮名"]).set_index("広告の名前")["クリエイティブ短縮名"]
+        proposals = CreativeMatcher(creatives).propose(
+            ad_names, confirmed=dict(zip(confirmed["広告の名前"], confirmed["video_id"])),
+        )
+        accepted = proposals[proposals["根拠"].isin(["確定済み", "自動"])]
+        mapping = dict(zip(accepted["広告の名前"], accepted["video_id"]))
+        short_names = {ad: confirmed_short.get(ad) or ad[:10] for ad in ad_names}
+        review = proposals.loc[proposals["根拠"] == "要確認", "広告の名前"].tolist()
+        print(f"  紐付け {len(mapping)} / {len(ad_names)} 本（確定済み {int((proposals['根拠'] == '確定済み').sum())}"
+              f" / 要確認 {len(review)}）")
+        if review:
+            print("  ⚠ 次の広告は候補が近いため紐付けていません。アプリで確定してください: " + "、".join(review))
+
+        creative_attrs = build_creative_attrs(mapping, short_names, creatives)
+        mapped_ids = set(mapping.values())
+        creatives_for_api = [cr for cr in creatives if cr["video_id"] in mapped_ids]
+        budget = kpi_token_budget(creatives_for_api)
+        date_index = DateRangeIndex(prepare_active_df(df))
+
+        for start, end in resolve_periods(entry.get("periods"), date_index.min_date, date_index.max_date):
+            label = f"{start:%Y-%m-%d}〜{end:%Y-%m-%d}"
+            try:
+                _, summary = build_window_summary(date_index, (start, end), creative_attrs, short_names)
+                effects_text = build_effects_text(fit_attribute_effects(summary, creatives))
+                kpi_text = build_kpi_text(summary, max_tokens=max(budget - estimate_tokens(effects_text), 0)) + effects_text
+                job_keys.append(queue.enqueue(account, (start, end), kpi_text, creatives_for_api))
+            except ValueError as e:
+                print(f"  ⚠ {label}: {e}（スキップ）")
+                continue
+            print(f"  {label}: 広告 {len(summary)} 本 → {job_keys[-1][:12]}")
+    return job_keys
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 実行・確認・書き出し
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def run(queue: ReportQueue, base_url: str | None, concurrency: int, max_attempts: int, retry_errors: bool) -> dict:
+    api_key = os.getenv("ANTHROPIC_API_KEY") or ("dummy" if base_url or os.getenv("ANTHROPIC_BASE_URL") else "")
+    if not api_key:
+        sys.exit("ANTHROPIC_API_KEY が設定されていません（スタブサーバーで確認する場合は --base-url を指定）")
+    if retry_errors:
+        print(f"失敗したジョブを再投入: {queue.retry_errors()} 件")
+    recovered = queue.recover()
+    if recovered:
+        print(f"前回中断したジョブを再開: {recovered} 件")
+    total = len(queue.pending())
+    print(f"未完了のジョブ: {total} 件（同時実行 {concurrency}）")
+    done = 0
+
+    def on_update(job_key: str, status: str) -> None:
+        nonlocal done
+        done += status == "done"
+        job = queue.load(job_key)
+        print(f"  [{done}/{total}] {job['account']} {job['window_start']}〜{job['window_end']}: {status}"
+              + (f"（{job['error']}）" if status != "done" else ""))
+
+    return run_queue(queue, api_key, base_url=base_url, concurrency=concurrency,
+                     max_attempts=max_attempts, on_update=on_update)
+
+
+def export(queue: ReportQueue, out_dir: Path) -> list[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for row in queue.reports().itertuples(index=False):
+        path = out_dir / f"{row.account}_{row.window_start}_{row.window_end}.md"
+        path.write_text(row.report, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数アカウント × 期間の Claude レポートを一括生成する")
+    parser.add_argument("--queue", help="キューの SQLite（省略時は REPORT_QUEUE_PATH または data/report_queue.sqlite3）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_enqueue = sub.add_parser("enqueue", help="マニフェストからジョブを投入する")
+    p_enqueue.add_argument("manifest", type=Path)
+    p_run = sub.add_parser("run", help="未完了のジョブを処理する（中断後は続きから）")
+    p_run.add_argument("--base-url", default=None, help="接続先（省略時は ANTHROPIC_BASE_URL または公式API）")
+    p_run.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY, help="同時に実行するリクエスト数")
+    p_run.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="1ジョブあたりの最大試行回数")
+    p_run.add_argument("--retry-errors", action="store_true", help="失敗したジョブも再実行する")
+    sub.add_parser("status", help="ジョブの状態を表示する")
+    p_export = sub.add_parser("export", help="完了したレポートを Markdown で書き出す")
+    p_export.add_argument("--out", type=Path, default=ROOT / "reports" / "batch")
+    args = parser.parse_args()
+
+    queue = ReportQueue(args.queue)
+    if args.command == "enqueue":
+        keys = enqueue_manifest(args.manifest, queue)
+        print(f"\n投入: {len(keys)} 件 / キュー: {queue.counts()}")
+    elif args.command == "run":
+        counts = run(queue, args.base_url, args.concurrency, args.max_attempts, args.retry_errors)
+        print(f"\n完了: {counts}")
+    elif args.command == "status":
+        status = queue.status()
+        print(status.drop(columns=["job_key"]).to_string(index=False) if len(status) else "ジョブはありません")
+        print(f"\n{queue.counts()}")
+    else:
+        for path in export(queue, args.out):
+            print(f"  {path.relative_to(ROOT) if path.is_relative_to(ROOT) else path}")
@@ -0,0 +1,318 @@
+"""
+分析パイプライン：01〜04 のスクリプトを依存関係（DAG）に沿って実行する
+- 各ステージは 入力 / 出力 を宣言し、依存関係は入出力から自動で決まる
+  （依存する app/ モジュールはスクリプトの import を推移的にたどって求める）
+- スクリプト・モジュール・引数・入力ファイルの内容ハッシュが前回と同じで、出力も前回のままのステージはスキップ
+  （上流が再実行されても出力が同じ内容なら下流はスキップされる）
+- 依存関係の無いステージ（図01〜05 と 図06〜10 など）は別プロセスで並列に実行する
+
+Usage:
+    python src/ad_analysis/run_pipeline.py                      # 変更のあるステージだけ実行
+    python src/ad_analysis/run_pipeline.py --dry-run            # 実行予定の確認のみ
+    python src/ad_analysis/run_pipeline.py performance --force  # 指定ステージ（と上流）を強制実行
+    python src/ad_analysis/run_pipeline.py --period 2026-01-23 2026-02-06 --html-mode external
+"""
+
+import argparse
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "app"))
+from html_export import IMAGE_MODES  # noqa: E402
+SCRIPT_DIR = Path(__file__).resolve().parent
+STATE_PATH = ROOT / ".cache" / "pipeline_state.json"
+
+PROCESSED = "data/processed/ad_analysis"
+FIG = "reports/figures/ad_creative_analysis"
+TBL = "reports/tables"
+
+
+@dataclass
+class Stage:
+    """パイプラインの1ステージ（パスは ROOT 相対。出力は glob 可）"""
+    name: str
+    script: str
+    inputs: list[str]
+    outputs: list[str]
+    env: list[str] = field(default_factory=list)    # 出力に影響する環境変数
+    args: list[str] = field(default_factory=list)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# ステージ定義
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+PERFORMANCE_FIGURES = [
+    "01_kpi_comparison", "02_daily_trend", "03_video_retention_curve",
+    "04_cost_efficiency_matrix", "05_daily_cpc_roas",
+]
+CROSS_FIGURES = [
+    "06_creative_structure_analysis", "07_video_structure_timeline",
+    "08_format_efficiency_comparison", "09_dropoff_analysis", "10_scorecard",
+    "11_attribute_effects",
+]
+
+
+def build_stages(period: list[str] | None = None, html_mode: str | None = None) -> list[Stage]:
+    processed = [f"{PROCESSED}/daily_performance.csv", f"{PROCESSED}/creative_summary.csv"]
+    return [
+        Stage(
+            "preprocess", "01_data_preprocessing.py",
+            inputs=["data/raw/kids向け動画CR_-_-_2026_01_23-_-2026_02_13.xlsx"],
+            outputs=[*processed, f"{PROCESSED}/creative_attributes.csv", f"{PROCESSED}/breakdown_*_summary.csv"],
+            args=list(period or []),
+        ),
+        Stage(
+            "performance", "02_performance_analysis.py",
+            inputs=processed,
+            outputs=[
+                *(f"{FIG}/{stem}.png" for stem in PERFORMANCE_FIGURES),
+                *(f"{FIG}/*/{stem}.*" for stem in PERFORMANCE_FIGURES),
+                f"{TBL}/01_kpi_summary_table.csv", f"{TBL}/03_fatigue_table.csv",
+            ],
+            env=["FIGURE_TARGETS"],
+        ),
+        Stage(
+            "cross", "03_cross_analysis.py",
+            inputs=processed,
+            outputs=[
+                *(f"{FIG}/{stem}.png" for stem in CROSS_FIGURES),
+                *(f"{FIG}/*/{stem}.*" for stem in CROSS_FIGURES),
+                f"{TBL}/02_cross_analysis_table.csv", f"{TBL}/04_attribute_rollup_table.csv",
+                f"{TBL}/05_attribute_effects_table.csv",
+            ],
+            env=["FIGURE_TARGETS"],
+        ),
+        Stage(
+            "export_html", "04_export_html.py",
+            inputs=[
+                "reports/docs/ad_creative_analysis_report.md",
+                *(f"{FIG}/{stem}.png" for stem in PERFORMANCE_FIGURES + CROSS_FIGURES),
+            ],
+            outputs=[
+                "reports/docs/ad_creative_analysis_report.html",
+                "reports/docs/ad_creative_analysis_report_assets/*",
+            ],
+            args=[html_mode] if html_mode else [],
+        ),
+    ]
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# DAG・フィンガープリント
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def build_graph(stages: list[Stage]) -> dict[str, set[str]]:
+    """ステージ名 → 上流ステージ名の集合（入力パスが他ステージの出力パターンに一致したら依存）"""
+    deps = {s.name: set() for s in stages}
+    for stage in stages:
+        for other in stages:
+            if other is stage:
+                continue
+            if any(fnmatch.fnmatch(i, o) for i in stage.inputs for o in other.outputs):
+                deps[stage.name].add(other.name)
+    return deps
+
+
+def topological_order(stages: list[Stage], deps: dict[str, set[str]]) -> list[str]:
+    order, done = [], set()
+    pending = [s.name for s in stages]
+    while pending:
+        ready = [n for n in pending if deps[n] <= done]
+        if not ready:
+            raise ValueError(f"循環依存があります: {', '.join(pending)}")
+        order += ready
+        done |= set(ready)
+        pending = [n for n in pending if n not in done]
+    return order
+
+
+def expand(patterns: list[str]) -> list[Path]:
+    paths = set()
+    for pattern in patterns:
+        paths |= {p for p in ROOT.glob(pattern) if p.is_file()}
+    return sorted(paths)
+
+
+def file_digest(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def app_dependencies(script: Path) -> list[Path]:
+    """スクリプトが（間接的にも）import する app/ のモジュール。一覧を手で管理すると漏れるため import 文からたどる"""
+    found: set[Path] = set()
+    pending = [script]
+    while pending:
+        tree = ast.parse(pending.pop().read_text(encoding="utf-8"))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = ROOT / "app" / f"{name.split('.')[0]}.py"
+                if path.exists() and path not in found:
+                    found.add(path)
+                    pending.append(path)
+    return sorted(found)
+
+
+def fingerprint(stage: Stage) -> str:
+    """スクリプト・依存モジュール・引数・環境変数・入力ファイルの内容から計算する"""
+    h = hashlib.sha256()
+    script = SCRIPT_DIR / stage.script
+    sources = [script, *app_dependencies(script)]
+    for path in sources:
+        h.update(f"{path.name}:{file_digest(path)}\n".encode())
+    h.update(json.dumps(stage.args, ensure_ascii=False).encode())
+    h.update(json.dumps({k: os.getenv(k) for k in stage.env}).encode())
+    for pattern in stage.inputs:
+        matched = expand([pattern])
+        if not matched:
+            h.update(f"{pattern}:missing\n".encode())
+        for path in matched:
+            h.update(f"{path.relative_to(ROOT)}:{file_digest(path)}\n".encode())
+    return h.hexdigest()
+
+
+def output_digests(stage: Stage) -> dict[str, str]:
+    return {str(p.relative_to(ROOT)): file_digest(p) for p in expand(stage.outputs)}
+
+
+def is_up_to_date(stage: Stage, state: dict, fp: str) -> bool:
+    """前回と同じフィンガープリントで、記録した出力が消えたり書き換えられたりしていないか"""
+    previous = state.get(stage.name)
+    if previous is None or previous["fingerprint"] != fp:
+        return False
+    outputs = previous["outputs"]
+    return bool(outputs) and all(
+        (ROOT / path).exists() and file_digest(ROOT / path) == digest for path, digest in outputs.items()
+    )
+
+
+def load_state() -> dict:
+    if STATE_PATH.exists():
+        return json.loads(STATE_PATH.read_text(encoding="utf-8"))
+    return {}
+
+
+def save_state(state: dict) -> None:
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    STATE_PATH.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 実行
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+def run_stage(stage: Stage) -> tuple[int, str, float]:
+    """ステージを別プロセスで実行する（pyplot のグローバル状態を共有しないため）"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, str(SCRIPT_DIR / stage.script), *stage.args],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    return proc.returncode, proc.stdout + proc.stderr, time.perf_counter() - start
+
+
+def select(stages: list[Stage], deps: dict[str, set[str]], targets: list[str]) -> list[Stage]:
+    """指定ステージとその上流だけに絞る"""
+    names = {s.name for s in stages}
+    unknown = [t for t in targets if t not in names]
+    if unknown:
+        sys.exit(f"不明なステージ: {', '.join(unknown)}（{', '.join(names)} から指定）")
+    keep, stack = set(), list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in keep:
+            keep.add(name)
+            stack += deps[name]
+    return [s for s in stages if s.name in keep]
+
+
+def run_pipeline(stages: list[Stage], force: bool = False, jobs: int = 2, dry_run: bool = False) -> bool:
+    deps = build_graph(stages)
+    order = topological_order(stages, deps)
+    by_name = {s.name: s for s in stages}
+    state = load_state()
+    status: dict[str, str] = {}
+
+    if dry_run:
+        for name in order:
+            if any(status[d] != "最新" for d in deps[name]):
+                status[name] = "上流の結果次第"
+            elif not force and is_up_to_date(by_name[name], state, fingerprint(by_name[name])):
+                status[name] = "最新"
+            else:
+                status[name] = "実行予定"
+            upstream = f"（← {', '.join(sorted(deps[name]))}）" if deps[name] else ""
+            print(f"  {name:12s} {status[name]}{upstream}")
+        return True
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while len(status) < len(order):
+            for name in order:
+                if name in status or name in running.values() or not deps[name] <= set(status):
+                    continue
+                if any(status[d] in ("失敗", "中止") for d in deps[name]):
+                    status[name] = "中止"
+                    print(f"[{name}] 上流が失敗したため中止")
+                    continue
+                # 上流が終わった時点の入力でフィンガープリントを取る
+                stage = by_name[name]
+                fp = fingerprint(stage)
+                if not force and is_up_to_date(stage, state, fp):
+                    status[name] = "スキップ"
+                    print(f"[{name}] 変更なし → スキップ")
+                    continue
+                print(f"[{name}] 実行開始")
+                running[pool.submit(run_stage, stage)] = name
+                state[name] = {"fingerprint": fp, "outputs": {}}
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                returncode, log, elapsed = future.result()
+                if returncode == 0:
+                    status[name] = "実行"
+                    state[name]["outputs"] = output_digests(by_name[name])
+                    print(f"[{name}] 完了（{elapsed:.1f}秒）")
+                else:
+                    status[name] = "失敗"
+                    state.pop(name, None)
+                    print(f"[{name}] 失敗（終了コード {returncode}）\n{log}")
+                save_state(state)
+
+    print("\n=== パイプライン結果 ===")
+    for name in order:
+        print(f"  {name:12s} {status[name]}")
+    return all(s in ("実行", "スキップ") for s in status.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分析パイプライン（01〜04）を依存関係に沿って実行する")
+    parser.add_argument("stages", nargs="*", help="実行するステージ（省略時は全て。上流も含めて実行）")
+    parser.add_argument("--force", action="store_true", help="変更が無くても再実行する")
+    parser.add_argument("--dry-run", action="store_true", help="実行せずに各ステージの状態を表示する")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="同時に実行するステージ数")
+    parser.add_argument("--period", nargs=2, metavar=("START", "END"), help="前処理の集計期間")
+    parser.add_argument("--html-mode", choices=IMAGE_MODES, help="HTMLの画像モード")
+    args = parser.parse_args()
+
+    stages = build_stages(args.period, args.html_mode)
+    if args.stages:
+        stages = select(stages, build_graph(stages), args.stages)
+    ok = run_pipeline(stages, force=args.force, jobs=args.jobs, dry_run=args.dry_run)
+    sys.exit(0 if ok else 1)
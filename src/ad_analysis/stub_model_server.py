@@ -0,0 +1,180 @@
+"""
+スタブモデルサーバー：Claude Messages API（POST /v1/messages）互換の応答を返すローカルサーバー
+APIキー無し・課金無しで、レポート生成キュー（batch_reports.py）や app の AI 分析を通しで確認する。
+遅延・過負荷エラー（529）を混ぜて、再試行・中断からの再開の挙動も確認できる。
+ツールの呼び出しを強制するリクエスト（構造化出力モード）には、KPI表の行から作った tool_use を返す。
+
+Usage:
+    python src/ad_analysis/stub_model_server.py                           # http://127.0.0.1:8765
+    python src/ad_analysis/stub_model_server.py --latency 2 --error-rate 0.2 --log .cache/stub_requests.jsonl
+    python src/ad_analysis/stub_model_server.py --invalid-rate 0.5   # スキーマ違反の構造化出力を混ぜる
+
+    # 別のターミナルで
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=dummy streamlit run app/app.py
+    python src/ad_analysis/batch_reports.py run --base-url http://127.0.0.1:8765
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    """応答設定と受信ログ（ハンドラのスレッド間で共有）"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, invalid_rate: float = 0.0,
+                 seed: int | None = None, log_path: str | None = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.random = random.Random(seed)
+        self.log_path = log_path
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def log(self, record: dict) -> None:
+        if not self.log_path:
+            return
+        with self.lock, open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _kpi_rows(prompt: str) -> list[str]:
+    """プロンプトの KPI 表のクリエイティブ名（表の順）"""
+    return re.findall(r"^\| (.+?) \| \d+日 \|", prompt, flags=re.MULTILINE)
+
+
+def stub_report(prompt: str) -> str:
+    """プロンプトの内容から決まる固定のレポート（同じ入力には同じ応答を返す）"""
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    creatives = sorted(set(re.findall(r'"video_id":\s*"([^"]+)"', prompt)))
+    return (
+        "# スタブレポート\n\n"
+        "※ スタブモデルサーバーの応答です（分析内容はありません）。\n\n"
+        f"- プロンプト: {len(prompt):,} 文字（sha256 {digest}）\n"
+        f"- KPI表の行数: {len(_kpi_rows(prompt))}\n"
+        f"- クリエイティブ: {', '.join(creatives) or 'なし'}\n"
+    )
+
+
+def stub_structured(prompt: str, valid: bool = True) -> dict:
+    """submit_analysis_report ツールの入力（KPI表の順をそのまま順位にする。valid=False ならスキーマ違反）"""
+    names = _kpi_rows(prompt) or ["（KPI表なし）"]
+    data = {
+        "markdown": stub_report(prompt),
+        "rankings": [
+            {"rank": i, "creative": name, "score": max(0, 100 - 10 * (i - 1)), "strength": "スタブ", "weakness": "スタブ"}
+            for i, name in enumerate(names, start=1)
+        ],
+        "findings": [
+            {"creative": name, "section": "performance", "finding": "スタブの所見", "evidence": "スタブ"}
+            for name in names
+        ],
+        "recommendations": [
+            {"priority": "High", "action": "スタブのアクション", "target": "全体",
+             "expected_effect": "スタブ", "difficulty": "Low"},
+        ],
+        "hypotheses": [
+            {"hypothesis": "スタブの仮説", "test_method": "A/Bテスト", "expected_effect": "スタブ", "required_assets": ""},
+        ],
+    }
+    if not valid:
+        del data["rankings"]
+    return data
+
+
+def make_handler(state: StubState) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):  # noqa: A002  標準エラーへのアクセスログは出さない
+            pass
+
+        def _send(self, status: int, body: dict, headers: dict | None = None) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/v1/messages":
+                self._send(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt = "".join(
+                m["content"] if isinstance(m["content"], str) else "".join(b.get("text", "") for b in m["content"])
+                for m in request.get("messages", [])
+            )
+            request_no = next(state.counter)
+            time.sleep(state.latency)
+
+            with state.lock:
+                fail = state.random.random() < state.error_rate
+            record = {"no": request_no, "sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+                      "status": 529 if fail else 200, "at": time.time()}
+            state.log(record)
+            if fail:
+                self._send(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+                           headers={"retry-after": "0"})
+                return
+
+            tool_choice = request.get("tool_choice") or {}
+            if tool_choice.get("type") == "tool":
+                with state.lock:
+                    valid = state.random.random() >= state.invalid_rate
+                tool_input = stub_structured(prompt, valid)
+                content = [{"type": "tool_use", "id": f"toolu_stub_{request_no:06d}",
+                            "name": tool_choice["name"], "input": tool_input}]
+                stop_reason, output_chars = "tool_use", len(json.dumps(tool_input, ensure_ascii=False))
+            else:
+                text = stub_report(prompt)
+                content = [{"type": "text", "text": text}]
+                stop_reason, output_chars = "end_turn", len(text)
+            self._send(200, {
+                "id": f"msg_stub_{request_no:06d}",
+                "type": "message",
+                "role": "assistant",
+                "model": request.get("model", "stub"),
+                "content": content,
+                "stop_reason": stop_reason,
+                "stop_sequence": None,
+                "usage": {"input_tokens": len(prompt), "output_tokens": output_chars},
+            })
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, **state_kwargs) -> ThreadingHTTPServer:
+    """スタブサーバーを生成する（serve_forever() で起動。port=0 なら空きポート）"""
+    return ThreadingHTTPServer((host, port), make_handler(StubState(**state_kwargs)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Claude Messages API 互換のスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの応答遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="529 Overloaded を返す割合（0〜1）")
+    parser.add_argument("--invalid-rate", type=float, default=0.0,
+                        help="構造化出力でスキーマ違反（rankings 欠落）を返す割合（0〜1）")
+    parser.add_argument("--seed", type=int, help="エラーを混ぜる乱数のシード")
+    parser.add_argument("--log", help="受信したリクエストを JSON Lines で追記するファイル")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                   invalid_rate=args.invalid_rate, seed=args.seed, log_path=args.log)
+    print(f"スタブモデルサーバー: http://{args.host}:{server.server_port}（Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()